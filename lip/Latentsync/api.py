@@ -12,6 +12,8 @@ import os
 import uuid
 import time
 import asyncio
+import httpx
+import aiofiles
 from datetime import datetime
 from pathlib import Path
 
@@ -53,36 +55,84 @@ os.makedirs(SHARED_DIR, exist_ok=True)
 # ComfyUI 클라이언트
 client = ComfyUIClient(COMFYUI_URL)
 
+# 워크플로우 템플릿 (시작 시 한 번만 로드, 파일 존재 확인도 이때 한 번만)
+WORKFLOW_TEMPLATE: Optional[dict] = None
+
+# ComfyUI 동시 실행 수 제한 (GPU VRAM 경쟁으로 처리량이 떨어지지 않도록, 대기는 이벤트 루프에서)
+COMFY_CONCURRENCY = int(os.getenv("COMFY_CONCURRENCY", "2"))
+COMFY_SEM = asyncio.Semaphore(COMFY_CONCURRENCY)
+
 # 파일 자동 삭제 설정
 FILE_MAX_AGE_HOURS = 2
 
+# 업로드 스트리밍 청크 크기 (1MB)
+UPLOAD_CHUNK_SIZE = 1 << 20
+
 
 # ============================================
 # 유틸리티 함수
 # ============================================
 def cleanup_old_files(directory: str, max_age_hours: int = FILE_MAX_AGE_HOURS):
-    """오래된 파일 삭제"""
-    now = time.time()
+    """오래된 파일 삭제 (scandir의 캐시된 stat 사용)"""
+    cutoff = time.time() - max_age_hours * 3600
     deleted_count = 0
-    for file in Path(directory).glob("*"):
-        if file.is_file():
-            age_hours = (now - file.stat().st_mtime) / 3600
-            if age_hours > max_age_hours:
+    with os.scandir(directory) as it:
+        for entry in it:
+            if entry.is_file(follow_symlinks=False) and entry.stat().st_mtime < cutoff:
                 try:
-                    file.unlink()
+                    os.unlink(entry.path)
                     deleted_count += 1
-                except Exception as e:
-                    print(f"파일 삭제 실패 {file}: {e}")
+                except OSError as e:
+                    print(f"파일 삭제 실패 {entry.path}: {e}")
     if deleted_count > 0:
         print(f"[Cleanup] {directory}: {deleted_count}개 오래된 파일 삭제됨")
 
 
+def write_file_atomic(path: str, data: bytes):
+    """임시 파일에 쓴 뒤 이름을 바꿔 저장 (실패해도 깨진 파일이 남지 않음)"""
+    tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.part"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def get_workflow() -> dict:
+    """워크플로우 템플릿 반환 (update_lipsync_workflow가 복사본을 만들므로 그대로 사용)"""
+    if WORKFLOW_TEMPLATE is None:
+        raise HTTPException(status_code=500, detail="워크플로우 파일이 없습니다")
+    return WORKFLOW_TEMPLATE
+
+
 async def periodic_cleanup():
     """주기적으로 오래된 파일 삭제"""
     while True:
         await asyncio.sleep(1800)  # 30분
-        cleanup_old_files(OUTPUT_DIR)
-        cleanup_old_files(UPLOAD_DIR)
+        await asyncio.to_thread(cleanup_old_files, OUTPUT_DIR)
+        await asyncio.to_thread(cleanup_old_files, UPLOAD_DIR)
+
+
+async def save_upload(upload: UploadFile, path: str) -> int:
+    """업로드 파일을 청크 단위로 디스크에 스트리밍 저장하고 저장한 바이트 수 반환"""
+    size = 0
+    async with aiofiles.open(path, "wb") as f:
+        while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+            await f.write(chunk)
+            size += len(chunk)
+    return size
+
+
+async def save_and_upload(upload: UploadFile, filename: str, file_type: str):
+    """업로드 파일을 UPLOAD_DIR에 저장한 뒤 ComfyUI에 같은 이름으로 업로드"""
+    path = os.path.join(UPLOAD_DIR, filename)
+    await save_upload(upload, path)
+    await client.upload_file(path, filename, file_type=file_type)
 
 
 # ============================================
@@ -141,13 +191,14 @@ class HealthResponse(BaseModel):
 @app.on_event("startup")
 async def startup_event():
     """서버 시작 시 초기화"""
+    global WORKFLOW_TEMPLATE
     print(f"LatentSync 립싱크 API 시작...")
     print(f"ComfyUI URL: {COMFYUI_URL}")
     print(f"Workflow Path: {WORKFLOW_PATH}")
     
     # 오래된 파일 정리
-    cleanup_old_files(OUTPUT_DIR)
-    cleanup_old_files(UPLOAD_DIR)
+    await asyncio.to_thread(cleanup_old_files, OUTPUT_DIR)
+    await asyncio.to_thread(cleanup_old_files, UPLOAD_DIR)
     
     # 백그라운드 정리 태스크
     asyncio.create_task(periodic_cleanup())
@@ -155,11 +206,18 @@ async def startup_event():
     
     # 워크플로우 파일 확인
     if os.path.exists(WORKFLOW_PATH):
+        WORKFLOW_TEMPLATE = client.load_workflow(WORKFLOW_PATH)
         print(f"워크플로우 파일 확인됨: {WORKFLOW_PATH}")
     else:
         print(f"경고: 워크플로우 파일이 없습니다: {WORKFLOW_PATH}")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """서버 종료 시 ComfyUI HTTP 연결 정리"""
+    await client.aclose()
+
+
 # ============================================
 # API 엔드포인트
 # ============================================
@@ -186,11 +244,9 @@ async def health_check():
     """헬스 체크"""
     comfyui_ok = False
     try:
-        import httpx
-        async with httpx.AsyncClient(timeout=5.0) as http_client:
-            response = await http_client.get(f"{COMFYUI_URL}/system_stats")
-            comfyui_ok = response.status_code == 200
-    except:
+        response = await client.http.get("/system_stats", timeout=5.0)
+        comfyui_ok = response.status_code == 200
+    except (httpx.HTTPError, asyncio.TimeoutError):
         pass
     
     return HealthResponse(
@@ -288,28 +344,19 @@ async def generate_lipsync_form(
     
     try:
         # 워크플로우 로드
-        if not os.path.exists(WORKFLOW_PATH):
-            raise HTTPException(status_code=500, detail="워크플로우 파일이 없습니다")
-        
-        workflow = client.load_workflow(WORKFLOW_PATH)
+        workflow = get_workflow()
         
         unique_id = str(uuid.uuid4())[:8]
         
-        # 비디오 저장 및 업로드
+        # 비디오/오디오 저장 및 업로드 (서로 독립적이므로 동시에 진행)
         video_ext = os.path.splitext(video.filename)[1] or ".mp4"
         video_filename = f"lipsync_video_{unique_id}{video_ext}"
-        video_path = os.path.join(UPLOAD_DIR, video_filename)
-        with open(video_path, "wb") as f:
-            f.write(await video.read())
-        await client.upload_file(video_path, video_filename, file_type="video")
-        
-        # 오디오 저장 및 업로드
         audio_ext = os.path.splitext(audio.filename)[1] or ".mp3"
         audio_filename = f"lipsync_audio_{unique_id}{audio_ext}"
-        audio_path = os.path.join(UPLOAD_DIR, audio_filename)
-        with open(audio_path, "wb") as f:
-            f.write(await audio.read())
-        await client.upload_file(audio_path, audio_filename, file_type="audio")
+        await asyncio.gather(
+            save_and_upload(video, video_filename, "video"),
+            save_and_upload(audio, audio_filename, "audio")
+        )
         
         # 워크플로우 업데이트
         workflow = client.update_lipsync_workflow(
@@ -323,7 +370,8 @@ async def generate_lipsync_form(
         )
         
         # 실행
-        result = await client.execute_workflow(workflow, timeout=1800)
+        async with COMFY_SEM:
+            result = await client.execute_workflow(workflow, timeout=1800)
         
         # 결과 비디오 가져오기
         outputs = result.get("outputs", {})
@@ -351,8 +399,8 @@ async def generate_lipsync_form(
         output_filename = f"lipsync_{timestamp}_{unique_id}.mp4"
         output_path = os.path.join(OUTPUT_DIR, output_filename)
         
-        with open(output_path, "wb") as f:
-            f.write(vid_bytes)
+        # 디스크 쓰기는 스레드에서 (이벤트 루프를 막지 않음)
+        await asyncio.to_thread(write_file_atomic, output_path, vid_bytes)
         
         processing_time = time.time() - start_time
         
@@ -381,10 +429,7 @@ async def generate_lipsync_json(request: LipSyncRequest):
     
     try:
         # 워크플로우 로드
-        if not os.path.exists(WORKFLOW_PATH):
-            raise HTTPException(status_code=500, detail="워크플로우 파일이 없습니다")
-        
-        workflow = client.load_workflow(WORKFLOW_PATH)
+        workflow = get_workflow()
         
         # 워크플로우 업데이트
         workflow = client.update_lipsync_workflow(
@@ -398,7 +443,8 @@ async def generate_lipsync_json(request: LipSyncRequest):
         )
         
         # 실행
-        result = await client.execute_workflow(workflow, timeout=1800)
+        async with COMFY_SEM:
+            result = await client.execute_workflow(workflow, timeout=1800)
         
         # 결과 처리
         outputs = result.get("outputs", {})
@@ -425,8 +471,8 @@ async def generate_lipsync_json(request: LipSyncRequest):
         output_filename = f"lipsync_{timestamp}_{unique_id}.mp4"
         output_path = os.path.join(OUTPUT_DIR, output_filename)
         
-        with open(output_path, "wb") as f:
-            f.write(vid_bytes)
+        # 디스크 쓰기는 스레드에서 (이벤트 루프를 막지 않음)
+        await asyncio.to_thread(write_file_atomic, output_path, vid_bytes)
         
         processing_time = time.time() - start_time
         
@@ -524,10 +570,7 @@ async def session_generate_lipsync(request: SessionLipSyncRequest):
             raise HTTPException(status_code=404, detail=f"오디오 파일을 찾을 수 없습니다: {request.audio_filename}")
         
         # 워크플로우 로드
-        if not os.path.exists(WORKFLOW_PATH):
-            raise HTTPException(status_code=500, detail="워크플로우 파일이 없습니다")
-        
-        workflow = client.load_workflow(WORKFLOW_PATH)
+        workflow = get_workflow()
         
         unique_id = str(uuid.uuid4())[:8]
         
@@ -535,8 +578,10 @@ async def session_generate_lipsync(request: SessionLipSyncRequest):
         comfy_video_name = f"session_{request.session_id}_{request.video_filename}"
         comfy_audio_name = f"session_{request.session_id}_{request.audio_filename}"
         
-        await client.upload_file(video_path, comfy_video_name, file_type="video")
-        await client.upload_file(audio_path, comfy_audio_name, file_type="audio")
+        await asyncio.gather(
+            client.upload_file(video_path, comfy_video_name, file_type="video"),
+            client.upload_file(audio_path, comfy_audio_name, file_type="audio")
+        )
         
         # 워크플로우 업데이트
         workflow = client.update_lipsync_workflow(
@@ -550,7 +595,8 @@ async def session_generate_lipsync(request: SessionLipSyncRequest):
         )
         
         # 실행
-        result = await client.execute_workflow(workflow, timeout=1800)
+        async with COMFY_SEM:
+            result = await client.execute_workflow(workflow, timeout=1800)
         
         # 결과 비디오 가져오기
         outputs = result.get("outputs", {})
@@ -577,8 +623,8 @@ async def session_generate_lipsync(request: SessionLipSyncRequest):
             output_filename += ".mp4"
         output_path = os.path.join(session_dir, output_filename)
         
-        with open(output_path, "wb") as f:
-            f.write(vid_bytes)
+        # 디스크 쓰기는 스레드에서 (이벤트 루프를 막지 않음)
+        await asyncio.to_thread(write_file_atomic, output_path, vid_bytes)
         
         processing_time = time.time() - start_time
         
@@ -17,6 +17,24 @@ class ComfyUIClient:
     def __init__(self, server_url: str = "http://localhost:8188"):
         self.server_url = server_url.rstrip("/")
         self.client_id = str(uuid.uuid4())
+        self._http: Optional[httpx.AsyncClient] = None
+    
+    @property
+    def http(self) -> httpx.AsyncClient:
+        """keep-alive 연결을 재사용하는 공유 HTTP 클라이언트 (처음 사용할 때 생성)"""
+        if self._http is None or self._http.is_closed:
+            self._http = httpx.AsyncClient(
+                base_url=self.server_url,
+                timeout=httpx.Timeout(30.0, connect=5.0),
+                limits=httpx.Limits(max_keepalive_connections=8)
+            )
+        return self._http
+    
+    async def aclose(self):
+        """공유 HTTP 클라이언트 종료"""
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
     
     async def upload_file(
         self, 
@@ -36,25 +54,24 @@ class ComfyUIClient:
             mime_type = "video/mp4"
             upload_type = "input"
         
-        async with httpx.AsyncClient() as client:
-            with open(file_path, "rb") as f:
-                files = {"image": (filename, f, mime_type)}  # ComfyUI는 'image' 필드 사용
-                data = {"overwrite": "true", "type": upload_type}
-                
-                response = await client.post(
-                    f"{self.server_url}/upload/image",
-                    files=files,
-                    data=data
-                )
-                
-                if response.status_code != 200:
-                    print(f"[Upload Error] Status: {response.status_code}")
-                    print(f"[Upload Error] Response: {response.text}")
-                    raise Exception(f"ComfyUI 파일 업로드 실패: {response.text}")
-                
-                result = response.json()
-                print(f"[Upload Success] {filename} -> {result}")
-                return result.get("name", filename)
+        with open(file_path, "rb") as f:
+            files = {"image": (filename, f, mime_type)}  # ComfyUI는 'image' 필드 사용
+            data = {"overwrite": "true", "type": upload_type}
+            
+            response = await self.http.post(
+                "/upload/image",
+                files=files,
+                data=data
+            )
+            
+            if response.status_code != 200:
+                print(f"[Upload Error] Status: {response.status_code}")
+                print(f"[Upload Error] Response: {response.text}")
+                raise Exception(f"ComfyUI 파일 업로드 실패: {response.text}")
+            
+            result = response.json()
+            print(f"[Upload Success] {filename} -> {result}")
+            return result.get("name", filename)
     
     async def queue_prompt(self, workflow: Dict[str, Any]) -> str:
         """워크플로우를 큐에 추가하고 prompt_id 반환"""
@@ -63,35 +80,28 @@ class ComfyUIClient:
             "client_id": self.client_id
         }
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{self.server_url}/prompt",
-                json=payload
-            )
-            
-            if response.status_code != 200:
-                print(f"[ComfyUI Error] Status: {response.status_code}")
-                print(f"[ComfyUI Error] Response: {response.text}")
-                try:
-                    error_json = response.json()
-                    if "error" in error_json:
-                        raise Exception(f"ComfyUI 에러: {error_json['error']}")
-                except json.JSONDecodeError:
-                    raise Exception(f"ComfyUI 응답 에러: {response.text}")
-            
-            result = response.json()
-            prompt_id = result["prompt_id"]
-            print(f"[ComfyUI] Prompt queued: {prompt_id}")
-            return prompt_id
+        response = await self.http.post("/prompt", json=payload)
+        
+        if response.status_code != 200:
+            print(f"[ComfyUI Error] Status: {response.status_code}")
+            print(f"[ComfyUI Error] Response: {response.text}")
+            try:
+                error_json = response.json()
+                if "error" in error_json:
+                    raise Exception(f"ComfyUI 에러: {error_json['error']}")
+            except json.JSONDecodeError:
+                raise Exception(f"ComfyUI 응답 에러: {response.text}")
+        
+        result = response.json()
+        prompt_id = result["prompt_id"]
+        print(f"[ComfyUI] Prompt queued: {prompt_id}")
+        return prompt_id
     
     async def get_history(self, prompt_id: str) -> Dict[str, Any]:
         """실행 히스토리 조회"""
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.server_url}/history/{prompt_id}"
-            )
-            response.raise_for_status()
-            return response.json()
+        response = await self.http.get(f"/history/{prompt_id}")
+        response.raise_for_status()
+        return response.json()
     
     async def get_video(self, filename: str, subfolder: str = "", folder_type: str = "output") -> bytes:
         """생성된 비디오 다운로드"""
@@ -101,13 +111,9 @@ class ComfyUIClient:
             "type": folder_type
         }
         
-        async with httpx.AsyncClient(timeout=300.0) as client:
-            response = await client.get(
-                f"{self.server_url}/view",
-                params=params
-            )
-            response.raise_for_status()
-            return response.content
+        response = await self.http.get("/view", params=params, timeout=300.0)
+        response.raise_for_status()
+        return response.content
     
     async def wait_for_completion(self, prompt_id: str, timeout: int = 1800) -> Dict[str, Any]:
         """WebSocket으로 완료 대기"""
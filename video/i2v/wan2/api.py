@@ -3,16 +3,21 @@ Wan2.1 Image-to-Video API
 ComfyUI를 통한 이미지 → 영상 생성 API
 """
 
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
-from fastapi.responses import FileResponse, Response
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Request
+from fastapi.responses import FileResponse, Response, ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
-from typing import Optional, List
+from typing import Optional, List, Tuple, Dict
 import os
-import uuid
 import time
 import asyncio
+import httpx
 import shutil
+import tempfile
+import orjson
+import aiofiles
+from collections import deque
+from secrets import token_hex
 from datetime import datetime
 from pathlib import Path
 
@@ -22,7 +27,8 @@ from comfyui_client import ComfyUIClient
 app = FastAPI(
     title="Wan2 Image-to-Video API",
     description="ComfyUI 기반 이미지 → 비디오 생성 API (Wan2.1 14B)",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # CORS 설정
@@ -43,32 +49,154 @@ UPLOAD_DIR = "uploads"
 OUTPUT_DIR = "outputs"
 WORKFLOW_DIR = "workflows"
 SHARED_DIR = "shared"
+# 병합용 임시 폴더 (OUTPUT_DIR 밖에 두어 출력 목록 캐시를 무효화하지 않음, 하드링크를 위해 같은 파일시스템)
+STAGING_DIR = "staging"
 
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 os.makedirs(WORKFLOW_DIR, exist_ok=True)
 os.makedirs(SHARED_DIR, exist_ok=True)
+os.makedirs(STAGING_DIR, exist_ok=True)
+
+UPLOAD_PATH = Path(UPLOAD_DIR)
+OUTPUT_PATH = Path(OUTPUT_DIR)
+
+# ComfyUI input/ 폴더가 이 컨테이너에 마운트된 경로 (공유 볼륨 배포용, 선택)
+# 설정하면 업로드 이미지를 HTTP로 다시 보내지 않고 하드링크(다른 파일시스템이면 복사)로 넘김
+COMFY_INPUT_DIR = os.getenv("COMFY_INPUT_DIR", "")
 
 # ComfyUI 클라이언트
 client = ComfyUIClient(COMFYUI_URL)
 
+# 워크플로우 템플릿 (시작 시 한 번만 로드)
+BASE_WORKFLOW: Optional[dict] = None
+
+# 워크플로우에 남아 있으면 안 되는 노드 (MathExpression, PreviewImage 등)
+PROBLEM_NODES = ('194', '195', '202', '230', '231', '81', '82', '83', '113')
+
+
+def get_workflow() -> dict:
+    """워크플로우 템플릿 반환
+    
+    client.update_* / randomize_seed는 바뀌는 노드만 복사한 새 dict를 돌려주므로
+    템플릿을 직접 수정하지 말 것
+    """
+    if BASE_WORKFLOW is None:
+        raise HTTPException(status_code=500, detail="워크플로우 파일이 없습니다")
+    return BASE_WORKFLOW
+
+
+# ComfyUI 동시 실행 수 제한 (GPU VRAM 경쟁으로 처리량이 떨어지지 않도록, 대기는 이벤트 루프에서)
+COMFY_CONCURRENCY = int(os.getenv("COMFY_CONCURRENCY", "2"))
+COMFY_SEM = asyncio.Semaphore(COMFY_CONCURRENCY)
+
 # 파일 자동 삭제 설정
 FILE_MAX_AGE_HOURS = 1
 
+# 업로드 스트리밍 청크 크기 (1MB)
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+
+def link_into_comfy_input(path, name: str):
+    """저장된 파일을 ComfyUI input 폴더에 하드링크 (다른 파일시스템이면 sendfile 기반 복사)"""
+    dest = os.path.join(COMFY_INPUT_DIR, name)
+    # 임시 이름으로 연결한 뒤 원자적으로 교체 (input이 비는 순간이 없고, 같은 이름 동시 호출도 안전)
+    tmp = f"{dest}.{token_hex(4)}.tmp"
+    try:
+        try:
+            os.link(path, tmp)
+        except OSError:
+            shutil.copyfile(path, tmp)
+        os.replace(tmp, dest)
+    finally:
+        # 실패했거나, dest가 이미 같은 inode라 rename이 아무것도 하지 않은 경우 임시 링크 정리
+        try:
+            os.unlink(tmp)
+        except FileNotFoundError:
+            pass
+
+
+async def push_to_comfy(path, name: str) -> str:
+    """디스크에 저장된 이미지를 ComfyUI에서 name으로 쓸 수 있게 함"""
+    if COMFY_INPUT_DIR:
+        await asyncio.to_thread(link_into_comfy_input, path, name)
+        return name
+    return await client.upload_image(path, name)
+
+
+# 응답 후 백그라운드로 진행 중인 ComfyUI 업로드: (저장 경로, ComfyUI 파일명) -> task
+# (끝나기 전에 GC되지 않도록 참조 유지, 같은 파일을 바로 쓰는 요청은 이 task를 기다림)
+_background_pushes: Dict[Tuple[str, str], asyncio.Task] = {}
+
+
+async def _safe_push_to_comfy(path, name: str) -> bool:
+    """push_to_comfy의 백그라운드 버전 (실패는 로그만 남기고 사용 시점에 다시 올림)"""
+    try:
+        await push_to_comfy(path, name)
+        return True
+    except Exception as e:
+        print(f"ComfyUI 업로드 실패 (나중에 재시도): {e}")
+        return False
+
+
+def push_to_comfy_background(path, name: str):
+    """응답을 기다리게 하지 않고 ComfyUI 업로드 시작"""
+    key = (str(path), name)
+    task = asyncio.create_task(_safe_push_to_comfy(path, name))
+    _background_pushes[key] = task
+    
+    def _forget(done: asyncio.Task):
+        if _background_pushes.get(key) is done:
+            del _background_pushes[key]
+    
+    task.add_done_callback(_forget)
+
+
+async def ensure_pushed(path, name: str):
+    """ComfyUI에서 name을 쓸 수 있게 함 - 같은 파일의 백그라운드 업로드가 진행 중이면
+    두 번째 업로드를 시작하지 않고 그 결과를 기다리고, 실패했을 때만 다시 올림"""
+    task = _background_pushes.get((str(path), name))
+    # shield: 이 요청이 취소되어도 백그라운드 업로드는 계속 진행
+    if task is not None and await asyncio.shield(task):
+        return
+    await push_to_comfy(path, name)
+
+
+async def save_upload(upload: UploadFile, path) -> int:
+    """업로드 파일을 청크 단위로 디스크에 스트리밍 저장하고 저장한 바이트 수 반환
+    
+    임시 파일에 쓴 뒤 교체하므로 항상 새 inode가 됨 - 같은 이름으로 다시 올려도
+    ComfyUI input에 하드링크된 이전 파일을 덮어쓰지 않음
+    """
+    part_path = f"{path}.{token_hex(4)}.part"
+    size = 0
+    try:
+        async with aiofiles.open(part_path, "wb") as f:
+            while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+                await f.write(chunk)
+                size += len(chunk)
+        os.replace(part_path, path)
+    except BaseException:
+        try:
+            os.unlink(part_path)
+        except FileNotFoundError:
+            pass
+        raise
+    return size
+
 
 def cleanup_old_files(directory: str, max_age_hours: int = FILE_MAX_AGE_HOURS):
-    """오래된 파일 삭제"""
-    now = time.time()
+    """오래된 파일 삭제 (scandir의 캐시된 stat 사용)"""
+    cutoff = time.time() - max_age_hours * 3600
     deleted_count = 0
-    for file in Path(directory).glob("*"):
-        if file.is_file():
-            age_hours = (now - file.stat().st_mtime) / 3600
-            if age_hours > max_age_hours:
+    with os.scandir(directory) as it:
+        for entry in it:
+            if entry.is_file(follow_symlinks=False) and entry.stat().st_mtime < cutoff:
                 try:
-                    file.unlink()
+                    os.unlink(entry.path)
                     deleted_count += 1
-                except Exception as e:
-                    print(f"파일 삭제 실패 {file}: {e}")
+                except OSError as e:
+                    print(f"파일 삭제 실패 {entry.path}: {e}")
     if deleted_count > 0:
         print(f"[Cleanup] {directory}: {deleted_count}개 오래된 파일 삭제됨")
 
@@ -77,8 +205,8 @@ async def periodic_cleanup():
     """주기적으로 오래된 파일 삭제"""
     while True:
         await asyncio.sleep(1800)  # 30분
-        cleanup_old_files(OUTPUT_DIR)
-        cleanup_old_files(UPLOAD_DIR)
+        await asyncio.to_thread(cleanup_old_files, OUTPUT_DIR)
+        await asyncio.to_thread(cleanup_old_files, UPLOAD_DIR)
 
 
 class I2VRequest(BaseModel):
@@ -127,25 +255,42 @@ class UploadResponse(BaseModel):
 @app.on_event("startup")
 async def startup_event():
     """서버 시작 시 초기화"""
+    global BASE_WORKFLOW
     print(f"Wan2 Image-to-Video API 시작...")
     print(f"ComfyUI URL: {COMFYUI_URL}")
     print(f"Workflow Path: {WORKFLOW_PATH}")
     
     # 오래된 파일 정리
-    cleanup_old_files(OUTPUT_DIR)
-    cleanup_old_files(UPLOAD_DIR)
+    await asyncio.to_thread(cleanup_old_files, OUTPUT_DIR)
+    await asyncio.to_thread(cleanup_old_files, UPLOAD_DIR)
     
     # 백그라운드 정리 태스크
     asyncio.create_task(periodic_cleanup())
     print(f"[Cleanup] 자동 파일 정리 활성화 ({FILE_MAX_AGE_HOURS}시간 이상 파일 삭제)")
     
-    # 워크플로우 파일 확인
+    # 워크플로우 파일 로드
     if os.path.exists(WORKFLOW_PATH):
-        print(f"워크플로우 파일 확인됨: {WORKFLOW_PATH}")
+        with open(WORKFLOW_PATH, "rb") as f:
+            BASE_WORKFLOW = orjson.loads(f.read())
+        print(f"워크플로우 파일 로드됨: {WORKFLOW_PATH} ({len(BASE_WORKFLOW)}개 노드)")
+        
+        # 문제가 되는 노드 확인 (워크플로우는 요청마다 바뀌지 않으므로 시작 시 한 번만)
+        found_problems = [n for n in PROBLEM_NODES if n in BASE_WORKFLOW]
+        if found_problems:
+            print(f"[WARNING] 문제 노드 발견! {found_problems}")
+            print(f"[WARNING] Docker 재빌드가 필요합니다!")
+        else:
+            print(f"[Workflow] OK - 불필요한 노드 없음 (MathExpression, PreviewImage 등 제거됨)")
     else:
         print(f"경고: 워크플로우 파일이 없습니다: {WORKFLOW_PATH}")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """서버 종료 시 공유 HTTP 연결 정리"""
+    await client.aclose()
+
+
 @app.get("/")
 async def root():
     """API 루트"""
@@ -169,11 +314,9 @@ async def health_check():
     # ComfyUI 연결 확인
     comfyui_ok = False
     try:
-        import httpx
-        async with httpx.AsyncClient(timeout=5.0) as http_client:
-            response = await http_client.get(f"{COMFYUI_URL}/system_stats")
-            comfyui_ok = response.status_code == 200
-    except:
+        response = await client.http.get(f"{COMFYUI_URL}/system_stats", timeout=5.0)
+        comfyui_ok = response.status_code == 200
+    except (httpx.HTTPError, asyncio.TimeoutError):
         pass
     
     return {
@@ -191,19 +334,17 @@ async def upload_image(
     """이미지 업로드"""
     try:
         # 고유 파일명 생성
-        ext = os.path.splitext(image.filename)[1] or ".png"
-        unique_id = str(uuid.uuid4())[:8]
+        ext = Path(image.filename).suffix or ".png"
+        unique_id = token_hex(4)
         filename = f"upload_{unique_id}{ext}"
-        filepath = os.path.join(UPLOAD_DIR, filename)
+        filepath = UPLOAD_PATH / filename
         
-        # 파일 저장
-        with open(filepath, "wb") as f:
-            content = await image.read()
-            f.write(content)
+        # 파일 저장 (청크 단위 스트리밍)
+        await save_upload(image, filepath)
         
         # ComfyUI에도 업로드
         try:
-            comfy_filename = await client.upload_image(filepath, filename)
+            comfy_filename = await push_to_comfy(filepath, filename)
         except Exception as e:
             print(f"ComfyUI 업로드 실패 (나중에 재시도): {e}")
             comfy_filename = filename
@@ -247,35 +388,17 @@ async def generate_video_form(
     
     try:
         # 워크플로우 로드
-        if not os.path.exists(WORKFLOW_PATH):
-            raise HTTPException(status_code=500, detail="워크플로우 파일이 없습니다")
-        
-        workflow = client.load_workflow(WORKFLOW_PATH)
-        
-        # 워크플로우 노드 확인 (디버깅)
-        node_ids = list(workflow.keys())
-        print(f"[Workflow] 로드된 노드 수: {len(node_ids)}")
-        print(f"[Workflow] 노드 목록: {node_ids}")
-        
-        # 문제가 되는 노드 확인
-        problem_nodes = ['194', '195', '202', '230', '231', '81', '82', '83', '113']
-        found_problems = [n for n in problem_nodes if n in node_ids]
-        if found_problems:
-            print(f"[WARNING] 문제 노드 발견! {found_problems}")
-            print(f"[WARNING] Docker 재빌드가 필요합니다!")
-        else:
-            print(f"[Workflow] OK - 불필요한 노드 없음 (MathExpression, PreviewImage 등 제거됨)")
+        workflow = get_workflow()
         
         # 이미지 저장 및 업로드
-        unique_id = str(uuid.uuid4())[:8]
+        unique_id = token_hex(4)
         
-        ext = os.path.splitext(image.filename)[1] or ".png"
+        ext = Path(image.filename).suffix or ".png"
         image_filename = f"i2v_{unique_id}{ext}"
-        image_path = os.path.join(UPLOAD_DIR, image_filename)
-        with open(image_path, "wb") as f:
-            f.write(await image.read())
+        image_path = UPLOAD_PATH / image_filename
+        await save_upload(image, image_path)
         
-        await client.upload_image(image_path, image_filename)
+        await push_to_comfy(image_path, image_filename)
         
         # 워크플로우 업데이트
         workflow = client.update_i2v_workflow(
@@ -291,7 +414,8 @@ async def generate_video_form(
         workflow = client.randomize_seed(workflow)  # seed 랜덤화
         
         # 실행 (영상 생성은 오래 걸림 - 타임아웃 30분)
-        result = await client.execute_workflow(workflow, timeout=1800)
+        async with COMFY_SEM:
+            result = await client.execute_workflow(workflow, timeout=1800)
         
         # 디버깅: 전체 결과 출력
         print(f"[Debug] Full result keys: {result.keys()}")
@@ -332,14 +456,9 @@ async def generate_video_form(
         
         # 첫 번째 출력 비디오 저장
         vid_info = output_videos[0]
-        vid_bytes = await client.get_video(
-            vid_info["filename"],
-            vid_info.get("subfolder", ""),
-            vid_info.get("type", "output")
-        )
         
         # 로컬에 저장 (프로젝트별 폴더 구조)
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        timestamp = time.strftime("%Y%m%d_%H%M%S")
         
         if project_id:
             # 프로젝트 폴더 생성
@@ -358,11 +477,15 @@ async def generate_video_form(
         else:
             # 프로젝트 ID 없으면 기존 방식
             output_filename = f"i2v_{timestamp}_{unique_id}.mp4"
-            output_path = os.path.join(OUTPUT_DIR, output_filename)
+            output_path = OUTPUT_PATH / output_filename
             relative_filename = output_filename
         
-        with open(output_path, "wb") as f:
-            f.write(vid_bytes)
+        await client.download_video(
+            vid_info["filename"],
+            output_path,
+            vid_info.get("subfolder", ""),
+            vid_info.get("type", "output")
+        )
         
         processing_time = time.time() - start_time
         
@@ -394,10 +517,7 @@ async def generate_video_json(request: I2VRequest):
     
     try:
         # 워크플로우 로드
-        if not os.path.exists(WORKFLOW_PATH):
-            raise HTTPException(status_code=500, detail="워크플로우 파일이 없습니다")
-        
-        workflow = client.load_workflow(WORKFLOW_PATH)
+        workflow = get_workflow()
         
         # 워크플로우 업데이트
         workflow = client.update_i2v_workflow(
@@ -413,7 +533,8 @@ async def generate_video_json(request: I2VRequest):
         workflow = client.randomize_seed(workflow)  # seed 랜덤화
         
         # 실행
-        result = await client.execute_workflow(workflow, timeout=1800)
+        async with COMFY_SEM:
+            result = await client.execute_workflow(workflow, timeout=1800)
         
         # 결과 처리
         outputs = result.get("outputs", {})
@@ -429,14 +550,9 @@ async def generate_video_json(request: I2VRequest):
         
         # 비디오 저장 (프로젝트별 폴더 구조)
         vid_info = output_videos[0]
-        vid_bytes = await client.get_video(
-            vid_info["filename"],
-            vid_info.get("subfolder", ""),
-            vid_info.get("type", "output")
-        )
         
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        unique_id = str(uuid.uuid4())[:8]
+        timestamp = time.strftime("%Y%m%d_%H%M%S")
+        unique_id = token_hex(4)
         
         if request.project_id:
             # 프로젝트 폴더 생성
@@ -453,11 +569,15 @@ async def generate_video_json(request: I2VRequest):
             relative_filename = f"proj_{request.project_id}/{output_filename}"
         else:
             output_filename = f"i2v_{timestamp}_{unique_id}.mp4"
-            output_path = os.path.join(OUTPUT_DIR, output_filename)
+            output_path = OUTPUT_PATH / output_filename
             relative_filename = output_filename
         
-        with open(output_path, "wb") as f:
-            f.write(vid_bytes)
+        await client.download_video(
+            vid_info["filename"],
+            output_path,
+            vid_info.get("subfolder", ""),
+            vid_info.get("type", "output")
+        )
         
         processing_time = time.time() - start_time
         
@@ -481,7 +601,7 @@ async def generate_video_json(request: I2VRequest):
 
 
 @app.get("/output/{filename:path}")
-async def get_output(filename: str):
+async def get_output(filename: str, request: Request):
     """
     결과 영상 다운로드
     
@@ -489,16 +609,31 @@ async def get_output(filename: str):
     """
     filepath = os.path.join(OUTPUT_DIR, filename)
     
-    if not os.path.exists(filepath):
+    try:
+        stat_result = os.stat(filepath)
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail="파일을 찾을 수 없습니다")
     
+    # 변경되지 않은 파일이면 본문 없이 304 응답 (탐색/재생 시 재전송 방지)
+    etag = f'"{stat_result.st_size:x}-{int(stat_result.st_mtime):x}"'
+    cache_headers = {
+        "ETag": etag,
+        "Cache-Control": "public, max-age=3600",
+        "Accept-Ranges": "bytes"
+    }
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=cache_headers)
+    
     # 파일명만 추출 (다운로드용)
     download_name = os.path.basename(filename)
     
+    # stat 결과를 넘겨 FileResponse의 중복 stat 생략
     return FileResponse(
         filepath,
         media_type="video/mp4",
-        filename=download_name
+        filename=download_name,
+        stat_result=stat_result,
+        headers=cache_headers
     )
 
 
@@ -515,7 +650,7 @@ async def delete_output(filename: str):
 
 
 @app.get("/outputs")
-async def list_outputs():
+def list_outputs():
     """결과 영상 목록 (전체)"""
     files = []
     for f in Path(OUTPUT_DIR).glob("*"):
@@ -531,7 +666,7 @@ async def list_outputs():
 
 
 @app.get("/projects")
-async def list_projects():
+def list_projects():
     """프로젝트 목록 조회"""
     projects = []
     for d in Path(OUTPUT_DIR).glob("proj_*"):
@@ -558,7 +693,7 @@ async def list_projects():
 
 
 @app.get("/project/{project_id}/videos")
-async def list_project_videos(project_id: str):
+def list_project_videos(project_id: str):
     """특정 프로젝트의 영상 목록 (시퀀스 순서대로)"""
     project_dir = os.path.join(OUTPUT_DIR, f"proj_{project_id}")
     
@@ -613,6 +748,142 @@ class MergeResponse(BaseModel):
     message: str
 
 
+def scan_files(directory: str) -> dict:
+    """디렉토리의 파일 목록을 한 번에 읽어 {파일명: 경로} 반환"""
+    with os.scandir(directory) as it:
+        return {entry.name: entry.path for entry in it if entry.is_file()}
+
+
+def list_mp4s(directory: str) -> List[Tuple[str, float]]:
+    """디렉토리의 mp4 파일을 한 번에 읽어 (파일명, 생성 시간) 목록 반환"""
+    with os.scandir(directory) as it:
+        return [
+            (entry.name, entry.stat().st_ctime)
+            for entry in it
+            if entry.name.endswith(".mp4") and entry.is_file()
+        ]
+
+
+# OUTPUT_DIR 영상 인덱스: 디렉토리 mtime이 그대로면 재스캔하지 않음
+_output_index_mtime_ns: Optional[int] = None
+_output_index: List[Tuple[float, str]] = []
+
+
+def get_output_video_index() -> List[Tuple[float, str]]:
+    """OUTPUT_DIR의 병합 대상 영상 (생성 시간, 파일명) 목록을 생성 시간 순으로 반환"""
+    global _output_index_mtime_ns, _output_index
+    # 파일 추가/삭제/이름 변경 시 디렉토리 mtime이 바뀜
+    mtime_ns = os.stat(OUTPUT_DIR).st_mtime_ns
+    if mtime_ns != _output_index_mtime_ns:
+        _output_index = sorted(
+            (ctime, name)
+            for name, ctime in list_mp4s(OUTPUT_DIR)
+            if name[:7] != "merged_"
+        )
+        _output_index_mtime_ns = mtime_ns
+    return _output_index
+
+
+# ffprobe 결과 캐시: (경로, mtime_ns, 크기) -> probe 결과
+PROBE_CACHE_MAX = 1024
+_probe_cache: dict = {}
+
+
+async def probe_video(path: str) -> dict:
+    """ffprobe로 영상 정보 조회 (변경되지 않은 파일은 캐시 사용)"""
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+    cached = _probe_cache.get(key)
+    if cached is not None:
+        return cached
+    
+    proc = await asyncio.create_subprocess_exec(
+        "ffprobe", "-v", "error",
+        "-print_format", "json",
+        "-show_entries", "format=duration:stream=codec_name,width,height",
+        path,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL
+    )
+    stdout, _ = await proc.communicate()
+    if proc.returncode != 0:
+        return {}
+    
+    try:
+        info = orjson.loads(stdout or b"{}")
+    except orjson.JSONDecodeError:
+        return {}
+    
+    if len(_probe_cache) >= PROBE_CACHE_MAX:
+        # 가장 오래된 항목 제거
+        _probe_cache.pop(next(iter(_probe_cache)))
+    _probe_cache[key] = info
+    return info
+
+
+async def get_video_duration(path: str) -> float:
+    """영상 길이(초) 조회"""
+    info = await probe_video(path)
+    try:
+        return float(info.get("format", {}).get("duration", 0))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+# FFmpeg 오류 보고용으로 보관할 stderr 줄 수
+FFMPEG_STDERR_TAIL = 200
+
+# FFmpeg 동시 실행 수 제한 (CPU 과점유 방지)
+FFMPEG_MAX_CONCURRENT = int(os.getenv("FFMPEG_MAX_CONCURRENT", str(max(1, (os.cpu_count() or 4) // 4))))
+FFMPEG_SEM = asyncio.Semaphore(FFMPEG_MAX_CONCURRENT)
+# 재인코딩 시 인스턴스당 인코더 스레드 수
+FFMPEG_THREADS = str(max(1, (os.cpu_count() or 4) // FFMPEG_MAX_CONCURRENT))
+
+
+async def run_ffmpeg(cmd: List[str], cwd: Optional[str] = None) -> Tuple[int, str]:
+    """FFmpeg 실행 (stderr는 줄 단위로 읽고 마지막 부분만 보관, 동시 실행 수 제한)"""
+    async with FFMPEG_SEM:
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+            cwd=cwd,
+            limit=1024 * 1024
+        )
+        tail = deque(maxlen=FFMPEG_STDERR_TAIL)
+        async for line in proc.stderr:
+            tail.append(line.decode("utf-8", errors="replace").rstrip())
+        returncode = await proc.wait()
+    return returncode, "\n".join(tail)
+
+
+# 스테이징 폴더 안의 concat 목록 파일명
+CONCAT_LIST_NAME = "concat.txt"
+
+
+def stage_concat_inputs(video_paths: List[str]) -> str:
+    """
+    합칠 영상을 임시 폴더에 하드링크로 배치하고 concat 목록 작성
+    
+    목록에는 00000.mp4 같은 단순 파일명만 들어가므로 -safe 1로 실행할 수 있고
+    파일명에 작은따옴표가 있어도 안전합니다. 스테이징 폴더 경로를 반환합니다.
+    """
+    staging_dir = tempfile.mkdtemp(prefix="concat_", dir=STAGING_DIR)
+    lines = []
+    for i, vpath in enumerate(video_paths):
+        name = f"{i:05d}.mp4"
+        link_path = os.path.join(staging_dir, name)
+        try:
+            os.link(vpath, link_path)
+        except OSError:
+            # 다른 파일시스템이면 심볼릭 링크로 대체
+            os.symlink(os.path.abspath(vpath), link_path)
+        lines.append(f"file '{name}'\n")
+    with open(os.path.join(staging_dir, CONCAT_LIST_NAME), "w") as f:
+        f.writelines(lines)
+    return staging_dir
+
+
 @app.post("/merge", response_model=MergeResponse)
 async def merge_videos(request: MergeRequest):
     """
@@ -626,40 +897,44 @@ async def merge_videos(request: MergeRequest):
     }
     ```
     """
-    import subprocess
-    
     if len(request.video_files) < 2:
         raise HTTPException(status_code=400, detail="최소 2개 이상의 영상이 필요합니다")
     
-    # 파일 존재 확인
+    # 파일 존재 확인 (디렉토리를 한 번만 읽어 이름 -> 경로 맵 구성)
+    existing = await asyncio.to_thread(scan_files, OUTPUT_DIR)
     video_paths = []
     for filename in request.video_files:
-        filepath = os.path.join(OUTPUT_DIR, filename)
-        if not os.path.exists(filepath):
+        filepath = existing.get(filename)
+        if filepath is None and os.sep in filename:
+            # 프로젝트 하위 경로 (예: proj_abc/scene_001.mp4)
+            candidate = os.path.join(OUTPUT_DIR, filename)
+            if await asyncio.to_thread(os.path.isfile, candidate):
+                filepath = candidate
+        if filepath is None:
             raise HTTPException(status_code=404, detail=f"파일을 찾을 수 없습니다: {filename}")
         video_paths.append(filepath)
     
     # 출력 파일명 생성
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    timestamp = time.strftime("%Y%m%d_%H%M%S")
     output_filename = request.output_filename or f"merged_{timestamp}.mp4"
     if not output_filename.endswith(".mp4"):
         output_filename += ".mp4"
-    output_path = os.path.join(OUTPUT_DIR, output_filename)
+    # FFmpeg는 스테이징 폴더에서 실행되므로 절대 경로 사용
+    output_path = os.path.abspath(os.path.join(OUTPUT_DIR, output_filename))
+    
+    # 입력 영상을 하드링크로 스테이징하고 concat 목록 작성
+    staging_dir = await asyncio.to_thread(stage_concat_inputs, video_paths)
     
-    # FFmpeg concat 리스트 파일 생성
-    concat_list_path = os.path.join(OUTPUT_DIR, f"concat_{timestamp}.txt")
     try:
-        with open(concat_list_path, "w") as f:
-            for vpath in video_paths:
-                # FFmpeg concat demuxer 형식
-                f.write(f"file '{os.path.abspath(vpath)}'\n")
-        
         # FFmpeg로 영상 합치기
         cmd = [
             "ffmpeg", "-y",
+            "-loglevel", "error", "-nostats",
+            "-seekable", "0",
+            "-thread_queue_size", "1024",
             "-f", "concat",
-            "-safe", "0",
-            "-i", concat_list_path,
+            "-safe", "1",
+            "-i", CONCAT_LIST_NAME,
             "-c", "copy",  # 재인코딩 없이 빠르게 합치기
             output_path
         ]
@@ -667,37 +942,34 @@ async def merge_videos(request: MergeRequest):
         print(f"[Merge] 영상 합치기 시작: {len(video_paths)}개 영상")
         print(f"[Merge] 명령: {' '.join(cmd)}")
         
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        returncode, stderr = await run_ffmpeg(cmd, cwd=staging_dir)
         
-        if result.returncode != 0:
+        if returncode != 0:
             # 코덱이 다른 경우 재인코딩으로 재시도
             print(f"[Merge] copy 실패, 재인코딩 시도...")
             cmd = [
                 "ffmpeg", "-y",
+                "-loglevel", "error", "-nostats",
+                "-seekable", "0",
+                "-thread_queue_size", "1024",
                 "-f", "concat",
-                "-safe", "0",
-                "-i", concat_list_path,
+                "-safe", "1",
+                "-i", CONCAT_LIST_NAME,
                 "-c:v", "libx264",
                 "-preset", "fast",
                 "-crf", "23",
+                "-threads", FFMPEG_THREADS,
                 "-c:a", "aac",
                 "-b:a", "128k",
                 output_path
             ]
-            result = subprocess.run(cmd, capture_output=True, text=True)
+            returncode, stderr = await run_ffmpeg(cmd, cwd=staging_dir)
             
-            if result.returncode != 0:
-                raise Exception(f"FFmpeg 오류: {result.stderr}")
+            if returncode != 0:
+                raise Exception(f"FFmpeg 오류: {stderr}")
         
         # 결과 영상 정보 가져오기
-        probe_cmd = [
-            "ffprobe", "-v", "error",
-            "-show_entries", "format=duration",
-            "-of", "default=noprint_wrappers=1:nokey=1",
-            output_path
-        ]
-        duration_result = subprocess.run(probe_cmd, capture_output=True, text=True)
-        total_duration = float(duration_result.stdout.strip()) if duration_result.returncode == 0 else 0
+        total_duration = await get_video_duration(output_path)
         
         print(f"[Merge] 완료! 출력: {output_filename}, 길이: {total_duration:.2f}초")
         
@@ -708,11 +980,10 @@ async def merge_videos(request: MergeRequest):
             video_count=len(video_paths),
             message=f"{len(video_paths)}개 영상을 합쳐서 {total_duration:.1f}초 영상 생성 완료"
         )
-        
+    
     finally:
-        # 임시 파일 삭제
-        if os.path.exists(concat_list_path):
-            os.remove(concat_list_path)
+        # 스테이징 폴더 삭제 (원본 영상은 하드링크라 영향 없음)
+        await asyncio.to_thread(shutil.rmtree, staging_dir, ignore_errors=True)
 
 
 @app.post("/merge/all", response_model=MergeResponse)
@@ -722,21 +993,13 @@ async def merge_all_videos(output_filename: Optional[str] = None):
     
     사용 예: 생성된 5초 영상 8개를 순서대로 합쳐서 40초 영상 만들기
     """
-    # outputs 폴더의 모든 mp4 파일 가져오기
-    video_files = []
-    for f in Path(OUTPUT_DIR).glob("*.mp4"):
-        if f.is_file() and not f.name.startswith("merged_"):
-            video_files.append({
-                "filename": f.name,
-                "created": f.stat().st_ctime
-            })
+    # outputs 폴더의 모든 mp4 파일 (병합 결과물 제외, 생성 시간 순, 변경 없으면 캐시 사용)
+    video_index = await asyncio.to_thread(get_output_video_index)
     
-    if len(video_files) < 2:
-        raise HTTPException(status_code=400, detail=f"합칠 영상이 부족합니다 (현재: {len(video_files)}개)")
+    if len(video_index) < 2:
+        raise HTTPException(status_code=400, detail=f"합칠 영상이 부족합니다 (현재: {len(video_index)}개)")
     
-    # 생성 시간 순 정렬
-    video_files.sort(key=lambda x: x["created"])
-    filenames = [v["filename"] for v in video_files]
+    filenames = [name for _, name in video_index]
     
     print(f"[Merge All] 합칠 영상 목록 ({len(filenames)}개):")
     for i, name in enumerate(filenames, 1):
@@ -760,8 +1023,6 @@ async def merge_project_videos(project_id: str, output_filename: Optional[str] =
     2. POST /merge/project/story123 호출
     3. 결과: proj_story123/final.mp4 (40초 영상)
     """
-    import subprocess
-    
     project_dir = os.path.join(OUTPUT_DIR, f"proj_{project_id}")
     
     if not os.path.exists(project_dir):
@@ -769,19 +1030,18 @@ async def merge_project_videos(project_id: str, output_filename: Optional[str] =
     
     # 프로젝트 폴더의 모든 scene 영상 가져오기
     video_files = []
-    for f in Path(project_dir).glob("scene_*.mp4"):
-        if f.is_file():
+    for filename, _ in await asyncio.to_thread(list_mp4s, project_dir):
+        if filename[:6] == "scene_":
             # scene_001.mp4 형식에서 시퀀스 번호 추출
-            name = f.stem
             seq = 999999
             try:
-                seq = int(name.split("_")[1])
+                seq = int(filename[:-4].split("_")[1])
             except:
                 pass
             
             video_files.append({
-                "path": str(f),
-                "filename": f.name,
+                "path": os.path.join(project_dir, filename),
+                "filename": filename,
                 "sequence": seq
             })
     
@@ -802,57 +1062,53 @@ async def merge_project_videos(project_id: str, output_filename: Optional[str] =
     final_filename = output_filename or "final.mp4"
     if not final_filename.endswith(".mp4"):
         final_filename += ".mp4"
-    output_path = os.path.join(project_dir, final_filename)
+    # FFmpeg는 스테이징 폴더에서 실행되므로 절대 경로 사용
+    output_path = os.path.abspath(os.path.join(project_dir, final_filename))
     
-    # FFmpeg concat 리스트 파일 생성
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    concat_list_path = os.path.join(project_dir, f"concat_{timestamp}.txt")
+    # 입력 영상을 하드링크로 스테이징하고 concat 목록 작성
+    staging_dir = await asyncio.to_thread(stage_concat_inputs, [v["path"] for v in video_files])
     
     try:
-        with open(concat_list_path, "w") as f:
-            for v in video_files:
-                f.write(f"file '{v['filename']}'\n")  # 파일명만 작성!
-        
-        # FFmpeg로 영상 합치기 (프로젝트 폴더 내 상대경로)
+        # FFmpeg로 영상 합치기
         cmd = [
             "ffmpeg", "-y",
+            "-loglevel", "error", "-nostats",
+            "-seekable", "0",
+            "-thread_queue_size", "1024",
             "-f", "concat",
-            "-safe", "0",
-            "-i", os.path.basename(concat_list_path),  # 파일명만 전달
+            "-safe", "1",
+            "-i", CONCAT_LIST_NAME,
             "-c", "copy",
-            final_filename
+            output_path
         ]
-        result = subprocess.run(cmd, capture_output=True, text=True, cwd=project_dir)
+        returncode, stderr = await run_ffmpeg(cmd, cwd=staging_dir)
         
-        if result.returncode != 0:
+        if returncode != 0:
             # 재인코딩으로 재시도
             print(f"[Merge Project] copy 실패, 재인코딩 시도...")
             cmd = [
                 "ffmpeg", "-y",
+                "-loglevel", "error", "-nostats",
+                "-seekable", "0",
+                "-thread_queue_size", "1024",
                 "-f", "concat",
-                "-safe", "0",
-                "-i", concat_list_path,
+                "-safe", "1",
+                "-i", CONCAT_LIST_NAME,
                 "-c:v", "libx264",
                 "-preset", "fast",
                 "-crf", "23",
+                "-threads", FFMPEG_THREADS,
                 "-c:a", "aac",
                 "-b:a", "128k",
                 output_path
             ]
-            result = subprocess.run(cmd, capture_output=True, text=True)
+            returncode, stderr = await run_ffmpeg(cmd, cwd=staging_dir)
             
-            if result.returncode != 0:
-                raise Exception(f"FFmpeg 오류: {result.stderr}")
+            if returncode != 0:
+                raise Exception(f"FFmpeg 오류: {stderr}")
         
         # 결과 영상 정보
-        probe_cmd = [
-            "ffprobe", "-v", "error",
-            "-show_entries", "format=duration",
-            "-of", "default=noprint_wrappers=1:nokey=1",
-            output_path
-        ]
-        duration_result = subprocess.run(probe_cmd, capture_output=True, text=True)
-        total_duration = float(duration_result.stdout.strip()) if duration_result.returncode == 0 else 0
+        total_duration = await get_video_duration(output_path)
         
         relative_path = f"proj_{project_id}/{final_filename}"
         print(f"[Merge Project] 완료! 출력: {relative_path}, 길이: {total_duration:.2f}초")
@@ -864,10 +1120,10 @@ async def merge_project_videos(project_id: str, output_filename: Optional[str] =
             video_count=len(video_files),
             message=f"프로젝트 {project_id}: {len(video_files)}개 영상을 합쳐서 {total_duration:.1f}초 영상 생성 완료"
         )
-        
+    
     finally:
-        if os.path.exists(concat_list_path):
-            os.remove(concat_list_path)
+        # 스테이징 폴더 삭제 (원본 영상은 하드링크라 영향 없음)
+        await asyncio.to_thread(shutil.rmtree, staging_dir, ignore_errors=True)
 
 
 @app.delete("/project/{project_id}")
@@ -878,11 +1134,15 @@ async def delete_project(project_id: str):
     if not os.path.exists(project_dir):
         raise HTTPException(status_code=404, detail=f"프로젝트를 찾을 수 없습니다: {project_id}")
     
-    # 폴더 내 파일 개수
-    file_count = len(list(Path(project_dir).glob("*")))
+    def _remove() -> int:
+        # 폴더 내 파일 개수 확인 후 삭제
+        with os.scandir(project_dir) as it:
+            count = sum(1 for _ in it)
+        shutil.rmtree(project_dir)
+        return count
     
-    # 폴더 삭제
-    shutil.rmtree(project_dir)
+    # 이벤트 루프를 막지 않도록 스레드에서 삭제
+    file_count = await asyncio.to_thread(_remove)
     
     return {
         "success": True,
@@ -913,24 +1173,19 @@ async def session_upload_image(
     try:
         session_dir = get_session_dir(session_id)
         
-        ext = os.path.splitext(image.filename)[1] or ".png"
+        ext = Path(image.filename).suffix or ".png"
         if filename:
             save_filename = filename if "." in filename else f"{filename}{ext}"
         else:
-            unique_id = str(uuid.uuid4())[:8]
+            unique_id = token_hex(4)
             save_filename = f"upload_{unique_id}{ext}"
         
         filepath = os.path.join(session_dir, save_filename)
         
-        with open(filepath, "wb") as f:
-            content = await image.read()
-            f.write(content)
+        await save_upload(image, filepath)
         
-        # ComfyUI에도 업로드
-        try:
-            await client.upload_image(filepath, save_filename)
-        except Exception as e:
-            print(f"ComfyUI 업로드 실패 (나중에 재시도): {e}")
+        # ComfyUI에도 업로드 (응답은 디스크 저장까지만 기다림, /session/generate에서 다시 올림)
+        push_to_comfy_background(filepath, save_filename)
         
         return {
             "success": True,
@@ -965,18 +1220,15 @@ async def session_generate_video(request: SessionI2VRequest):
         session_dir = get_session_dir(request.session_id)
         
         # 워크플로우 로드
-        if not os.path.exists(WORKFLOW_PATH):
-            raise HTTPException(status_code=500, detail="워크플로우 파일이 없습니다")
-        
-        workflow = client.load_workflow(WORKFLOW_PATH)
+        workflow = get_workflow()
         
         # 세션 폴더에서 이미지 경로 확인
         image_path = os.path.join(session_dir, request.image_filename)
         if not os.path.exists(image_path):
             raise HTTPException(status_code=404, detail=f"세션 내 이미지를 찾을 수 없습니다: {request.image_filename}")
         
-        # ComfyUI에 업로드
-        await client.upload_image(image_path, request.image_filename)
+        # ComfyUI에 업로드 (업로드 직후라 백그라운드 업로드가 진행 중이면 그것을 기다림)
+        await ensure_pushed(image_path, request.image_filename)
         
         # 워크플로우 업데이트
         workflow = client.update_i2v_workflow(
@@ -992,7 +1244,8 @@ async def session_generate_video(request: SessionI2VRequest):
         workflow = client.randomize_seed(workflow)
         
         # 실행 (영상 생성은 오래 걸림)
-        result = await client.execute_workflow(workflow, timeout=1800)
+        async with COMFY_SEM:
+            result = await client.execute_workflow(workflow, timeout=1800)
         
         # 결과 비디오 가져오기
         outputs = result.get("outputs", {})
@@ -1008,21 +1261,20 @@ async def session_generate_video(request: SessionI2VRequest):
         
         # 비디오 저장 (세션 폴더에)
         vid_info = output_videos[0]
-        vid_bytes = await client.get_video(
-            vid_info["filename"],
-            vid_info.get("subfolder", ""),
-            vid_info.get("type", "output")
-        )
         
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        unique_id = str(uuid.uuid4())[:8]
+        timestamp = time.strftime("%Y%m%d_%H%M%S")
+        unique_id = token_hex(4)
         output_filename = request.output_filename or f"i2v_{timestamp}_{unique_id}.mp4"
         if not output_filename.endswith(".mp4"):
             output_filename += ".mp4"
         output_path = os.path.join(session_dir, output_filename)
         
-        with open(output_path, "wb") as f:
-            f.write(vid_bytes)
+        await client.download_video(
+            vid_info["filename"],
+            output_path,
+            vid_info.get("subfolder", ""),
+            vid_info.get("type", "output")
+        )
         
         processing_time = time.time() - start_time
         
@@ -1044,7 +1296,7 @@ async def session_generate_video(request: SessionI2VRequest):
 
 
 @app.get("/session/{session_id}/files", tags=["Session"])
-async def list_session_files(session_id: str):
+def list_session_files(session_id: str):
     """세션 폴더 내 파일 목록 조회"""
     session_dir = os.path.join(SHARED_DIR, session_id)
     
@@ -1065,11 +1317,13 @@ async def list_session_files(session_id: str):
 
 
 @app.get("/session/{session_id}/file/{filename}", tags=["Session"])
-async def get_session_file(session_id: str, filename: str):
+def get_session_file(session_id: str, filename: str):
     """세션 폴더 내 특정 파일 다운로드"""
     filepath = os.path.join(SHARED_DIR, session_id, filename)
     
-    if not os.path.exists(filepath):
+    try:
+        stat_result = os.stat(filepath)
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail="파일을 찾을 수 없습니다")
     
     # 파일 확장자에 따라 미디어 타입 결정
@@ -1082,10 +1336,19 @@ async def get_session_file(session_id: str, filename: str):
     else:
         media_type = "application/octet-stream"
     
-    return FileResponse(filepath, media_type=media_type, filename=filename)
+    return FileResponse(filepath, media_type=media_type, filename=filename, stat_result=stat_result)
 
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=4200)
+    # uvloop + httptools, 멀티 워커 (워크플로우 템플릿/FFmpeg 세마포어는 워커별로 유지됨)
+    uvicorn.run(
+        "api:app",
+        host="0.0.0.0",
+        port=4200,
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.getenv("UVICORN_WORKERS", "2")),
+        proxy_headers=True
+    )
 
@@ -3,58 +3,130 @@ ComfyUI API Client for Image-to-Video
 ComfyUI 서버와 통신하는 클라이언트 (영상 생성용)
 """
 
+import os
 import json
+import orjson
 import uuid
+import aiofiles
+import logging
 import httpx
 import websockets
 import asyncio
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Tuple
 import base64
 from pathlib import Path
 
+logger = logging.getLogger(__name__)
+
+# (class_type, 노드 제목의 " - " 뒤 이름) -> update_i2v_workflow 파라미터
+# 예: "Int - Width", "Float - CFG"
+I2V_PARAM_TITLES = {
+    ("easy int", "Width"): "width",
+    ("easy int", "Height"): "height",
+    ("easy int", "Length"): "length",
+    ("easy int", "Steps"): "steps",
+    ("easy float", "CFG"): "cfg",
+}
+
+# 완료 시 실행 여부를 확인하는 비디오 관련 노드
+VIDEO_NODES = ("57", "58", "224", "68")
+
+# 업로드 시 디스크에서 읽어 바로 보내는 청크 크기
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# multipart filename 이스케이프 (httpx와 동일: 따옴표/역슬래시, 제어문자는 %XX)
+_FORM_FILENAME_ESCAPES = {ord('"'): "%22", ord("\\"): "\\\\"}
+_FORM_FILENAME_ESCAPES.update({c: f"%{c:02X}" for c in range(0x20) if c != 0x1B})
+
 
 class ComfyUIClient:
     def __init__(self, server_url: str = "http://localhost:8188"):
         self.server_url = server_url.rstrip("/")
         self.client_id = str(uuid.uuid4())
+        self._http: Optional[httpx.AsyncClient] = None
+        # (워크플로우 객체, update_i2v_workflow용 노드 인덱스)
+        self._i2v_index: Optional[Tuple[Dict[str, Any], Dict[str, List[Tuple[str, str]]]]] = None
+    
+    @property
+    def http(self) -> httpx.AsyncClient:
+        """keep-alive 연결을 재사용하는 공유 HTTP 클라이언트 (처음 사용할 때 생성)"""
+        if self._http is None or self._http.is_closed:
+            self._http = httpx.AsyncClient(
+                timeout=httpx.Timeout(60.0, connect=5.0),
+                limits=httpx.Limits(max_keepalive_connections=8)
+            )
+        return self._http
+    
+    async def aclose(self):
+        """공유 HTTP 클라이언트 종료"""
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
     
     async def upload_image(self, image_path: str, filename: Optional[str] = None) -> str:
-        """이미지를 ComfyUI 서버에 업로드"""
+        """이미지를 ComfyUI 서버에 업로드
+        
+        multipart 본문을 직접 만들어 파일을 청크 단위로 읽으면서 바로 전송
+        (디스크 읽기와 네트워크 전송이 겹치고 이벤트 루프에서 동기 read를 하지 않음)
+        """
         if filename is None:
             filename = Path(image_path).name
         
-        async with httpx.AsyncClient() as client:
-            with open(image_path, "rb") as f:
-                files = {"image": (filename, f, "image/png")}
-                data = {"overwrite": "true"}
-                response = await client.post(
-                    f"{self.server_url}/upload/image",
-                    files=files,
-                    data=data
-                )
-                
-                if response.status_code != 200:
-                    print(f"[Upload Error] Status: {response.status_code}")
-                    print(f"[Upload Error] Response: {response.text}")
-                    raise Exception(f"ComfyUI 이미지 업로드 실패 (Status {response.status_code}): {response.text}")
-                
-                result = response.json()
-                print(f"[Upload Success] {filename} -> {result}")
-                return result.get("name", filename)
+        boundary = uuid.uuid4().hex
+        quoted_name = filename.translate(_FORM_FILENAME_ESCAPES)
+        head = (
+            f'--{boundary}\r\nContent-Disposition: form-data; name="overwrite"\r\n\r\ntrue\r\n'
+            f'--{boundary}\r\nContent-Disposition: form-data; name="image"; filename="{quoted_name}"\r\n'
+            f'Content-Type: image/png\r\n\r\n'
+        ).encode()
+        tail = f"\r\n--{boundary}--\r\n".encode()
+        # 크기를 미리 알아 Content-Length로 보냄 (chunked 인코딩 회피)
+        file_size = (await asyncio.to_thread(os.stat, image_path)).st_size
+        
+        async def body():
+            yield head
+            sent = 0
+            async with aiofiles.open(image_path, "rb") as f:
+                while chunk := await f.read(UPLOAD_CHUNK_SIZE):
+                    sent += len(chunk)
+                    if sent > file_size:
+                        break
+                    yield chunk
+            # stat 이후 파일이 바뀌면 Content-Length와 본문이 어긋나므로 그대로 보내지 않음
+            if sent != file_size:
+                raise Exception(f"업로드 중 파일 크기가 바뀌었습니다: {image_path} ({file_size} -> {sent} bytes)")
+            yield tail
+        
+        response = await self.http.post(
+            f"{self.server_url}/upload/image",
+            content=body(),
+            headers={
+                "Content-Type": f"multipart/form-data; boundary={boundary}",
+                "Content-Length": str(len(head) + file_size + len(tail))
+            }
+        )
+        
+        if response.status_code != 200:
+            print(f"[Upload Error] Status: {response.status_code}")
+            print(f"[Upload Error] Response: {response.text}")
+            raise Exception(f"ComfyUI 이미지 업로드 실패 (Status {response.status_code}): {response.text}")
+        
+        result = orjson.loads(response.content)
+        print(f"[Upload Success] {filename} -> {result}")
+        return result.get("name", filename)
     
     async def upload_image_bytes(self, image_bytes: bytes, filename: str) -> str:
         """바이트 데이터로 이미지 업로드"""
-        async with httpx.AsyncClient() as client:
-            files = {"image": (filename, image_bytes, "image/png")}
-            data = {"overwrite": "true"}
-            response = await client.post(
-                f"{self.server_url}/upload/image",
-                files=files,
-                data=data
-            )
-            response.raise_for_status()
-            result = response.json()
-            return result.get("name", filename)
+        files = {"image": (filename, image_bytes, "image/png")}
+        data = {"overwrite": "true"}
+        response = await self.http.post(
+            f"{self.server_url}/upload/image",
+            files=files,
+            data=data
+        )
+        response.raise_for_status()
+        result = orjson.loads(response.content)
+        return result.get("name", filename)
     
     async def queue_prompt(self, workflow: Dict[str, Any]) -> str:
         """워크플로우를 큐에 추가하고 prompt_id 반환"""
@@ -63,45 +135,44 @@ class ComfyUIClient:
             "client_id": self.client_id
         }
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{self.server_url}/prompt",
-                json=payload
-            )
-            
-            # 에러 시 상세 내용 출력
-            if response.status_code != 200:
-                print(f"[ComfyUI Error] Status: {response.status_code}")
-                print(f"[ComfyUI Error] Response: {response.text}")
-                try:
-                    error_json = response.json()
-                    print(f"[ComfyUI Error] JSON: {error_json}")
-                    if "error" in error_json:
-                        raise Exception(f"ComfyUI 에러: {error_json['error']}")
-                    if "node_errors" in error_json:
-                        raise Exception(f"노드 에러: {error_json['node_errors']}")
-                except json.JSONDecodeError:
-                    raise Exception(f"ComfyUI 응답 에러 (Status {response.status_code}): {response.text}")
-                except Exception as e:
-                    if "ComfyUI 에러" in str(e) or "노드 에러" in str(e):
-                        raise
-                    raise Exception(f"ComfyUI 에러 (Status {response.status_code}): {response.text}")
-                response.raise_for_status()
-            
-            result = response.json()
-            prompt_id = result["prompt_id"]
-            print(f"[ComfyUI] Prompt queued successfully!")
-            print(f"[ComfyUI] Prompt ID: {prompt_id}")
-            return prompt_id
+        response = await self.http.post(
+            f"{self.server_url}/prompt",
+            content=orjson.dumps(payload),
+            headers={"Content-Type": "application/json"}
+        )
+        
+        # 에러 시 상세 내용 출력
+        if response.status_code != 200:
+            print(f"[ComfyUI Error] Status: {response.status_code}")
+            print(f"[ComfyUI Error] Response: {response.text}")
+            try:
+                error_json = orjson.loads(response.content)
+                print(f"[ComfyUI Error] JSON: {error_json}")
+                if "error" in error_json:
+                    raise Exception(f"ComfyUI 에러: {error_json['error']}")
+                if "node_errors" in error_json:
+                    raise Exception(f"노드 에러: {error_json['node_errors']}")
+            except orjson.JSONDecodeError:
+                raise Exception(f"ComfyUI 응답 에러 (Status {response.status_code}): {response.text}")
+            except Exception as e:
+                if "ComfyUI 에러" in str(e) or "노드 에러" in str(e):
+                    raise
+                raise Exception(f"ComfyUI 에러 (Status {response.status_code}): {response.text}")
+            response.raise_for_status()
+        
+        result = orjson.loads(response.content)
+        prompt_id = result["prompt_id"]
+        print(f"[ComfyUI] Prompt queued successfully!")
+        print(f"[ComfyUI] Prompt ID: {prompt_id}")
+        return prompt_id
     
     async def get_history(self, prompt_id: str) -> Dict[str, Any]:
         """실행 히스토리 조회"""
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.server_url}/history/{prompt_id}"
-            )
-            response.raise_for_status()
-            return response.json()
+        response = await self.http.get(
+            f"{self.server_url}/history/{prompt_id}"
+        )
+        response.raise_for_status()
+        return orjson.loads(response.content)
     
     async def get_image(self, filename: str, subfolder: str = "", folder_type: str = "output") -> bytes:
         """생성된 이미지 다운로드"""
@@ -111,13 +182,12 @@ class ComfyUIClient:
             "type": folder_type
         }
         
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.server_url}/view",
-                params=params
-            )
-            response.raise_for_status()
-            return response.content
+        response = await self.http.get(
+            f"{self.server_url}/view",
+            params=params
+        )
+        response.raise_for_status()
+        return response.content
     
     async def get_video(self, filename: str, subfolder: str = "", folder_type: str = "output") -> bytes:
         """생성된 비디오 다운로드"""
@@ -127,151 +197,249 @@ class ComfyUIClient:
             "type": folder_type
         }
         
-        async with httpx.AsyncClient(timeout=300.0) as client:
-            response = await client.get(
-                f"{self.server_url}/view",
-                params=params
-            )
-            response.raise_for_status()
-            return response.content
+        response = await self.http.get(
+            f"{self.server_url}/view",
+            params=params,
+            timeout=300.0
+        )
+        response.raise_for_status()
+        return response.content
+    
+    async def download_video(
+        self,
+        filename: str,
+        dest_path: str,
+        subfolder: str = "",
+        folder_type: str = "output"
+    ) -> int:
+        """생성된 비디오를 메모리에 올리지 않고 파일로 바로 저장
+        
+        임시 파일(.part)에 받은 뒤 완료되면 교체 - 전송 실패 시 잘린 mp4가 남거나
+        기존 결과를 덮어쓰지 않고, 받는 중인 파일이 .mp4 목록에 보이지 않음
+        """
+        params = {
+            "filename": filename,
+            "subfolder": subfolder,
+            "type": folder_type
+        }
+        
+        part_path = f"{dest_path}.{uuid.uuid4().hex[:8]}.part"
+        size = 0
+        try:
+            async with self.http.stream("GET", f"{self.server_url}/view", params=params, timeout=300.0) as response:
+                response.raise_for_status()
+                async with aiofiles.open(part_path, "wb") as f:
+                    async for chunk in response.aiter_bytes(1 << 20):
+                        await f.write(chunk)
+                        size += len(chunk)
+            os.replace(part_path, dest_path)
+        except BaseException:
+            try:
+                os.unlink(part_path)
+            except FileNotFoundError:
+                pass
+            raise
+        return size
+    
+    def _ws_url(self) -> str:
+        """ComfyUI WebSocket 주소"""
+        ws_url = self.server_url.replace("http://", "ws://").replace("https://", "wss://")
+        return f"{ws_url}/ws?clientId={self.client_id}"
     
     async def wait_for_completion(self, prompt_id: str, timeout: int = 1800) -> Dict[str, Any]:
         """WebSocket으로 완료 대기 (영상 생성은 오래 걸림)"""
-        ws_url = self.server_url.replace("http://", "ws://").replace("https://", "wss://")
-        ws_url = f"{ws_url}/ws?clientId={self.client_id}"
-        
+        ws_url = self._ws_url()
         print(f"[WebSocket] Connecting to {ws_url}")
+        
+        async with websockets.connect(ws_url) as websocket:
+            print(f"[WebSocket] Connected successfully!")
+            await self._wait_on_socket(websocket, prompt_id, timeout)
+        
+        # 히스토리에서 결과 가져오기
+        history = await self.get_history(prompt_id)
+        return history.get(prompt_id, {})
+    
+    async def _wait_on_socket(self, websocket, prompt_id: str, timeout: int):
+        """열린 WebSocket에서 해당 prompt의 완료 이벤트까지 대기 (폴링 없음)"""
         print(f"[WebSocket] Waiting for prompt_id: {prompt_id}")
         
-        executed_nodes = []  # 실행된 노드 추적
+        executed_nodes = set()  # 실행된 노드 추적
         message_count = 0
-        last_log_time = 0
         
-        async with websockets.connect(ws_url) as websocket:
-            print(f"[WebSocket] Connected successfully!")
-            start_time = asyncio.get_event_loop().time()
+        start_time = asyncio.get_event_loop().time()
+        
+        while True:
+            elapsed = asyncio.get_event_loop().time() - start_time
+            if elapsed > timeout:
+                raise TimeoutError(f"Timeout waiting for prompt {prompt_id}")
             
-            while True:
-                elapsed = asyncio.get_event_loop().time() - start_time
-                if elapsed > timeout:
-                    raise TimeoutError(f"Timeout waiting for prompt {prompt_id}")
+            try:
+                # 메시지가 없으면 최대 30초마다 깨어나 타임아웃/상태만 확인
+                message = await asyncio.wait_for(
+                    websocket.recv(),
+                    timeout=min(30.0, max(timeout - elapsed, 0.1))
+                )
+                message_count += 1
+                
+                # 바이너리 메시지는 스킵 (프리뷰 이미지 등)
+                if isinstance(message, bytes):
+                    continue  # 바이너리 메시지는 조용히 스킵
                 
+                # 텍스트 메시지만 JSON 파싱
                 try:
-                    message = await asyncio.wait_for(websocket.recv(), timeout=5.0)
-                    message_count += 1
-                    
-                    # 바이너리 메시지는 스킵 (프리뷰 이미지 등)
-                    if isinstance(message, bytes):
-                        continue  # 바이너리 메시지는 조용히 스킵
-                    
-                    # 텍스트 메시지만 JSON 파싱
-                    try:
-                        data = json.loads(message)
-                    except json.JSONDecodeError as e:
-                        print(f"[WebSocket] JSON decode error: {e}")
-                        continue
-                    
-                    msg_type = data.get("type", "unknown")
-                    
-                    # 상태 메시지
-                    if msg_type == "status":
-                        status = data.get("data", {}).get("status", {})
-                        queue_remaining = status.get("exec_info", {}).get("queue_remaining", "?")
-                        print(f"[WebSocket] Status: queue_remaining={queue_remaining}")
-                    
-                    # 실행 시작 메시지
-                    elif msg_type == "execution_start":
-                        recv_prompt_id = data.get("data", {}).get("prompt_id")
-                        if recv_prompt_id == prompt_id:
-                            print(f"[ComfyUI] Execution STARTED for our prompt!")
-                        else:
-                            print(f"[ComfyUI] Different prompt started: {recv_prompt_id[:8]}...")
-                    
-                    # 캐시된 노드 정보
-                    elif msg_type == "execution_cached":
-                        cached = data.get("data", {}).get("nodes", [])
-                        if cached:
-                            print(f"[ComfyUI] Cached nodes: {len(cached)} nodes")
-                    
-                    # 진행 상황 로깅
-                    elif msg_type == "progress":
+                    data = orjson.loads(message)
+                except orjson.JSONDecodeError as e:
+                    print(f"[WebSocket] JSON decode error: {e}")
+                    continue
+                
+                msg_type = data.get("type", "unknown")
+                
+                # 상태 메시지
+                if msg_type == "status":
+                    status = data.get("data", {}).get("status", {})
+                    queue_remaining = status.get("exec_info", {}).get("queue_remaining", "?")
+                    print(f"[WebSocket] Status: queue_remaining={queue_remaining}")
+                
+                # 실행 시작 메시지
+                elif msg_type == "execution_start":
+                    recv_prompt_id = data.get("data", {}).get("prompt_id")
+                    if recv_prompt_id == prompt_id:
+                        print(f"[ComfyUI] Execution STARTED for our prompt!")
+                    else:
+                        print(f"[ComfyUI] Different prompt started: {recv_prompt_id[:8]}...")
+                
+                # 캐시된 노드 정보
+                elif msg_type == "execution_cached":
+                    cached = data.get("data", {}).get("nodes", [])
+                    if cached:
+                        print(f"[ComfyUI] Cached nodes: {len(cached)} nodes")
+                
+                # 진행 상황 로깅 (DEBUG, 10스텝마다)
+                elif msg_type == "progress":
+                    if logger.isEnabledFor(logging.DEBUG):
                         progress = data.get("data", {})
                         value = progress.get("value", 0)
                         max_val = progress.get("max", 1)
-                        node = progress.get("node", "?")
-                        pct = (value/max_val*100) if max_val > 0 else 0
-                        print(f"[Progress] Node {node}: {value}/{max_val} ({pct:.1f}%)")
-                    
-                    elif msg_type == "executing":
-                        exec_data = data.get("data", {})
-                        recv_prompt_id = exec_data.get("prompt_id")
-                        
-                        if recv_prompt_id == prompt_id:
-                            node = exec_data.get("node")
-                            if node:
-                                executed_nodes.append(node)
-                                print(f"[Executing] ▶Node {node}")
-                            if node is None:
-                                # 실행 완료
-                                print(f"\n[ComfyUI] Execution COMPLETED!")
-                                print(f"[Summary] Total executed nodes: {len(executed_nodes)}")
-                                print(f"[Summary] Executed: {executed_nodes}")
-                                
-                                # 비디오 관련 노드 실행 여부 확인
-                                video_nodes = ['57', '58', '224', '68']
-                                executed_video = [n for n in video_nodes if n in executed_nodes]
-                                missing_video = [n for n in video_nodes if n not in executed_nodes]
-                                
-                                if executed_video:
-                                    print(f"[Summary] Video nodes executed: {executed_video}")
-                                if missing_video:
-                                    print(f"[WARNING] Video nodes NOT executed: {missing_video}")
-                                    print(f"  57=KSamplerAdvanced(high), 58=KSamplerAdvanced(low)")
-                                    print(f"  224=VAEDecodeTiled, 68=VideoCombine")
-                                break
-                        else:
-                            print(f"[WebSocket] Different prompt executing: {recv_prompt_id[:8] if recv_prompt_id else 'None'}...")
-                    
-                    elif msg_type == "execution_error":
-                        exec_data = data.get("data", {})
-                        if exec_data.get("prompt_id") == prompt_id:
-                            print(f"[ERROR] Execution error!")
-                            print(f"[ERROR] Node: {exec_data.get('node_id')}")
-                            print(f"[ERROR] Type: {exec_data.get('node_type')}")
-                            print(f"[ERROR] Message: {exec_data.get('exception_message')}")
-                            raise Exception(f"Execution error: {exec_data}")
+                        if value % 10 == 0 or value == max_val:
+                            logger.debug("[Progress] Node %s: %s/%s", progress.get("node", "?"), value, max_val)
+                
+                elif msg_type == "executing":
+                    exec_data = data.get("data", {})
+                    recv_prompt_id = exec_data.get("prompt_id")
                     
-                    # crystools.monitor 등 기타 메시지는 무시
-                    elif msg_type not in ["crystools.monitor"]:
-                        print(f"[WebSocket] Message type: {msg_type}")
+                    if recv_prompt_id == prompt_id:
+                        node = exec_data.get("node")
+                        if node:
+                            executed_nodes.add(node)
+                            logger.debug("[Executing] Node %s", node)
+                        if node is None:
+                            # 실행 완료
+                            print(f"\n[ComfyUI] Execution COMPLETED!")
+                            print(f"[Summary] Total executed nodes: {len(executed_nodes)}")
+                            logger.debug("[Summary] Executed: %s", executed_nodes)
+                            
+                            # 비디오 관련 노드 실행 여부 확인
+                            executed_video = [n for n in VIDEO_NODES if n in executed_nodes]
+                            missing_video = [n for n in VIDEO_NODES if n not in executed_nodes]
+                            
+                            if executed_video:
+                                print(f"[Summary] Video nodes executed: {executed_video}")
+                            if missing_video:
+                                print(f"[WARNING] Video nodes NOT executed: {missing_video}")
+                                print(f"  57=KSamplerAdvanced(high), 58=KSamplerAdvanced(low)")
+                                print(f"  224=VAEDecodeTiled, 68=VideoCombine")
+                            break
+                    else:
+                        logger.debug("[WebSocket] Different prompt executing: %s", recv_prompt_id)
                 
-                except asyncio.TimeoutError:
-                    # 30초마다 상태 출력
-                    if int(elapsed) - last_log_time >= 30:
-                        last_log_time = int(elapsed)
-                        print(f"[WebSocket] Waiting... ({int(elapsed)}s elapsed, {len(executed_nodes)} nodes executed)")
-                    continue
-        
-        # 히스토리에서 결과 가져오기
-        history = await self.get_history(prompt_id)
-        return history.get(prompt_id, {})
+                elif msg_type == "execution_success":
+                    if data.get("data", {}).get("prompt_id") == prompt_id:
+                        print(f"\n[ComfyUI] Execution SUCCESS!")
+                        break
+                
+                elif msg_type == "execution_error":
+                    exec_data = data.get("data", {})
+                    if exec_data.get("prompt_id") == prompt_id:
+                        print(f"[ERROR] Execution error!")
+                        print(f"[ERROR] Node: {exec_data.get('node_id')}")
+                        print(f"[ERROR] Type: {exec_data.get('node_type')}")
+                        print(f"[ERROR] Message: {exec_data.get('exception_message')}")
+                        raise Exception(f"Execution error: {exec_data}")
+                
+                # crystools.monitor 등 기타 메시지는 무시
+                elif msg_type != "crystools.monitor":
+                    logger.debug("[WebSocket] Message type: %s", msg_type)
+            
+            except asyncio.TimeoutError:
+                # 30초 동안 메시지가 없을 때 상태 출력
+                print(f"[WebSocket] Waiting... ({int(elapsed)}s elapsed, {len(executed_nodes)} nodes executed)")
+                continue
     
     async def execute_workflow(
         self,
         workflow: Dict[str, Any],
         timeout: int = 1800
     ) -> Dict[str, Any]:
-        """워크플로우 실행 및 결과 대기"""
-        prompt_id = await self.queue_prompt(workflow)
-        print(f"Workflow queued with prompt_id: {prompt_id}")
-        result = await self.wait_for_completion(prompt_id, timeout)
-        return result
+        """워크플로우 실행 및 결과 대기 (큐 등록 전에 WebSocket을 열어 이벤트 누락 방지)"""
+        ws_url = self._ws_url()
+        print(f"[WebSocket] Connecting to {ws_url}")
+        
+        async with websockets.connect(ws_url) as websocket:
+            print(f"[WebSocket] Connected successfully!")
+            prompt_id = await self.queue_prompt(workflow)
+            print(f"Workflow queued with prompt_id: {prompt_id}")
+            await self._wait_on_socket(websocket, prompt_id, timeout)
+        
+        # 히스토리에서 결과 가져오기
+        history = await self.get_history(prompt_id)
+        return history.get(prompt_id, {})
     
     def load_workflow(self, workflow_path: str) -> Dict[str, Any]:
         """JSON 파일에서 워크플로우 로드"""
         with open(workflow_path, "r", encoding="utf-8") as f:
             return json.load(f)
     
+    def _mutable_inputs(self, workflow: Dict[str, Any], node_id: str) -> Dict[str, Any]:
+        """수정할 노드만 복사해 넣고 그 노드의 inputs 반환 (나머지 노드는 원본과 공유)"""
+        node = workflow[node_id]
+        inputs = dict(node.get("inputs", {}))
+        workflow[node_id] = {**node, "inputs": inputs}
+        return inputs
+    
+    def _i2v_node_index(self, workflow: Dict[str, Any]) -> Dict[str, List[Tuple[str, str]]]:
+        """update_i2v_workflow가 수정할 (노드 ID, 입력 키) 목록
+        
+        같은 워크플로우 객체(템플릿)에 대해서는 한 번만 스캔하고 재사용
+        """
+        cached = self._i2v_index
+        if cached is not None and cached[0] is workflow:
+            return cached[1]
+        
+        index: Dict[str, List[Tuple[str, str]]] = {
+            "image": [], "prompt": [], "width": [], "height": [], "length": [], "steps": [], "cfg": []
+        }
+        for node_id, node in workflow.items():
+            class_type = node.get("class_type", "")
+            title = node.get("_meta", {}).get("title", "")
+            
+            # 이미지 로드 노드 (노드 172)
+            if class_type == "LoadImage":
+                index["image"].append((node_id, "image"))
+            
+            # Positive Prompt (노드 6)
+            elif class_type == "CLIPTextEncode":
+                if "Positive" in title:
+                    index["prompt"].append((node_id, "text"))
+            
+            # 파라미터 노드들 (easy int, easy float) - 제목 끝 이름으로 바로 조회
+            elif class_type in ("easy int", "easy float"):
+                param = I2V_PARAM_TITLES.get((class_type, title.rpartition(" - ")[2]))
+                if param:
+                    index[param].append((node_id, "value"))
+        
+        self._i2v_index = (workflow, index)
+        return index
+    
     def update_i2v_workflow(
         self,
         workflow: Dict[str, Any],
@@ -283,47 +451,26 @@ class ComfyUIClient:
         steps: int = 8,
         cfg: float = 1.0
     ) -> Dict[str, Any]:
-        """Image-to-Video 워크플로우 업데이트"""
-        workflow = json.loads(json.dumps(workflow))  # Deep copy
+        """Image-to-Video 워크플로우 업데이트 (원본은 수정하지 않음)"""
+        index = self._i2v_node_index(workflow)
+        workflow = dict(workflow)  # 바뀌는 노드만 따로 복사
         
         print(f"[Workflow] 업데이트 시작: image={image_filename}, prompt={prompt[:50]}...")
         print(f"[Workflow] 파라미터: width={width}, height={height}, length={length}, steps={steps}, cfg={cfg}")
         
-        for node_id, node in workflow.items():
-            class_type = node.get("class_type", "")
-            title = node.get("_meta", {}).get("title", "")
-            inputs = node.get("inputs", {})
-            
-            # 이미지 로드 노드 (노드 172)
-            if class_type == "LoadImage":
-                inputs["image"] = image_filename
-                print(f"[Workflow] 노드 {node_id} (LoadImage): image={image_filename}")
-            
-            # Positive Prompt (노드 6)
-            elif class_type == "CLIPTextEncode":
-                if "Positive" in title:
-                    inputs["text"] = prompt
-                    print(f"[Workflow] 노드 {node_id} (Positive Prompt): 설정됨")
-            
-            # 파라미터 노드들 (easy int, easy float)
-            elif class_type == "easy int":
-                if "Width" in title:
-                    inputs["value"] = width
-                    print(f"[Workflow] 노드 {node_id} (Width): {width}")
-                elif "Height" in title:
-                    inputs["value"] = height
-                    print(f"[Workflow] 노드 {node_id} (Height): {height}")
-                elif "Length" in title:
-                    inputs["value"] = length
-                    print(f"[Workflow] 노드 {node_id} (Length): {length}")
-                elif "Steps" in title:
-                    inputs["value"] = steps
-                    print(f"[Workflow] 노드 {node_id} (Steps): {steps}")
-            
-            elif class_type == "easy float":
-                if "CFG" in title:
-                    inputs["value"] = cfg
-                    print(f"[Workflow] 노드 {node_id} (CFG): {cfg}")
+        values = {
+            "image": image_filename,
+            "prompt": prompt,
+            "width": width,
+            "height": height,
+            "length": length,
+            "steps": steps,
+            "cfg": cfg
+        }
+        for param, targets in index.items():
+            for node_id, input_key in targets:
+                self._mutable_inputs(workflow, node_id)[input_key] = values[param]
+                print(f"[Workflow] 노드 {node_id} ({param}): 설정됨")
         
         return workflow
     
@@ -334,13 +481,13 @@ class ComfyUIClient:
         image2_name: Optional[str] = None
     ) -> Dict[str, Any]:
         """워크플로우의 이미지 파일명 업데이트 (호환성)"""
-        workflow = json.loads(json.dumps(workflow))
+        source = workflow
+        workflow = dict(source)
         
-        for node_id, node in workflow.items():
+        for node_id, node in source.items():
             if node.get("class_type") == "LoadImage":
-                inputs = node.get("inputs", {})
-                if "image" in inputs:
-                    inputs["image"] = image1_name
+                if "image" in node.get("inputs", {}):
+                    self._mutable_inputs(workflow, node_id)["image"] = image1_name
         
         return workflow
     
@@ -350,29 +497,31 @@ class ComfyUIClient:
         prompt: str
     ) -> Dict[str, Any]:
         """워크플로우의 프롬프트 업데이트 (호환성)"""
-        workflow = json.loads(json.dumps(workflow))
+        source = workflow
+        workflow = dict(source)
         
-        for node_id, node in workflow.items():
+        for node_id, node in source.items():
             class_type = node.get("class_type", "")
             
             if class_type == "CLIPTextEncode":
                 title = node.get("_meta", {}).get("title", "")
                 if "Positive" in title:
-                    node["inputs"]["text"] = prompt
+                    self._mutable_inputs(workflow, node_id)["text"] = prompt
         
         return workflow
     
     def randomize_seed(self, workflow: Dict[str, Any]) -> Dict[str, Any]:
         """워크플로우의 KSampler seed를 랜덤하게 변경"""
         import random
-        workflow = json.loads(json.dumps(workflow))  # deep copy
+        source = workflow
+        workflow = dict(source)
         
-        for node_id, node in workflow.items():
+        for node_id, node in source.items():
             class_type = node.get("class_type", "")
             
             # KSampler 또는 KSamplerAdvanced 노드의 seed 랜덤화
             if "KSampler" in class_type:
-                inputs = node.get("inputs", {})
+                inputs = self._mutable_inputs(workflow, node_id)
                 if "seed" in inputs:
                     old_seed = inputs["seed"]
                     new_seed = random.randint(0, 2**63 - 1)
@@ -5,18 +5,26 @@ ComfyUI를 통한 이미지 편집 API
 - v2 워크플로우: 최대 3개 이미지 지원
 """
 
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Request
+from fastapi.responses import FileResponse, Response, ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
-from typing import Optional, Union
+from typing import Optional, Union, Dict, Tuple
+from collections import OrderedDict
 import os
-import uuid
+import logging
 import time
 import asyncio
 import shutil
+import mmap
+import itertools
+import functools
+import hashlib
+import httpx
 from datetime import datetime
 from pathlib import Path
+from secrets import token_hex
+from urllib.parse import quote
 
 from comfyui_client import ComfyUIClient
 
@@ -26,7 +34,8 @@ from comfyui_client import ComfyUIClient
 app = FastAPI(
     title="Qwen Image Edit API",
     description="ComfyUI 기반 이미지 편집 API - 기본 지지(GiGi) 얼굴 내장",
-    version="2.1.0"
+    version="2.1.0",
+    default_response_class=ORJSONResponse
 )
 
 app.add_middleware(
@@ -48,6 +57,20 @@ UPLOAD_DIR = "uploads"
 SHARED_DIR = "shared"
 ASSETS_DIR = "assets"  # 기본 이미지 저장 폴더
 
+# nginx 뒤에서 실행할 때 OUTPUT_DIR에 매핑된 internal location (예: "/internal/outputs/")
+# 설정하면 /output 파일 전송을 X-Accel-Redirect로 nginx에 넘김
+OUTPUT_ACCEL_PREFIX = os.getenv("OUTPUT_ACCEL_PREFIX", "")
+
+# SHARED_DIR에 매핑된 internal location (예: "/internal_shared/"), 세션 파일 다운로드용
+SESSION_ACCEL_PREFIX = os.getenv("SESSION_ACCEL_PREFIX", "")
+
+# ComfyUI input/ 폴더가 이 컨테이너에 마운트된 경로 (공유 볼륨 배포용, 선택)
+# 설정하면 업로드 이미지를 HTTP /upload/image 대신 이 폴더에 바로 저장
+COMFY_INPUT_DIR = os.getenv("COMFY_INPUT_DIR", "")
+
+# 업로드 파일 복사 버퍼 크기 (1MB)
+UPLOAD_COPY_BUFSIZE = 1 << 20
+
 # 기본 얼굴 이미지 설정
 DEFAULT_FACE_FILENAME = "default_face.png"
 DEFAULT_FACE_PATH = os.path.join(ASSETS_DIR, DEFAULT_FACE_FILENAME)
@@ -57,6 +80,10 @@ os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(SHARED_DIR, exist_ok=True)
 os.makedirs(ASSETS_DIR, exist_ok=True)
 
+UPLOAD_PATH = Path(UPLOAD_DIR)
+
+logger = logging.getLogger(__name__)
+
 # ComfyUI 클라이언트
 client = ComfyUIClient(COMFYUI_URL)
 
@@ -66,23 +93,44 @@ FILE_MAX_AGE_HOURS = 2
 # 기본 얼굴 이미지 ComfyUI 업로드 상태
 default_face_uploaded = False
 
+# ComfyUI 동시 실행 한도 (상한, 적응형으로 1까지 줄어듦)
+COMFY_MAX_CONCURRENCY = int(os.getenv("COMFY_MAX_CONCURRENCY", "4"))
+
+# 편집 엔드포인트별 동시 처리 요청 수 (초과 요청은 대기하지 않고 503)
+EDIT_MAX_INFLIGHT = int(os.getenv("EDIT_MAX_INFLIGHT", "2"))
+EDIT_ACQUIRE_TIMEOUT = float(os.getenv("EDIT_ACQUIRE_TIMEOUT", "0.5"))
+
+# ComfyUI에 올린 이미지: 이름 -> (로컬 경로, mtime_ns, 크기)
+_uploaded_to_comfy: Dict[str, Tuple[str, int, int]] = {}
+_upload_locks: Dict[str, asyncio.Lock] = {}
+
+# mmap으로 올려둔 파일: 경로 -> ((mtime_ns, 크기), 매핑) (기본 얼굴 업로드용)
+_mapped_files: Dict[str, Tuple[Tuple[int, int], mmap.mmap]] = {}
+
+# 스타일 이미지 내용 해시(BLAKE2b) -> ComfyUI 파일명 (최근 UPLOAD_HASH_CACHE_SIZE개, LRU)
+UPLOAD_HASH_CACHE_SIZE = 128
+_upload_hash_cache: "OrderedDict[bytes, str]" = OrderedDict()
+
+# 파일명 ID: 서버 시작 시각 + PID + 증가 카운터 (요청마다 uuid/strftime 호출 없이 고유, 시간순 정렬)
+FILE_ID_PREFIX = f"{time.strftime('%Y%m%d_%H%M%S')}_{os.getpid():x}"
+_file_id_counter = itertools.count(1)
+
 
 # ============================================
 # 유틸리티 함수
 # ============================================
 def cleanup_old_files(directory: str, max_age_hours: int = FILE_MAX_AGE_HOURS):
-    """오래된 파일 삭제"""
-    now = time.time()
+    """오래된 파일 삭제 (scandir의 캐시된 stat 사용)"""
+    cutoff = time.time() - max_age_hours * 3600
     deleted_count = 0
-    for file in Path(directory).glob("*"):
-        if file.is_file():
-            age_hours = (now - file.stat().st_mtime) / 3600
-            if age_hours > max_age_hours:
+    with os.scandir(directory) as it:
+        for entry in it:
+            if entry.is_file(follow_symlinks=False) and entry.stat().st_mtime < cutoff:
                 try:
-                    file.unlink()
+                    os.unlink(entry.path)
                     deleted_count += 1
-                except Exception as e:
-                    print(f"파일 삭제 실패 {file}: {e}")
+                except OSError as e:
+                    print(f"파일 삭제 실패 {entry.path}: {e}")
     if deleted_count > 0:
         print(f"[Cleanup] {directory}: {deleted_count}개 오래된 파일 삭제됨")
 
@@ -91,8 +139,166 @@ async def periodic_cleanup():
     """주기적으로 오래된 파일 삭제"""
     while True:
         await asyncio.sleep(1800)  # 30분
-        cleanup_old_files(OUTPUT_DIR)
-        cleanup_old_files(UPLOAD_DIR)
+        await asyncio.to_thread(cleanup_old_files, OUTPUT_DIR)
+        await asyncio.to_thread(cleanup_old_files, UPLOAD_DIR)
+
+
+def list_files(directory: str, suffix: str = "") -> list:
+    """디렉토리 파일 목록 (최신순) - scandir 한 번, 파일당 stat 한 번"""
+    entries = []
+    with os.scandir(directory) as it:
+        for entry in it:
+            if entry.name.endswith(suffix) and entry.is_file():
+                st = entry.stat()
+                entries.append((st.st_ctime, entry.name, st.st_size))
+    entries.sort(reverse=True)
+    return [
+        {
+            "filename": name,
+            "size_mb": round(size / (1024 * 1024), 2),
+            "created": datetime.fromtimestamp(ctime).isoformat()
+        }
+        for ctime, name, size in entries
+    ]
+
+
+def list_file_names(directory: str) -> set:
+    """디렉토리의 파일 이름 집합 (존재 확인을 stat 대신 집합 조회로)"""
+    with os.scandir(directory) as it:
+        return {entry.name for entry in it if entry.is_file()}
+
+
+def get_workflow() -> dict:
+    """워크플로우 템플릿 반환 (경로+mtime 캐시, 존재 확인을 위한 별도 stat 없음)"""
+    try:
+        return client.load_workflow(WORKFLOW_PATH)
+    except FileNotFoundError:
+        raise HTTPException(status_code=500, detail="워크플로우 파일이 없습니다")
+
+
+class AdaptiveLimiter:
+    """ComfyUI 워크플로우 동시 실행 제한 (AIMD)
+    
+    성공하면 한도를 1씩 늘리고, 타임아웃/연결 오류면 절반으로 줄여
+    ComfyUI(단일 GPU) 큐에 작업이 과하게 쌓이지 않게 함
+    """
+    
+    def __init__(self, max_limit: int, min_limit: int = 1):
+        self.min_limit = min_limit
+        self.max_limit = max(max_limit, min_limit)
+        self.limit = self.max_limit
+        self.in_flight = 0
+        self._cond = asyncio.Condition()
+    
+    async def __aenter__(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        async with self._cond:
+            self.in_flight -= 1
+            if exc_type is None:
+                self.limit = min(self.max_limit, self.limit + 1)
+            elif issubclass(exc_type, (TimeoutError, asyncio.TimeoutError, httpx.TransportError)):
+                self.limit = max(self.min_limit, self.limit // 2)
+                print(f"[Limiter] ComfyUI 과부하 의심 ({exc_type.__name__}) - 동시 실행 한도 {self.limit}")
+            self._cond.notify_all()
+        return False
+
+
+comfy_limiter = AdaptiveLimiter(COMFY_MAX_CONCURRENCY)
+
+
+async def run_workflow(workflow: dict) -> dict:
+    """동시 실행 한도 안에서 워크플로우 실행"""
+    async with comfy_limiter:
+        return await client.execute_workflow(workflow, timeout=600)
+
+
+def limit_inflight(handler):
+    """엔드포인트별 세마포어로 동시 요청 수 제한
+
+    자리가 EDIT_ACQUIRE_TIMEOUT 안에 나지 않으면 ComfyUI 큐에 쌓지 않고 바로 503 반환
+    """
+    sema = asyncio.Semaphore(EDIT_MAX_INFLIGHT)
+    
+    @functools.wraps(handler)
+    async def wrapper(*args, **kwargs):
+        try:
+            await asyncio.wait_for(sema.acquire(), EDIT_ACQUIRE_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise HTTPException(
+                status_code=503,
+                detail="처리 중인 요청이 많습니다. 잠시 후 다시 시도하세요.",
+                headers={"Retry-After": "5"}
+            )
+        try:
+            return await handler(*args, **kwargs)
+        finally:
+            sema.release()
+    
+    return wrapper
+
+
+def first_output_image(result: dict) -> dict:
+    """실행 결과에서 첫 번째 출력 이미지 정보 (찾는 즉시 멈춤), 없으면 500"""
+    img_info = next(
+        (
+            img
+            for node_output in result.get("outputs", {}).values()
+            if isinstance(node_output, dict)
+            for img in node_output.get("images", ())
+        ),
+        None
+    )
+    if img_info is None:
+        raise HTTPException(status_code=500, detail="출력 이미지가 없습니다")
+    return img_info
+
+
+async def run_edit(
+    workflow: dict,
+    image_names: Tuple[Optional[str], ...],
+    prompt: str,
+    output_path: Optional[str] = None
+) -> Optional[bytes]:
+    """모든 편집 엔드포인트가 공유하는 실행 경로
+    
+    워크플로우에 이미지/프롬프트/시드를 넣고 실행한 뒤 첫 번째 결과 이미지를
+    output_path로 바로 저장 (output_path가 없으면 바이트로 반환)
+    """
+    workflow = client.update_workflow_images(workflow, *image_names)
+    workflow = client.update_workflow_prompt(workflow, prompt)
+    workflow = client.randomize_seed(workflow)
+    
+    result = await run_workflow(workflow)
+    
+    img_info = first_output_image(result)
+    source = (img_info["filename"], img_info.get("subfolder", ""), img_info.get("type", "output"))
+    if output_path is None:
+        return await client.get_image(*source)
+    await client.stream_image(*source, output_path)
+    return None
+
+
+def upload_ext(filename: Optional[str], default: str = ".png") -> str:
+    """업로드 파일명의 확장자 (없으면 default) - splitext 대신 rfind 한 번으로"""
+    if not filename:
+        return default
+    dot = filename.rfind(".")
+    return filename[dot:] if dot > filename.rfind("/") + 1 else default
+
+
+def png_filename(filename: Optional[str], default: str) -> str:
+    """세션 출력 파일명 정규화 (비어 있으면 default, .png가 없으면 붙임)"""
+    filename = filename or default
+    return filename if filename.endswith(".png") else f"{filename}.png"
+
+
+def next_file_id() -> str:
+    """업로드/출력 파일명에 쓰는 고유 ID"""
+    return f"{FILE_ID_PREFIX}_{next(_file_id_counter):06x}"
 
 
 def get_session_dir(session_id: str) -> str:
@@ -102,22 +308,207 @@ def get_session_dir(session_id: str) -> str:
     return session_dir
 
 
-async def ensure_default_face_uploaded():
-    """기본 얼굴 이미지가 ComfyUI에 업로드되었는지 확인하고 업로드"""
-    global default_face_uploaded
+def accel_redirect_headers(prefix: str, *parts: str) -> Dict[str, str]:
+    """nginx X-Accel-Redirect용 헤더 (경로는 URL 인코딩, 파일명은 FileResponse처럼 RFC 5987 형식)
     
-    if not os.path.exists(DEFAULT_FACE_PATH):
-        print(f"[Warning] 기본 얼굴 이미지 없음: {DEFAULT_FACE_PATH}")
-        return False
+    헤더는 latin-1로 인코딩되므로 한글 등 비ASCII 파일명을 그대로 넣으면 안 됨
+    """
+    filename = parts[-1]
+    quoted_name = quote(filename)
+    if quoted_name != filename:
+        disposition = f"attachment; filename*=utf-8''{quoted_name}"
+    else:
+        disposition = f'attachment; filename="{filename}"'
+    return {
+        "X-Accel-Redirect": "/".join([prefix.rstrip("/"), *(quote(part) for part in parts)]),
+        "Content-Disposition": disposition
+    }
+
+
+def copy_upload_file(upload: UploadFile, path: Union[str, Path]) -> int:
+    """업로드 임시파일을 1MB 버퍼로 path에 복사하고 바이트 수 반환 (스레드에서 실행)
     
-    if not default_face_uploaded:
+    임시 파일에 쓴 뒤 교체하므로 항상 새 inode가 됨 - 같은 이름으로 다시 올려도
+    ComfyUI input에 하드링크된 이전 파일을 덮어쓰지 않음
+    """
+    upload.file.seek(0)
+    part_path = f"{path}.{token_hex(4)}.part"
+    try:
+        with open(part_path, "wb") as f:
+            shutil.copyfileobj(upload.file, f, UPLOAD_COPY_BUFSIZE)
+            size = f.tell()
+        os.replace(part_path, path)
+    except BaseException:
         try:
-            await client.upload_image(DEFAULT_FACE_PATH, DEFAULT_FACE_FILENAME)
-            default_face_uploaded = True
-            print(f"[Default Face] ComfyUI에 업로드 완료: {DEFAULT_FACE_FILENAME}")
-        except Exception as e:
-            print(f"[Default Face] 업로드 실패: {e}")
+            os.unlink(part_path)
+        except FileNotFoundError:
+            pass
+        raise
+    return size
+
+
+async def save_upload(upload: UploadFile, path: Union[str, Path]) -> int:
+    """업로드 파일을 디스크에 저장하고 저장한 바이트 수 반환
+    
+    청크마다 이벤트 루프와 스레드를 오가지 않도록 복사 전체를 워커 스레드에서 한 번에 처리
+    """
+    return await asyncio.to_thread(copy_upload_file, upload, path)
+
+
+def link_into_comfy_input(path: Union[str, Path], name: str):
+    """저장된 파일을 ComfyUI input 폴더에 하드링크 (다른 파일시스템이면 sendfile 기반 복사)"""
+    dest = os.path.join(COMFY_INPUT_DIR, name)
+    # 임시 이름으로 연결한 뒤 원자적으로 교체 (input이 비는 순간이 없고, 같은 이름 동시 호출도 안전)
+    tmp = f"{dest}.{token_hex(4)}.tmp"
+    try:
+        try:
+            os.link(path, tmp)
+        except OSError:
+            shutil.copyfile(path, tmp)
+        os.replace(tmp, dest)
+    finally:
+        # 실패했거나, dest가 이미 같은 inode라 rename이 아무것도 하지 않은 경우 임시 링크 정리
+        try:
+            os.unlink(tmp)
+        except FileNotFoundError:
+            pass
+
+
+def copy_upload(upload: UploadFile, path: Path, name: str):
+    """업로드 임시파일을 path에 복사한 뒤 ComfyUI input 폴더에 연결 (스레드에서 실행)"""
+    copy_upload_file(upload, path)
+    link_into_comfy_input(path, name)
+
+
+async def save_and_upload(upload: UploadFile, filename: str, directory: Union[str, Path] = UPLOAD_PATH) -> str:
+    """업로드 파일을 directory에 저장한 뒤 ComfyUI로 전송
+    
+    업로드 임시파일을 디스크로 바로 복사한 다음, 저장된 파일을 ComfyUI에 업로드
+    (파일 읽기는 upload_image가 스레드에서 처리하므로 이벤트 루프를 막지 않음).
+    COMFY_INPUT_DIR가 설정되어 있으면 HTTP 업로드 대신 ComfyUI input 폴더에 직접 저장
+    """
+    path = Path(directory, filename)
+    if COMFY_INPUT_DIR:
+        await asyncio.to_thread(copy_upload, upload, path, filename)
+        return filename
+    
+    await save_upload(upload, path)
+    return await client.upload_image(str(path), filename)
+
+
+def hash_upload(upload: UploadFile) -> bytes:
+    """업로드 임시파일 내용의 BLAKE2b 해시 (읽은 뒤 처음으로 되감음)"""
+    h = hashlib.blake2b(digest_size=16)
+    f = upload.file
+    f.seek(0)
+    while chunk := f.read(UPLOAD_COPY_BUFSIZE):
+        h.update(chunk)
+    f.seek(0)
+    return h.digest()
+
+
+async def save_and_upload_cached(upload: UploadFile, filename: str, directory: Union[str, Path] = UPLOAD_PATH) -> str:
+    """save_and_upload와 같지만 최근에 같은 내용을 올린 적이 있으면 저장/업로드 없이 그 파일명 반환"""
+    digest = await asyncio.to_thread(hash_upload, upload)
+    cached = _upload_hash_cache.get(digest)
+    if cached is not None:
+        _upload_hash_cache.move_to_end(digest)
+        return cached
+    
+    comfy_name = await save_and_upload(upload, filename, directory)
+    _upload_hash_cache[digest] = comfy_name
+    if len(_upload_hash_cache) > UPLOAD_HASH_CACHE_SIZE:
+        _upload_hash_cache.popitem(last=False)
+    return comfy_name
+
+
+def map_file(path: str, st: os.stat_result) -> mmap.mmap:
+    """파일을 읽기 전용으로 mmap (mtime/크기가 같으면 이전 매핑 재사용)"""
+    key = (st.st_mtime_ns, st.st_size)
+    cached = _mapped_files.get(path)
+    if cached and cached[0] == key:
+        return cached[1]
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if cached:
+        cached[1].close()
+    _mapped_files[path] = (key, mapped)
+    return mapped
+
+
+async def ensure_uploaded(path: str, name: str, mapped: bool = False) -> bool:
+    """path의 현재 내용이 ComfyUI에 name으로 올라가 있지 않을 때만 업로드
+    
+    (경로, mtime, 크기)가 마지막 업로드와 같으면 건너뜀. 업로드했으면 True.
+    mapped면 파일을 매번 읽지 않고 mmap한 버퍼를 그대로 전송.
+    파일이 없으면 FileNotFoundError
+    """
+    lock = _upload_locks.setdefault(name, asyncio.Lock())
+    async with lock:
+        st = os.stat(path)
+        key = (path, st.st_mtime_ns, st.st_size)
+        if _uploaded_to_comfy.get(name) == key:
             return False
+        if COMFY_INPUT_DIR:
+            await asyncio.to_thread(link_into_comfy_input, path, name)
+        elif mapped:
+            await client.upload_image_bytes(map_file(path, st), name)
+        else:
+            await client.upload_image(path, name)
+        _uploaded_to_comfy[name] = key
+        return True
+
+
+async def upload_edit_images(
+    unique_id: str,
+    image1: UploadFile,
+    image2: Optional[UploadFile],
+    image3: Optional[UploadFile]
+) -> Tuple[str, Optional[str], Optional[str]]:
+    """편집용 이미지 1~3 저장 및 ComfyUI 업로드 (없는 참조 이미지는 None)"""
+    names = []
+    uploads = []
+    for index, image in enumerate((image1, image2, image3), start=1):
+        if index > 1 and not (image and image.filename):
+            names.append(None)
+            continue
+        name = f"edit_{unique_id}_{index}{upload_ext(image.filename)}"
+        names.append(name)
+        uploads.append(save_and_upload(image, name))
+    
+    # 서로 독립적인 업로드이므로 동시에 진행
+    await asyncio.gather(*uploads)
+    return tuple(names)
+
+
+async def ensure_session_image_uploaded(session_dir: str, filename: str):
+    """세션 이미지를 ComfyUI에 올림 (이미 같은 내용이면 생략), 없으면 404"""
+    try:
+        await ensure_uploaded(os.path.join(session_dir, filename), filename)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail=f"이미지를 찾을 수 없습니다: {filename}")
+
+
+async def ensure_default_face_uploaded(missing_detail: Optional[str] = None):
+    """기본 얼굴 이미지가 ComfyUI에 업로드되었는지 확인하고 업로드
+
+    missing_detail이 주어지면 파일이 없을 때 400 에러로 응답
+    (os.path.exists 사전 확인 대신 stat 실패를 그대로 사용)
+    """
+    global default_face_uploaded
+    
+    try:
+        if await ensure_uploaded(DEFAULT_FACE_PATH, DEFAULT_FACE_FILENAME, mapped=True):
+            print(f"[Default Face] ComfyUI에 업로드 완료: {DEFAULT_FACE_FILENAME}")
+        default_face_uploaded = True
+    except FileNotFoundError:
+        if missing_detail:
+            raise HTTPException(status_code=400, detail=missing_detail)
+        print(f"[Warning] 기본 얼굴 이미지 없음: {DEFAULT_FACE_PATH}")
+        return False
+    except Exception as e:
+        print(f"[Default Face] 업로드 실패: {e}")
+        return False
     
     return True
 
@@ -198,13 +589,15 @@ async def startup_event():
     print(f"Workflow Path: {WORKFLOW_PATH}")
     print(f"Default Face Path: {DEFAULT_FACE_PATH}")
     
-    cleanup_old_files(OUTPUT_DIR)
-    cleanup_old_files(UPLOAD_DIR)
+    await asyncio.to_thread(cleanup_old_files, OUTPUT_DIR)
+    await asyncio.to_thread(cleanup_old_files, UPLOAD_DIR)
     
     asyncio.create_task(periodic_cleanup())
     print(f"[Cleanup] 자동 파일 정리 활성화 ({FILE_MAX_AGE_HOURS}시간 이상 파일 삭제)")
     
     if os.path.exists(WORKFLOW_PATH):
+        # 첫 요청 전에 파싱해 캐시에 올려둠
+        await asyncio.to_thread(client.load_workflow, WORKFLOW_PATH)
         print(f"워크플로우 파일 확인됨: {WORKFLOW_PATH}")
     else:
         print(f"경고: 워크플로우 파일이 없습니다: {WORKFLOW_PATH}")
@@ -221,6 +614,12 @@ async def startup_event():
         print(f"[Default Face] 경고: 기본 얼굴 이미지 없음 - /default-face API로 업로드하세요")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """서버 종료 시 공유 HTTP 연결 정리"""
+    await client.aclose()
+
+
 # ============================================
 # API 엔드포인트
 # ============================================
@@ -235,6 +634,7 @@ async def root():
             "POST /edit/gigi": "⭐ 지지 얼굴 기반 편집 (기본 얼굴 자동 적용)",
             "POST /session/edit/gigi": "⭐ 세션 기반 지지 얼굴 편집",
             "POST /edit": "이미지 편집 (Form-data, 3개 이미지)",
+            "POST /edit/stream": "이미지 편집 (Form-data, 결과 PNG 바로 반환)",
             "POST /edit/json": "이미지 편집 (JSON)",
             "POST /session/edit": "세션 기반 이미지 편집",
             "GET /default-face": "기본 얼굴 이미지 확인",
@@ -256,11 +656,9 @@ async def health_check():
     """헬스 체크"""
     comfyui_ok = False
     try:
-        import httpx
-        async with httpx.AsyncClient(timeout=5.0) as http_client:
-            response = await http_client.get(f"{COMFYUI_URL}/system_stats")
-            comfyui_ok = response.status_code == 200
-    except:
+        response = await client.http.get("/system_stats", timeout=5.0)
+        comfyui_ok = response.status_code == 200
+    except (httpx.HTTPError, asyncio.TimeoutError):
         pass
     
     return HealthResponse(
@@ -278,11 +676,12 @@ async def health_check():
 @app.get("/default-face", response_model=DefaultFaceResponse, tags=["Default Face"])
 async def get_default_face():
     """기본 얼굴 이미지 정보 확인"""
-    exists = os.path.exists(DEFAULT_FACE_PATH)
-    size_mb = None
-    
-    if exists:
-        size_mb = round(os.path.getsize(DEFAULT_FACE_PATH) / (1024 * 1024), 2)
+    try:
+        size_mb = round(os.stat(DEFAULT_FACE_PATH).st_size / (1024 * 1024), 2)
+        exists = True
+    except FileNotFoundError:
+        exists = False
+        size_mb = None
     
     return DefaultFaceResponse(
         exists=exists,
@@ -301,16 +700,17 @@ async def upload_default_face(
     global default_face_uploaded
     
     try:
-        # 파일 저장
-        content = await image.read()
-        with open(DEFAULT_FACE_PATH, "wb") as f:
-            f.write(content)
+        # 파일 저장 (청크 단위 스트리밍)
+        # 기존 파일은 mmap되어 있을 수 있으므로 제자리에서 자르지 않고 임시파일로 저장 후 교체
+        tmp_path = f"{DEFAULT_FACE_PATH}.tmp"
+        size = await save_upload(image, tmp_path)
+        os.replace(tmp_path, DEFAULT_FACE_PATH)
         
         # ComfyUI에 업로드
-        await client.upload_image(DEFAULT_FACE_PATH, DEFAULT_FACE_FILENAME)
+        await ensure_uploaded(DEFAULT_FACE_PATH, DEFAULT_FACE_FILENAME, mapped=True)
         default_face_uploaded = True
         
-        size_mb = round(len(content) / (1024 * 1024), 2)
+        size_mb = round(size / (1024 * 1024), 2)
         
         return {
             "success": True,
@@ -327,16 +727,25 @@ async def upload_default_face(
 @app.get("/default-face/image", tags=["Default Face"])
 async def download_default_face():
     """기본 얼굴 이미지 다운로드"""
-    if not os.path.exists(DEFAULT_FACE_PATH):
+    try:
+        stat_result = os.stat(DEFAULT_FACE_PATH)
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail="기본 얼굴 이미지가 설정되지 않았습니다")
     
-    return FileResponse(DEFAULT_FACE_PATH, media_type="image/png", filename=DEFAULT_FACE_FILENAME)
+    # stat 결과를 넘겨 FileResponse의 중복 stat 생략
+    return FileResponse(
+        DEFAULT_FACE_PATH,
+        media_type="image/png",
+        filename=DEFAULT_FACE_FILENAME,
+        stat_result=stat_result
+    )
 
 
 # ============================================
 # 지지 얼굴 기반 편집 엔드포인트 (핵심!)
 # ============================================
 @app.post("/edit/gigi", response_model=ImageEditResponse, tags=["GiGi Edit"])
+@limit_inflight
 async def edit_with_gigi_face(
     prompt: str = Form(..., description="편집 프롬프트 (포즈, 표정, 스타일 등 텍스트로 지정)"),
     style_image: UploadFile = File(default=None, description="스타일 참조 이미지 1 (헤어, 메이크업 등)"),
@@ -353,79 +762,45 @@ async def edit_with_gigi_face(
     start_time = time.time()
     
     try:
-        # 기본 얼굴 이미지 확인
-        if not os.path.exists(DEFAULT_FACE_PATH):
-            raise HTTPException(
-                status_code=400, 
-                detail="기본 얼굴 이미지가 설정되지 않았습니다. POST /default-face로 먼저 업로드하세요."
-            )
-        
-        # ComfyUI에 기본 얼굴 업로드 확인
-        await ensure_default_face_uploaded()
-        
-        if not os.path.exists(WORKFLOW_PATH):
-            raise HTTPException(status_code=500, detail="워크플로우 파일이 없습니다")
+        workflow = get_workflow()
+        unique_id = next_file_id()
         
-        workflow = client.load_workflow(WORKFLOW_PATH)
-        unique_id = str(uuid.uuid4())[:8]
+        # ComfyUI 업로드는 서로 독립적이므로 모아서 동시에 진행 (기본 얼굴 포함)
+        # 기본 얼굴 이미지 확인은 업로드 시 stat 결과로 대신함 (없으면 400)
+        uploads = [ensure_default_face_uploaded(
+            missing_detail="기본 얼굴 이미지가 설정되지 않았습니다. POST /default-face로 먼저 업로드하세요."
+        )]
         
         # Image 2 (스타일 참조 1) 처리
         image2_filename = None
         if style_image and style_image.filename:
-            ext2 = os.path.splitext(style_image.filename)[1] or ".png"
+            ext2 = upload_ext(style_image.filename)
             image2_filename = f"gigi_{unique_id}_style1{ext2}"
-            image2_path = os.path.join(UPLOAD_DIR, image2_filename)
-            with open(image2_path, "wb") as f:
-                f.write(await style_image.read())
-            await client.upload_image(image2_path, image2_filename)
+            uploads.append(save_and_upload_cached(style_image, image2_filename))
         
         # Image 3 (스타일 참조 2) 처리
         image3_filename = None
         if style_image2 and style_image2.filename:
-            ext3 = os.path.splitext(style_image2.filename)[1] or ".png"
+            ext3 = upload_ext(style_image2.filename)
             image3_filename = f"gigi_{unique_id}_style2{ext3}"
-            image3_path = os.path.join(UPLOAD_DIR, image3_filename)
-            with open(image3_path, "wb") as f:
-                f.write(await style_image2.read())
-            await client.upload_image(image3_path, image3_filename)
-        
-        # 워크플로우 업데이트 (image1 = 기본 지지 얼굴)
-        workflow = client.update_workflow_images(
-            workflow, 
-            DEFAULT_FACE_FILENAME,  # 항상 기본 지지 얼굴 사용
-            image2_filename, 
-            image3_filename
-        )
-        workflow = client.update_workflow_prompt(workflow, prompt)
-        workflow = client.randomize_seed(workflow)
-        
-        result = await client.execute_workflow(workflow, timeout=600)
-        
-        # 결과 이미지 처리
-        outputs = result.get("outputs", {})
-        output_images = []
-        for node_id, node_output in outputs.items():
-            if isinstance(node_output, dict) and "images" in node_output:
-                for img in node_output["images"]:
-                    output_images.append(img)
-        
-        if not output_images:
-            raise HTTPException(status_code=500, detail="출력 이미지가 없습니다")
-        
-        img_info = output_images[0]
-        img_bytes = await client.get_image(
-            img_info["filename"],
-            img_info.get("subfolder", ""),
-            img_info.get("type", "output")
+            uploads.append(save_and_upload_cached(style_image2, image3_filename))
+        
+        # 같은 스타일 이미지를 다시 보낸 경우 이전에 올린 ComfyUI 파일명을 그대로 사용
+        _, *style_names = await asyncio.gather(*uploads)
+        if image2_filename:
+            image2_filename = style_names.pop(0)
+        if image3_filename:
+            image3_filename = style_names.pop(0)
+        
+        # image1 = 항상 기본 지지 얼굴
+        output_filename = f"gigi_{unique_id}.png"
+        await run_edit(
+            workflow,
+            (DEFAULT_FACE_FILENAME, image2_filename, image3_filename),
+            prompt,
+            os.path.join(OUTPUT_DIR, output_filename)
         )
         
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        output_filename = f"gigi_{timestamp}_{unique_id}.png"
-        output_path = os.path.join(OUTPUT_DIR, output_filename)
-        
-        with open(output_path, "wb") as f:
-            f.write(img_bytes)
-        
         processing_time = time.time() - start_time
         
         return ImageEditResponse(
@@ -439,12 +814,12 @@ async def edit_with_gigi_face(
     except HTTPException:
         raise
     except Exception as e:
-        import traceback
-        print(f"[ERROR] /edit/gigi 실패:\n{traceback.format_exc()}")
+        logger.exception("/edit/gigi 실패")
         raise HTTPException(status_code=500, detail=f"이미지 편집 실패: {str(e)}")
 
 
 @app.post("/session/edit/gigi", response_model=ImageEditResponse, tags=["GiGi Edit"])
+@limit_inflight
 async def session_edit_with_gigi_face(
     session_id: str = Form(..., description="세션 ID"),
     prompt: str = Form(..., description="편집 프롬프트 (포즈, 표정, 스타일 등 텍스트로 지정)"),
@@ -465,79 +840,39 @@ async def session_edit_with_gigi_face(
     try:
         session_dir = get_session_dir(session_id)
         
-        # 기본 얼굴 이미지 확인
-        if not os.path.exists(DEFAULT_FACE_PATH):
-            raise HTTPException(
-                status_code=400, 
-                detail="기본 얼굴 이미지가 설정되지 않았습니다."
-            )
-        
-        await ensure_default_face_uploaded()
-        
-        if not os.path.exists(WORKFLOW_PATH):
-            raise HTTPException(status_code=500, detail="워크플로우 파일이 없습니다")
+        workflow = get_workflow()
+        unique_id = next_file_id()
         
-        workflow = client.load_workflow(WORKFLOW_PATH)
-        unique_id = str(uuid.uuid4())[:8]
+        # ComfyUI 업로드는 서로 독립적이므로 모아서 동시에 진행 (기본 얼굴 포함)
+        # 기본 얼굴 이미지 확인은 업로드 시 stat 결과로 대신함 (없으면 400)
+        uploads = [ensure_default_face_uploaded(
+            missing_detail="기본 얼굴 이미지가 설정되지 않았습니다."
+        )]
         
         # Image 2 (스타일 참조 1) 처리 - 파일 업로드
         image2_filename = None
         if style_image and style_image.filename:
-            ext2 = os.path.splitext(style_image.filename)[1] or ".png"
+            ext2 = upload_ext(style_image.filename)
             image2_filename = f"gigi_{unique_id}_style1{ext2}"
-            image2_path = os.path.join(session_dir, image2_filename)
-            with open(image2_path, "wb") as f:
-                f.write(await style_image.read())
-            await client.upload_image(image2_path, image2_filename)
+            uploads.append(save_and_upload(style_image, image2_filename, session_dir))
         
         # Image 3 (스타일 참조 2) 처리 - 파일 업로드
         image3_filename = None
         if style_image2 and style_image2.filename:
-            ext3 = os.path.splitext(style_image2.filename)[1] or ".png"
+            ext3 = upload_ext(style_image2.filename)
             image3_filename = f"gigi_{unique_id}_style2{ext3}"
-            image3_path = os.path.join(session_dir, image3_filename)
-            with open(image3_path, "wb") as f:
-                f.write(await style_image2.read())
-            await client.upload_image(image3_path, image3_filename)
-        
-        # 워크플로우 업데이트 (image1 = 기본 지지 얼굴)
-        workflow = client.update_workflow_images(
-            workflow, 
-            DEFAULT_FACE_FILENAME,
-            image2_filename, 
-            image3_filename
-        )
-        workflow = client.update_workflow_prompt(workflow, prompt)
-        workflow = client.randomize_seed(workflow)
-        
-        result = await client.execute_workflow(workflow, timeout=600)
-        
-        # 결과 이미지 처리
-        outputs = result.get("outputs", {})
-        output_images = []
-        for node_id, node_output in outputs.items():
-            if isinstance(node_output, dict) and "images" in node_output:
-                for img in node_output["images"]:
-                    output_images.append(img)
-        
-        if not output_images:
-            raise HTTPException(status_code=500, detail="출력 이미지가 없습니다")
-        
-        img_info = output_images[0]
-        img_bytes = await client.get_image(
-            img_info["filename"],
-            img_info.get("subfolder", ""),
-            img_info.get("type", "output")
-        )
+            uploads.append(save_and_upload(style_image2, image3_filename, session_dir))
         
-        # 세션 폴더에 저장
-        final_output_filename = output_filename or "gigi_styled.png"
-        if not final_output_filename.endswith(".png"):
-            final_output_filename += ".png"
-        output_path = os.path.join(session_dir, final_output_filename)
+        await asyncio.gather(*uploads)
         
-        with open(output_path, "wb") as f:
-            f.write(img_bytes)
+        # image1 = 항상 기본 지지 얼굴, 결과는 세션 폴더에 저장
+        final_output_filename = png_filename(output_filename, "gigi_styled.png")
+        await run_edit(
+            workflow,
+            (DEFAULT_FACE_FILENAME, image2_filename, image3_filename),
+            prompt,
+            os.path.join(session_dir, final_output_filename)
+        )
         
         processing_time = time.time() - start_time
         
@@ -553,8 +888,7 @@ async def session_edit_with_gigi_face(
     except HTTPException:
         raise
     except Exception as e:
-        import traceback
-        print(f"[ERROR] /session/edit/gigi 실패:\n{traceback.format_exc()}")
+        logger.exception("/session/edit/gigi 실패")
         raise HTTPException(status_code=500, detail=f"이미지 편집 실패: {str(e)}")
 
 
@@ -562,6 +896,7 @@ async def session_edit_with_gigi_face(
 # 일반 편집 엔드포인트 (기존 유지)
 # ============================================
 @app.post("/edit", response_model=ImageEditResponse, tags=["Edit"])
+@limit_inflight
 async def edit_image_form(
     prompt: str = Form(..., description="편집 프롬프트"),
     image1: UploadFile = File(..., description="첫 번째 이미지 (메인)"),
@@ -572,69 +907,13 @@ async def edit_image_form(
     start_time = time.time()
     
     try:
-        if not os.path.exists(WORKFLOW_PATH):
-            raise HTTPException(status_code=500, detail="워크플로우 파일이 없습니다")
+        workflow = get_workflow()
+        unique_id = next_file_id()
         
-        workflow = client.load_workflow(WORKFLOW_PATH)
-        unique_id = str(uuid.uuid4())[:8]
+        image_names = await upload_edit_images(unique_id, image1, image2, image3)
         
-        # Image 1
-        ext1 = os.path.splitext(image1.filename)[1] or ".png"
-        image1_filename = f"edit_{unique_id}_1{ext1}"
-        image1_path = os.path.join(UPLOAD_DIR, image1_filename)
-        with open(image1_path, "wb") as f:
-            f.write(await image1.read())
-        await client.upload_image(image1_path, image1_filename)
-        
-        # Image 2
-        image2_filename = None
-        if image2 and image2.filename:
-            ext2 = os.path.splitext(image2.filename)[1] or ".png"
-            image2_filename = f"edit_{unique_id}_2{ext2}"
-            image2_path = os.path.join(UPLOAD_DIR, image2_filename)
-            with open(image2_path, "wb") as f:
-                f.write(await image2.read())
-            await client.upload_image(image2_path, image2_filename)
-        
-        # Image 3
-        image3_filename = None
-        if image3 and image3.filename:
-            ext3 = os.path.splitext(image3.filename)[1] or ".png"
-            image3_filename = f"edit_{unique_id}_3{ext3}"
-            image3_path = os.path.join(UPLOAD_DIR, image3_filename)
-            with open(image3_path, "wb") as f:
-                f.write(await image3.read())
-            await client.upload_image(image3_path, image3_filename)
-        
-        workflow = client.update_workflow_images(workflow, image1_filename, image2_filename, image3_filename)
-        workflow = client.update_workflow_prompt(workflow, prompt)
-        workflow = client.randomize_seed(workflow)
-        
-        result = await client.execute_workflow(workflow, timeout=600)
-        
-        outputs = result.get("outputs", {})
-        output_images = []
-        for node_id, node_output in outputs.items():
-            if isinstance(node_output, dict) and "images" in node_output:
-                for img in node_output["images"]:
-                    output_images.append(img)
-        
-        if not output_images:
-            raise HTTPException(status_code=500, detail="출력 이미지가 없습니다")
-        
-        img_info = output_images[0]
-        img_bytes = await client.get_image(
-            img_info["filename"],
-            img_info.get("subfolder", ""),
-            img_info.get("type", "output")
-        )
-        
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        output_filename = f"qwen_{timestamp}_{unique_id}.png"
-        output_path = os.path.join(OUTPUT_DIR, output_filename)
-        
-        with open(output_path, "wb") as f:
-            f.write(img_bytes)
+        output_filename = f"qwen_{unique_id}.png"
+        await run_edit(workflow, image_names, prompt, os.path.join(OUTPUT_DIR, output_filename))
         
         processing_time = time.time() - start_time
         
@@ -648,57 +927,59 @@ async def edit_image_form(
     except HTTPException:
         raise
     except Exception as e:
-        import traceback
-        print(f"[ERROR] /edit 실패:\n{traceback.format_exc()}")
+        logger.exception("/edit 실패")
         raise HTTPException(status_code=500, detail=f"이미지 편집 실패: {str(e)}")
 
 
-@app.post("/edit/json", response_model=ImageEditResponse, tags=["Edit"])
-async def edit_image_json(request: ImageEditRequest):
-    """이미지 편집 (JSON) - 미리 업로드된 이미지 사용"""
+@app.post("/edit/stream", tags=["Edit"])
+@limit_inflight
+async def edit_image_stream(
+    prompt: str = Form(..., description="편집 프롬프트"),
+    image1: UploadFile = File(..., description="첫 번째 이미지 (메인)"),
+    image2: UploadFile = File(default=None, description="두 번째 이미지 (참조1)"),
+    image3: UploadFile = File(default=None, description="세 번째 이미지 (참조2)"),
+):
+    """이미지 편집 (Form-data) - 결과 PNG를 디스크에 저장하지 않고 응답 본문으로 바로 반환
+    
+    /output/{filename} 재요청이 필요 없는 단발성 클라이언트용 (결과 파일은 남지 않음)
+    """
     start_time = time.time()
     
     try:
-        if not os.path.exists(WORKFLOW_PATH):
-            raise HTTPException(status_code=500, detail="워크플로우 파일이 없습니다")
+        workflow = get_workflow()
+        unique_id = next_file_id()
         
-        workflow = client.load_workflow(WORKFLOW_PATH)
+        image_names = await upload_edit_images(unique_id, image1, image2, image3)
         
-        workflow = client.update_workflow_images(
-            workflow,
-            request.image1_filename,
-            request.image2_filename,
-            request.image3_filename
-        )
-        workflow = client.update_workflow_prompt(workflow, request.prompt)
-        workflow = client.randomize_seed(workflow)
-        
-        result = await client.execute_workflow(workflow, timeout=600)
-        
-        outputs = result.get("outputs", {})
-        output_images = []
-        for node_id, node_output in outputs.items():
-            if isinstance(node_output, dict) and "images" in node_output:
-                for img in node_output["images"]:
-                    output_images.append(img)
-        
-        if not output_images:
-            raise HTTPException(status_code=500, detail="출력 이미지가 없습니다")
-        
-        img_info = output_images[0]
-        img_bytes = await client.get_image(
-            img_info["filename"],
-            img_info.get("subfolder", ""),
-            img_info.get("type", "output")
-        )
+        img_bytes = await run_edit(workflow, image_names, prompt)
         
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        unique_id = str(uuid.uuid4())[:8]
-        output_filename = f"qwen_{timestamp}_{unique_id}.png"
-        output_path = os.path.join(OUTPUT_DIR, output_filename)
+        processing_time = time.time() - start_time
         
-        with open(output_path, "wb") as f:
-            f.write(img_bytes)
+        return Response(
+            content=img_bytes,
+            media_type="image/png",
+            headers={"X-Processing-Time": f"{processing_time:.2f}"}
+        )
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception("/edit/stream 실패")
+        raise HTTPException(status_code=500, detail=f"이미지 편집 실패: {str(e)}")
+
+
+@app.post("/edit/json", response_model=ImageEditResponse, tags=["Edit"])
+@limit_inflight
+async def edit_image_json(request: ImageEditRequest):
+    """이미지 편집 (JSON) - 미리 업로드된 이미지 사용"""
+    start_time = time.time()
+    
+    try:
+        workflow = get_workflow()
+        image_names = (request.image1_filename, request.image2_filename, request.image3_filename)
+        
+        output_filename = f"qwen_{next_file_id()}.png"
+        await run_edit(workflow, image_names, request.prompt, os.path.join(OUTPUT_DIR, output_filename))
         
         processing_time = time.time() - start_time
         
@@ -712,8 +993,7 @@ async def edit_image_json(request: ImageEditRequest):
     except HTTPException:
         raise
     except Exception as e:
-        import traceback
-        print(f"[ERROR] /edit/json 실패:\n{traceback.format_exc()}")
+        logger.exception("/edit/json 실패")
         raise HTTPException(status_code=500, detail=f"이미지 편집 실패: {str(e)}")
 
 
@@ -721,6 +1001,7 @@ async def edit_image_json(request: ImageEditRequest):
 # 세션 기반 엔드포인트
 # ============================================
 @app.post("/session/edit", response_model=ImageEditResponse, tags=["Session"])
+@limit_inflight
 async def session_edit_image(request: SessionImageEditRequest):
     """세션 기반 이미지 편집 (v2: 최대 3개 이미지)"""
     start_time = time.time()
@@ -728,65 +1009,24 @@ async def session_edit_image(request: SessionImageEditRequest):
     try:
         session_dir = get_session_dir(request.session_id)
         
-        if not os.path.exists(WORKFLOW_PATH):
-            raise HTTPException(status_code=500, detail="워크플로우 파일이 없습니다")
+        workflow = get_workflow()
         
-        workflow = client.load_workflow(WORKFLOW_PATH)
+        # Image 1 (필수), Image 2/3 (선택)
+        image_names = (request.image1_filename, request.image2_filename, request.image3_filename)
         
-        # Image 1
-        image1_path = os.path.join(session_dir, request.image1_filename)
-        if not os.path.exists(image1_path):
-            raise HTTPException(status_code=404, detail=f"이미지를 찾을 수 없습니다: {request.image1_filename}")
-        await client.upload_image(image1_path, request.image1_filename)
+        # 세션 폴더를 한 번만 훑어 업로드 시작 전에 없는 파일을 걸러냄
+        existing = await asyncio.to_thread(list_file_names, session_dir)
+        for name in image_names:
+            if name and name not in existing:
+                raise HTTPException(status_code=404, detail=f"이미지를 찾을 수 없습니다: {name}")
         
-        # Image 2
-        image2_filename = None
-        if request.image2_filename:
-            image2_path = os.path.join(session_dir, request.image2_filename)
-            if not os.path.exists(image2_path):
-                raise HTTPException(status_code=404, detail=f"이미지를 찾을 수 없습니다: {request.image2_filename}")
-            await client.upload_image(image2_path, request.image2_filename)
-            image2_filename = request.image2_filename
-        
-        # Image 3
-        image3_filename = None
-        if request.image3_filename:
-            image3_path = os.path.join(session_dir, request.image3_filename)
-            if not os.path.exists(image3_path):
-                raise HTTPException(status_code=404, detail=f"이미지를 찾을 수 없습니다: {request.image3_filename}")
-            await client.upload_image(image3_path, request.image3_filename)
-            image3_filename = request.image3_filename
-        
-        workflow = client.update_workflow_images(workflow, request.image1_filename, image2_filename, image3_filename)
-        workflow = client.update_workflow_prompt(workflow, request.prompt)
-        workflow = client.randomize_seed(workflow)
-        
-        result = await client.execute_workflow(workflow, timeout=600)
-        
-        outputs = result.get("outputs", {})
-        output_images = []
-        for node_id, node_output in outputs.items():
-            if isinstance(node_output, dict) and "images" in node_output:
-                for img in node_output["images"]:
-                    output_images.append(img)
-        
-        if not output_images:
-            raise HTTPException(status_code=500, detail="출력 이미지가 없습니다")
-        
-        img_info = output_images[0]
-        img_bytes = await client.get_image(
-            img_info["filename"],
-            img_info.get("subfolder", ""),
-            img_info.get("type", "output")
-        )
+        # 서로 독립적인 업로드이므로 동시에 진행
+        await asyncio.gather(*[
+            ensure_session_image_uploaded(session_dir, name) for name in image_names if name
+        ])
         
-        output_filename = request.output_filename or "edited.png"
-        if not output_filename.endswith(".png"):
-            output_filename += ".png"
-        output_path = os.path.join(session_dir, output_filename)
-        
-        with open(output_path, "wb") as f:
-            f.write(img_bytes)
+        output_filename = png_filename(request.output_filename, "edited.png")
+        await run_edit(workflow, image_names, request.prompt, os.path.join(session_dir, output_filename))
         
         processing_time = time.time() - start_time
         
@@ -801,8 +1041,7 @@ async def session_edit_image(request: SessionImageEditRequest):
     except HTTPException:
         raise
     except Exception as e:
-        import traceback
-        print(f"[ERROR] /session/edit 실패:\n{traceback.format_exc()}")
+        logger.exception("/session/edit 실패")
         raise HTTPException(status_code=500, detail=f"이미지 편집 실패: {str(e)}")
 
 
@@ -811,19 +1050,11 @@ async def list_session_files(session_id: str):
     """세션 폴더 내 파일 목록 조회"""
     session_dir = os.path.join(SHARED_DIR, session_id)
     
-    if not os.path.exists(session_dir):
+    try:
+        files = await asyncio.to_thread(list_files, session_dir)
+    except FileNotFoundError:
         return {"session_id": session_id, "files": [], "count": 0, "exists": False}
     
-    files = []
-    for f in Path(session_dir).glob("*"):
-        if f.is_file():
-            files.append({
-                "filename": f.name,
-                "size_mb": round(f.stat().st_size / (1024 * 1024), 2),
-                "created": datetime.fromtimestamp(f.stat().st_ctime).isoformat()
-            })
-    files.sort(key=lambda x: x["created"], reverse=True)
-    
     return {"session_id": session_id, "files": files, "count": len(files), "exists": True}
 
 
@@ -832,38 +1063,67 @@ async def get_session_file(session_id: str, filename: str):
     """세션 폴더 내 파일 다운로드"""
     filepath = os.path.join(SHARED_DIR, session_id, filename)
     
-    if not os.path.exists(filepath):
+    try:
+        stat_result = os.stat(filepath)
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail="파일을 찾을 수 없습니다")
     
-    return FileResponse(filepath, media_type="image/png", filename=filename)
+    # nginx가 파일을 직접 전송 (stat은 존재 확인용으로만 사용)
+    if SESSION_ACCEL_PREFIX:
+        return Response(
+            media_type="image/png",
+            headers=accel_redirect_headers(SESSION_ACCEL_PREFIX, session_id, filename)
+        )
+    
+    return FileResponse(filepath, media_type="image/png", filename=filename, stat_result=stat_result)
 
 
 # ============================================
 # 출력 엔드포인트
 # ============================================
 @app.get("/output/{filename}", tags=["Output"])
-async def get_output(filename: str):
+async def get_output(filename: str, request: Request):
     """결과 이미지 다운로드"""
     filepath = os.path.join(OUTPUT_DIR, filename)
     
-    if not os.path.exists(filepath):
+    try:
+        stat_result = os.stat(filepath)
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail="파일을 찾을 수 없습니다")
     
-    return FileResponse(filepath, media_type="image/png", filename=filename)
+    # 출력 파일은 생성 후 바뀌지 않으므로 재요청은 본문 없이 304 응답
+    etag = f'"{stat_result.st_size:x}-{int(stat_result.st_mtime):x}"'
+    cache_headers = {
+        "ETag": etag,
+        "Cache-Control": "public, max-age=3600"
+    }
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=cache_headers)
+    
+    # nginx가 파일을 직접 전송 (Python을 거치지 않음)
+    if OUTPUT_ACCEL_PREFIX:
+        return Response(
+            media_type="image/png",
+            headers={
+                **cache_headers,
+                **accel_redirect_headers(OUTPUT_ACCEL_PREFIX, filename)
+            }
+        )
+    
+    # stat 결과를 넘겨 FileResponse의 중복 stat 생략
+    return FileResponse(
+        filepath,
+        media_type="image/png",
+        filename=filename,
+        stat_result=stat_result,
+        headers=cache_headers
+    )
 
 
 @app.get("/outputs", tags=["Output"])
 async def list_outputs():
     """결과 이미지 목록"""
-    files = []
-    for f in Path(OUTPUT_DIR).glob("*.png"):
-        if f.is_file():
-            files.append({
-                "filename": f.name,
-                "size_mb": round(f.stat().st_size / (1024 * 1024), 2),
-                "created": datetime.fromtimestamp(f.stat().st_ctime).isoformat()
-            })
-    files.sort(key=lambda x: x["created"], reverse=True)
+    files = await asyncio.to_thread(list_files, OUTPUT_DIR, ".png")
     return {"files": files, "count": len(files)}
 
 
@@ -872,4 +1132,4 @@ async def list_outputs():
 # ============================================
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=4100)
+    uvicorn.run(app, host="0.0.0.0", port=4100, http="httptools")
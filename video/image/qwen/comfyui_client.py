@@ -3,58 +3,110 @@ ComfyUI API Client
 ComfyUI 서버와 통신하는 클라이언트
 """
 
-import json
+import os
+import orjson
 import uuid
+import logging
+import functools
 import httpx
+import aiofiles
 import websockets
 import asyncio
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Union, BinaryIO, List, Tuple
 import base64
 from pathlib import Path
 
+logger = logging.getLogger(__name__)
+
+# ComfyUI가 보내는 progress 메시지의 시작 부분 (json.dumps 기본 구분자)
+PROGRESS_FRAME_PREFIX = '{"type": "progress"'
+
+# /view 응답을 디스크로 옮길 때의 청크 크기
+STREAM_CHUNK_SIZE = 1 << 20
+
+
+@functools.lru_cache(maxsize=8)
+def _load_workflow_cached(workflow_path: str, mtime_ns: int) -> Dict[str, Any]:
+    """(경로, 수정 시각)별로 파싱된 워크플로우 캐시 - 파일이 바뀌면 mtime이 달라져 다시 읽음"""
+    with open(workflow_path, "rb") as f:
+        return orjson.loads(f.read())
+
 
 class ComfyUIClient:
     def __init__(self, server_url: str = "http://localhost:8188"):
         self.server_url = server_url.rstrip("/")
         self.client_id = str(uuid.uuid4())
+        self._http: Optional[httpx.AsyncClient] = None
+        # (워크플로우 객체, 수정 대상 노드 인덱스) - 같은 템플릿이면 재스캔하지 않음
+        self._node_index_cache: Optional[Tuple[Dict[str, Any], Dict[str, list]]] = None
+        # 마지막으로 만든 복사본과 그 인덱스 (update_* 연속 호출 시 재스캔 방지)
+        self._derived_index: Optional[Tuple[Dict[str, Any], Dict[str, list]]] = None
+    
+    @property
+    def http(self) -> httpx.AsyncClient:
+        """keep-alive 연결을 재사용하는 공유 HTTP 클라이언트 (처음 사용할 때 생성)"""
+        if self._http is None or self._http.is_closed:
+            self._http = httpx.AsyncClient(
+                base_url=self.server_url,
+                # HTTP/2는 TLS(ALPN)로만 협상됨 - 평문 http://는 HTTP/1.1 그대로 사용
+                http2=self.server_url.startswith("https://"),
+                timeout=httpx.Timeout(60.0, read=300.0),
+                limits=httpx.Limits(
+                    max_keepalive_connections=20,
+                    max_connections=50,
+                    keepalive_expiry=30
+                )
+            )
+        return self._http
+    
+    async def aclose(self):
+        """공유 HTTP 클라이언트 종료"""
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+    
+    async def __aenter__(self) -> "ComfyUIClient":
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
     
     async def upload_image(self, image_path: str, filename: Optional[str] = None) -> str:
         """이미지를 ComfyUI 서버에 업로드"""
         if filename is None:
             filename = Path(image_path).name
         
-        async with httpx.AsyncClient() as client:
-            with open(image_path, "rb") as f:
-                files = {"image": (filename, f, "image/png")}
-                data = {"overwrite": "true"}
-                response = await client.post(
-                    f"{self.server_url}/upload/image",
-                    files=files,
-                    data=data
-                )
-                
-                if response.status_code != 200:
-                    print(f"[Upload Error] Status: {response.status_code}")
-                    print(f"[Upload Error] Response: {response.text}")
-                    raise Exception(f"ComfyUI 이미지 업로드 실패 (Status {response.status_code}): {response.text}")
-                
-                result = response.json()
-                print(f"[Upload Success] {filename} -> {result}")
-                return result.get("name", filename)
+        # 파일 읽기는 스레드에서 (이벤트 루프 블로킹 방지)
+        image_bytes = await asyncio.to_thread(Path(image_path).read_bytes)
+        files = {"image": (filename, image_bytes, "image/png")}
+        data = {"overwrite": "true"}
+        response = await self.http.post(
+            "/upload/image",
+            files=files,
+            data=data
+        )
+        
+        if response.status_code != 200:
+            print(f"[Upload Error] Status: {response.status_code}")
+            print(f"[Upload Error] Response: {response.text}")
+            raise Exception(f"ComfyUI 이미지 업로드 실패 (Status {response.status_code}): {response.text}")
+        
+        result = orjson.loads(response.content)
+        print(f"[Upload Success] {filename} -> {result}")
+        return result.get("name", filename)
     
-    async def upload_image_bytes(self, image_bytes: bytes, filename: str) -> str:
-        """바이트 데이터로 이미지 업로드"""
-        async with httpx.AsyncClient() as client:
-            files = {"image": (filename, image_bytes, "image/png")}
-            data = {"overwrite": "true"}
-            response = await client.post(
-                f"{self.server_url}/upload/image",
-                files=files,
-                data=data
-            )
-            response.raise_for_status()
-            result = response.json()
-            return result.get("name", filename)
+    async def upload_image_bytes(self, image_bytes: Union[bytes, BinaryIO], filename: str) -> str:
+        """바이트 데이터(또는 mmap 같은 읽기 가능한 버퍼)로 이미지 업로드"""
+        files = {"image": (filename, image_bytes, "image/png")}
+        data = {"overwrite": "true"}
+        response = await self.http.post(
+            "/upload/image",
+            files=files,
+            data=data
+        )
+        response.raise_for_status()
+        result = orjson.loads(response.content)
+        return result.get("name", filename)
     
     async def queue_prompt(self, workflow: Dict[str, Any]) -> str:
         """워크플로우를 큐에 추가하고 prompt_id 반환"""
@@ -63,45 +115,42 @@ class ComfyUIClient:
             "client_id": self.client_id
         }
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{self.server_url}/prompt",
-                json=payload
-            )
-            
-            # 에러 시 상세 내용 출력
-            if response.status_code != 200:
-                print(f"[ComfyUI Error] Status: {response.status_code}")
-                print(f"[ComfyUI Error] Response: {response.text}")
-                try:
-                    error_json = response.json()
-                    print(f"[ComfyUI Error] JSON: {error_json}")
-                    # ComfyUI 에러 메시지 추출
-                    if "error" in error_json:
-                        raise Exception(f"ComfyUI 에러: {error_json['error']}")
-                    if "node_errors" in error_json:
-                        raise Exception(f"노드 에러: {error_json['node_errors']}")
-                except json.JSONDecodeError:
-                    raise Exception(f"ComfyUI 응답 에러 (Status {response.status_code}): {response.text}")
-                except Exception as e:
-                    if "ComfyUI 에러" in str(e) or "노드 에러" in str(e):
-                        raise
-                    raise Exception(f"ComfyUI 에러 (Status {response.status_code}): {response.text}")
-            response.raise_for_status()
-            
-            result = response.json()
-            prompt_id = result["prompt_id"]
-            print(f"[ComfyUI] Prompt queued successfully: {prompt_id}")
-            return prompt_id
+        response = await self.http.post(
+            "/prompt",
+            content=orjson.dumps(payload),
+            headers={"Content-Type": "application/json"}
+        )
+        
+        # 에러 시 상세 내용 출력
+        if response.status_code != 200:
+            print(f"[ComfyUI Error] Status: {response.status_code}")
+            print(f"[ComfyUI Error] Response: {response.text}")
+            try:
+                error_json = orjson.loads(response.content)
+                print(f"[ComfyUI Error] JSON: {error_json}")
+                # ComfyUI 에러 메시지 추출
+                if "error" in error_json:
+                    raise Exception(f"ComfyUI 에러: {error_json['error']}")
+                if "node_errors" in error_json:
+                    raise Exception(f"노드 에러: {error_json['node_errors']}")
+            except orjson.JSONDecodeError:
+                raise Exception(f"ComfyUI 응답 에러 (Status {response.status_code}): {response.text}")
+            except Exception as e:
+                if "ComfyUI 에러" in str(e) or "노드 에러" in str(e):
+                    raise
+                raise Exception(f"ComfyUI 에러 (Status {response.status_code}): {response.text}")
+        response.raise_for_status()
+        
+        result = orjson.loads(response.content)
+        prompt_id = result["prompt_id"]
+        print(f"[ComfyUI] Prompt queued successfully: {prompt_id}")
+        return prompt_id
     
     async def get_history(self, prompt_id: str) -> Dict[str, Any]:
         """실행 히스토리 조회"""
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.server_url}/history/{prompt_id}"
-            )
-            response.raise_for_status()
-            return response.json()
+        response = await self.http.get(f"/history/{prompt_id}")
+        response.raise_for_status()
+        return orjson.loads(response.content)
     
     async def get_image(self, filename: str, subfolder: str = "", folder_type: str = "output") -> bytes:
         """생성된 이미지 다운로드"""
@@ -111,113 +160,268 @@ class ComfyUIClient:
             "type": folder_type
         }
         
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.server_url}/view",
-                params=params
-            )
-            response.raise_for_status()
-            return response.content
+        response = await self.http.get("/view", params=params)
+        response.raise_for_status()
+        return response.content
+    
+    async def stream_image(self, filename: str, subfolder: str, folder_type: str, dest_path: str) -> int:
+        """생성된 이미지를 메모리에 모으지 않고 파일로 바로 저장 (저장한 바이트 수 반환)"""
+        params = {
+            "filename": filename,
+            "subfolder": subfolder,
+            "type": folder_type
+        }
+        
+        # 임시 파일에 받은 뒤 완료되면 교체 (전송 실패 시 잘린 파일이 기존 결과를 덮어쓰지 않도록)
+        part_path = f"{dest_path}.{uuid.uuid4().hex[:8]}.part"
+        written = 0
+        try:
+            async with self.http.stream("GET", "/view", params=params) as response:
+                response.raise_for_status()
+                async with aiofiles.open(part_path, "wb") as f:
+                    async for chunk in response.aiter_bytes(STREAM_CHUNK_SIZE):
+                        await f.write(chunk)
+                        written += len(chunk)
+            os.replace(part_path, dest_path)
+        except BaseException:
+            try:
+                os.unlink(part_path)
+            except FileNotFoundError:
+                pass
+            raise
+        return written
+    
+    async def _pump_frames(self, websocket, frames: asyncio.Queue):
+        """WebSocket 프레임을 수신 큐로 옮김 (연결 종료 시 None으로 알림)"""
+        try:
+            async for message in websocket:
+                frames.put_nowait(message)
+        finally:
+            frames.put_nowait(None)
+    
+    def _handle_message(self, message: str, prompt_id: str, outputs: Dict[str, Any]) -> bool:
+        """텍스트 메시지 1개 처리, 해당 프롬프트 실행이 끝났으면 True
+        
+        executed 이벤트의 노드 출력(이미지 정보)은 outputs에 모음
+        """
+        try:
+            data = orjson.loads(message)
+        except orjson.JSONDecodeError as e:
+            print(f"[WebSocket] JSON decode error: {e}")
+            return False
+        
+        msg_type = data.get("type", "unknown")
+        
+        if msg_type == "status":
+            status = data.get("data", {}).get("status", {})
+            queue_remaining = status.get("exec_info", {}).get("queue_remaining", "?")
+            print(f"[WebSocket] Status: queue_remaining={queue_remaining}")
+        
+        elif msg_type == "progress":
+            # DEBUG일 때만, 10스텝마다 기록
+            if logger.isEnabledFor(logging.DEBUG):
+                progress = data.get("data", {})
+                value = progress.get("value", 0)
+                max_val = progress.get("max", 1)
+                if value % 10 == 0 or value == max_val:
+                    logger.debug("Progress: %s/%s", value, max_val)
+        
+        elif msg_type == "executing":
+            exec_data = data.get("data", {})
+            recv_prompt_id = exec_data.get("prompt_id")
+            if recv_prompt_id == prompt_id:
+                node = exec_data.get("node")
+                if node:
+                    logger.debug("Executing node: %s", node)
+                if node is None:
+                    # 실행 완료
+                    print("Execution completed!")
+                    return True
+            else:
+                logger.debug("[WebSocket] Different prompt executing: %s", recv_prompt_id)
+        
+        elif msg_type == "executed":
+            exec_data = data.get("data", {})
+            if exec_data.get("prompt_id") == prompt_id and exec_data.get("output"):
+                outputs[exec_data.get("node")] = exec_data["output"]
+        
+        elif msg_type == "execution_start":
+            exec_data = data.get("data", {})
+            recv_prompt_id = exec_data.get("prompt_id")
+            print(f"[WebSocket] Execution start: {recv_prompt_id}")
+        
+        elif msg_type == "execution_error":
+            exec_data = data.get("data", {})
+            if exec_data.get("prompt_id") == prompt_id:
+                print(f"[WebSocket] Execution error: {exec_data}")
+                raise Exception(f"Execution error: {exec_data}")
+        
+        else:
+            logger.debug("[WebSocket] Message type: %s", msg_type)
+        
+        return False
+    
+    def _ws_url(self) -> str:
+        """ComfyUI WebSocket 주소"""
+        ws_url = self.server_url.replace("http://", "ws://").replace("https://", "wss://")
+        return f"{ws_url}/ws?clientId={self.client_id}"
     
     async def wait_for_completion(self, prompt_id: str, timeout: int = 300) -> Dict[str, Any]:
         """WebSocket으로 완료 대기"""
-        ws_url = self.server_url.replace("http://", "ws://").replace("https://", "wss://")
-        ws_url = f"{ws_url}/ws?clientId={self.client_id}"
-        
+        ws_url = self._ws_url()
         print(f"[WebSocket] Connecting to {ws_url}")
-        print(f"[WebSocket] Waiting for prompt_id: {prompt_id}")
         
         async with websockets.connect(ws_url) as websocket:
             print(f"[WebSocket] Connected successfully!")
-            start_time = asyncio.get_event_loop().time()
-            message_count = 0
-            
+            await self._wait_on_socket(websocket, prompt_id, timeout)
+        
+        # 히스토리에서 결과 가져오기
+        history = await self.get_history(prompt_id)
+        return history.get(prompt_id, {})
+    
+    async def _wait_on_socket(self, websocket, prompt_id: str, timeout: int) -> Dict[str, Any]:
+        """열린 WebSocket에서 해당 prompt 완료까지 대기하고 executed 이벤트의 노드 출력 반환
+        
+        이미 도착한 프레임은 한 번에 꺼내 배치로 처리하고,
+        같은 배치 안에서 뒤의 progress 프레임에 덮이는 progress 프레임은 파싱하지 않음
+        """
+        print(f"[WebSocket] Waiting for prompt_id: {prompt_id}")
+        
+        loop = asyncio.get_running_loop()
+        frames: asyncio.Queue = asyncio.Queue()
+        reader = asyncio.create_task(self._pump_frames(websocket, frames))
+        start_time = loop.time()
+        message_count = 0
+        outputs: Dict[str, Any] = {}
+        
+        try:
             while True:
-                elapsed = asyncio.get_event_loop().time() - start_time
+                elapsed = loop.time() - start_time
                 if elapsed > timeout:
                     raise TimeoutError(f"Timeout waiting for prompt {prompt_id}")
                 
                 try:
-                    message = await asyncio.wait_for(websocket.recv(), timeout=1.0)
-                    message_count += 1
+                    first = await asyncio.wait_for(frames.get(), timeout=min(10.0, timeout - elapsed))
+                except asyncio.TimeoutError:
+                    # 10초마다 상태 출력
+                    print(f"[WebSocket] Waiting... ({int(loop.time() - start_time)}s elapsed, {message_count} messages received)")
+                    continue
+                
+                # 대기 없이 꺼낼 수 있는 프레임을 모두 모음
+                batch = [first]
+                while not frames.empty():
+                    batch.append(frames.get_nowait())
+                message_count += len(batch)
+                
+                # 배치 안의 마지막 progress 프레임 위치
+                last_progress = -1
+                for idx, message in enumerate(batch):
+                    if isinstance(message, str) and message.startswith(PROGRESS_FRAME_PREFIX):
+                        last_progress = idx
+                
+                for idx, message in enumerate(batch):
+                    if message is None:
+                        raise Exception(f"WebSocket 연결이 끊어졌습니다 (prompt {prompt_id})")
                     
                     # 바이너리 메시지는 스킵 (프리뷰 이미지 등)
                     if isinstance(message, bytes):
-                        print(f"[WebSocket] Binary message #{message_count} ({len(message)} bytes), skipping...")
+                        if logger.isEnabledFor(logging.DEBUG):
+                            logger.debug("[WebSocket] Binary message (%d bytes), skipping...", len(message))
                         continue
                     
-                    # 텍스트 메시지만 JSON 파싱
-                    try:
-                        data = json.loads(message)
-                    except json.JSONDecodeError as e:
-                        print(f"[WebSocket] JSON decode error: {e}")
+                    if idx < last_progress and message.startswith(PROGRESS_FRAME_PREFIX):
                         continue
                     
-                    msg_type = data.get("type", "unknown")
-                    
-                    if msg_type == "status":
-                        status = data.get("data", {}).get("status", {})
-                        queue_remaining = status.get("exec_info", {}).get("queue_remaining", "?")
-                        print(f"[WebSocket] Status: queue_remaining={queue_remaining}")
-                    
-                    elif msg_type == "progress":
-                        progress = data.get("data", {})
-                        value = progress.get("value", 0)
-                        max_val = progress.get("max", 1)
-                        print(f"Progress: {value}/{max_val} ({(value/max_val*100):.1f}%)")
-                    
-                    elif msg_type == "executing":
-                        exec_data = data.get("data", {})
-                        recv_prompt_id = exec_data.get("prompt_id")
-                        if recv_prompt_id == prompt_id:
-                            node = exec_data.get("node")
-                            if node:
-                                print(f"Executing node: {node}")
-                            if node is None:
-                                # 실행 완료
-                                print("Execution completed!")
-                                break
-                        else:
-                            print(f"[WebSocket] Different prompt executing: {recv_prompt_id}")
-                    
-                    elif msg_type == "execution_start":
-                        exec_data = data.get("data", {})
-                        recv_prompt_id = exec_data.get("prompt_id")
-                        print(f"[WebSocket] Execution start: {recv_prompt_id}")
-                    
-                    elif msg_type == "execution_error":
-                        exec_data = data.get("data", {})
-                        if exec_data.get("prompt_id") == prompt_id:
-                            print(f"[WebSocket] Execution error: {exec_data}")
-                            raise Exception(f"Execution error: {exec_data}")
-                    
-                    else:
-                        print(f"[WebSocket] Message type: {msg_type}")
-                
-                except asyncio.TimeoutError:
-                    # 10초마다 상태 출력
-                    if int(elapsed) % 10 == 0 and int(elapsed) > 0:
-                        print(f"[WebSocket] Waiting... ({int(elapsed)}s elapsed, {message_count} messages received)")
-                    continue
-        
-        # 히스토리에서 결과 가져오기
-        history = await self.get_history(prompt_id)
-        return history.get(prompt_id, {})
+                    if self._handle_message(message, prompt_id, outputs):
+                        return outputs
+        finally:
+            reader.cancel()
     
     async def execute_workflow(
         self,
         workflow: Dict[str, Any],
         timeout: int = 300
     ) -> Dict[str, Any]:
-        """워크플로우 실행 및 결과 대기"""
-        prompt_id = await self.queue_prompt(workflow)
-        result = await self.wait_for_completion(prompt_id, timeout)
-        return result
+        """워크플로우 실행 및 결과 대기
+        
+        큐 등록 전에 WebSocket을 열어 이벤트 누락을 막고, 출력 정보는 executed 이벤트에서 바로 받음
+        (이미지 출력이 없을 때만 히스토리 조회)
+        """
+        ws_url = self._ws_url()
+        print(f"[WebSocket] Connecting to {ws_url}")
+        
+        async with websockets.connect(ws_url) as websocket:
+            print(f"[WebSocket] Connected successfully!")
+            prompt_id = await self.queue_prompt(workflow)
+            outputs = await self._wait_on_socket(websocket, prompt_id, timeout)
+        
+        if any("images" in output for output in outputs.values()):
+            return {"outputs": outputs}
+        
+        # 캐시된 출력 노드 등 executed 이벤트가 없었던 경우
+        history = await self.get_history(prompt_id)
+        return history.get(prompt_id, {})
     
     def load_workflow(self, workflow_path: str) -> Dict[str, Any]:
-        """JSON 파일에서 워크플로우 로드"""
-        with open(workflow_path, "r", encoding="utf-8") as f:
-            return json.load(f)
+        """JSON 파일에서 워크플로우 로드 (캐시된 dict를 공유하므로 직접 수정하지 말 것)"""
+        return _load_workflow_cached(workflow_path, os.stat(workflow_path).st_mtime_ns)
+    
+    def _mutable_inputs(self, workflow: Dict[str, Any], node_id: str) -> Dict[str, Any]:
+        """수정할 노드만 복사해 넣고 그 노드의 inputs 반환 (나머지 노드는 원본과 공유)"""
+        node = workflow[node_id]
+        inputs = dict(node.get("inputs", {}))
+        workflow[node_id] = {**node, "inputs": inputs}
+        return inputs
+    
+    def _node_index(self, workflow: Dict[str, Any]) -> Dict[str, list]:
+        """update_workflow_images/update_workflow_prompt/randomize_seed가 수정할 노드 목록
+        
+        같은 워크플로우 객체(템플릿)에 대해서는 한 번만 스캔하고 재사용
+        """
+        for cached in (self._node_index_cache, self._derived_index):
+            if cached is not None and cached[0] is workflow:
+                return cached[1]
+        
+        images: List[str] = []
+        prompts: List[Tuple[str, str]] = []
+        seeds: List[Tuple[str, str]] = []
+        for node_id, node in workflow.items():
+            class_type = node.get("class_type", "")
+            inputs = node.get("inputs", {})
+            
+            if class_type == "LoadImage":
+                images.append(node_id)
+            
+            # Qwen Image Edit 프롬프트 노드 (Positive 프롬프트만)
+            elif "TextEncodeQwenImageEditPlus" in class_type:
+                if inputs.get("prompt", "") != "":
+                    prompts.append((node_id, "prompt"))
+            
+            # 일반 CLIP 텍스트 인코더 (Positive)
+            elif class_type == "CLIPTextEncode":
+                if "Positive" in node.get("_meta", {}).get("title", ""):
+                    prompts.append((node_id, "text"))
+            
+            # KSampler 또는 KSamplerAdvanced 노드의 seed / noise_seed
+            elif "KSampler" in class_type:
+                for key in ("seed", "noise_seed"):
+                    if key in inputs:
+                        seeds.append((node_id, key))
+        
+        # 노드 ID 순으로 정렬 (숫자로 정렬)
+        images.sort(key=lambda x: int(x) if x.isdigit() else float('inf'))
+        print(f"[Workflow] LoadImage 노드 발견: {images}")
+        
+        index = {"image": images, "prompt": prompts, "seed": seeds}
+        self._node_index_cache = (workflow, index)
+        return index
+    
+    def _derive(self, source: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, list]]:
+        """바뀌는 노드만 따로 복사할 얕은 복사본과 노드 인덱스 (복사본도 원본의 인덱스를 이어받음)"""
+        index = self._node_index(source)
+        workflow = dict(source)
+        self._derived_index = (workflow, index)
+        return workflow, index
     
     def update_workflow_images(
         self,
@@ -226,38 +430,14 @@ class ComfyUIClient:
         image2_name: Optional[str] = None,
         image3_name: Optional[str] = None
     ) -> Dict[str, Any]:
-        """워크플로우의 이미지 파일명 업데이트 (최대 3개 이미지 지원)"""
-        import copy
-        workflow = copy.deepcopy(workflow)  # Deep copy로 변경
-        
-        # LoadImage 노드 찾기
-        load_image_nodes = []
-        for node_id, node in workflow.items():
-            if node.get("class_type") == "LoadImage":
-                load_image_nodes.append((node_id, node))
-        
-        # 노드 ID 순으로 정렬 (숫자로 정렬)
-        load_image_nodes.sort(key=lambda x: int(x[0]) if x[0].isdigit() else float('inf'))
+        """워크플로우의 이미지 파일명 업데이트 (최대 3개 이미지 지원, 원본은 수정하지 않음)"""
+        workflow, index = self._derive(workflow)
         
-        print(f"[Workflow] LoadImage 노드 발견: {[n[0] for n in load_image_nodes]}")
-                
-        # 첫 번째 이미지 노드에 image1 할당
-        if len(load_image_nodes) >= 1:
-            node_id, node = load_image_nodes[0]
-            node["inputs"]["image"] = image1_name
-            print(f"[Workflow] 노드 {node_id}에 image1 설정: {image1_name}")
-        
-        # 두 번째 이미지 노드에 image2 할당 (있는 경우)
-        if len(load_image_nodes) >= 2 and image2_name:
-            node_id, node = load_image_nodes[1]
-            node["inputs"]["image"] = image2_name
-            print(f"[Workflow] 노드 {node_id}에 image2 설정: {image2_name}")
-        
-        # 세 번째 이미지 노드에 image3 할당 (있는 경우) - v2 workflow 지원
-        if len(load_image_nodes) >= 3 and image3_name:
-            node_id, node = load_image_nodes[2]
-            node["inputs"]["image"] = image3_name
-            print(f"[Workflow] 노드 {node_id}에 image3 설정: {image3_name}")
+        # LoadImage 노드에 순서대로 image1, image2, image3 할당 (v2 workflow는 3개)
+        for i, (node_id, image_name) in enumerate(zip(index["image"], (image1_name, image2_name, image3_name)), 1):
+            if image_name:
+                self._mutable_inputs(workflow, node_id)["image"] = image_name
+                print(f"[Workflow] 노드 {node_id}에 image{i} 설정: {image_name}")
         
         return workflow
     
@@ -267,47 +447,23 @@ class ComfyUIClient:
         prompt: str
     ) -> Dict[str, Any]:
         """워크플로우의 프롬프트 업데이트"""
-        import copy
-        workflow = copy.deepcopy(workflow)  # Deep copy
+        workflow, index = self._derive(workflow)
         
-        for node_id, node in workflow.items():
-            class_type = node.get("class_type", "")
-            
-            # Qwen Image Edit 프롬프트 노드
-            if "TextEncodeQwenImageEditPlus" in class_type:
-                inputs = node.get("inputs", {})
-                if inputs.get("prompt", "") != "":  # Positive 프롬프트만
-                    inputs["prompt"] = prompt
-            
-            # 일반 CLIP 텍스트 인코더 (Positive)
-            elif class_type == "CLIPTextEncode":
-                title = node.get("_meta", {}).get("title", "")
-                if "Positive" in title:
-                    node["inputs"]["text"] = prompt
+        for node_id, key in index["prompt"]:
+            self._mutable_inputs(workflow, node_id)[key] = prompt
         
         return workflow
     
     def randomize_seed(self, workflow: Dict[str, Any]) -> Dict[str, Any]:
         """워크플로우의 KSampler seed를 랜덤하게 변경"""
-        import copy
         import random
-        workflow = copy.deepcopy(workflow)
+        workflow, index = self._derive(workflow)
         
-        for node_id, node in workflow.items():
-            class_type = node.get("class_type", "")
-            
-            # KSampler 또는 KSamplerAdvanced 노드의 seed 랜덤화
-            if "KSampler" in class_type:
-                inputs = node.get("inputs", {})
-                if "seed" in inputs:
-                    old_seed = inputs["seed"]
-                    new_seed = random.randint(0, 2**63 - 1)
-                    inputs["seed"] = new_seed
-                    print(f"[Workflow] 노드 {node_id} seed 변경: {old_seed} -> {new_seed}")
-                    
-                # noise_seed도 변경 (KSamplerAdvanced용)
-                if "noise_seed" in inputs:
-                    inputs["noise_seed"] = random.randint(0, 2**63 - 1)
+        for node_id, key in index["seed"]:
+            inputs = self._mutable_inputs(workflow, node_id)
+            old_seed = inputs[key]
+            inputs[key] = random.randint(0, 2**63 - 1)
+            if key == "seed":
+                print(f"[Workflow] 노드 {node_id} seed 변경: {old_seed} -> {inputs[key]}")
         
         return workflow
-
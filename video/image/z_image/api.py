@@ -4,14 +4,16 @@ ComfyUI를 통한 텍스트 → 이미지 생성 API
 """
 
 from fastapi import FastAPI, HTTPException, Form
-from fastapi.responses import FileResponse, Response
+from fastapi.responses import FileResponse, Response, ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
 from typing import Optional, List
 import os
-import uuid
 import time
 import asyncio
+import random
+import traceback
+from secrets import token_hex
 from datetime import datetime
 from pathlib import Path
 
@@ -23,7 +25,8 @@ from comfyui_client import ComfyUIClient
 app = FastAPI(
     title="Z-Image Turbo API",
     description="ComfyUI 기반 텍스트 → 이미지 생성 API (Z-Image Turbo)",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 app.add_middleware(
@@ -51,6 +54,15 @@ os.makedirs(SHARED_DIR, exist_ok=True)
 # ComfyUI 클라이언트
 client = ComfyUIClient(COMFYUI_URL)
 
+# ComfyUI keep-alive 연결이 끊기지 않도록 /system_stats를 보내는 간격 (초, 풀 keepalive_expiry 30초보다 짧게)
+COMFY_KEEPALIVE_INTERVAL = 20
+_keepalive_task: Optional[asyncio.Task] = None
+
+# 워크플로우 템플릿 (시작 시 한 번 파싱, 요청에서는 수정하지 않음)
+WORKFLOW_TEMPLATE: Optional[dict] = None
+# 템플릿에서 수정 대상 노드 ID (역할별, 템플릿 로드 시 한 번 계산)
+WORKFLOW_INDEX: Optional[dict] = None
+
 # 파일 자동 삭제 설정
 FILE_MAX_AGE_HOURS = 2
 
@@ -59,18 +71,17 @@ FILE_MAX_AGE_HOURS = 2
 # 유틸리티 함수
 # ============================================
 def cleanup_old_files(directory: str, max_age_hours: int = FILE_MAX_AGE_HOURS):
-    """오래된 파일 삭제"""
-    now = time.time()
+    """오래된 파일 삭제 (scandir의 캐시된 stat 사용)"""
+    cutoff = time.time() - max_age_hours * 3600
     deleted_count = 0
-    for file in Path(directory).glob("*"):
-        if file.is_file():
-            age_hours = (now - file.stat().st_mtime) / 3600
-            if age_hours > max_age_hours:
+    with os.scandir(directory) as it:
+        for entry in it:
+            if entry.is_file(follow_symlinks=False) and entry.stat().st_mtime < cutoff:
                 try:
-                    file.unlink()
+                    os.unlink(entry.path)
                     deleted_count += 1
-                except Exception as e:
-                    print(f"파일 삭제 실패 {file}: {e}")
+                except OSError as e:
+                    print(f"파일 삭제 실패 {entry.path}: {e}")
     if deleted_count > 0:
         print(f"[Cleanup] {directory}: {deleted_count}개 오래된 파일 삭제됨")
 
@@ -79,7 +90,48 @@ async def periodic_cleanup():
     """주기적으로 오래된 파일 삭제"""
     while True:
         await asyncio.sleep(1800)  # 30분
-        cleanup_old_files(OUTPUT_DIR)
+        await asyncio.to_thread(cleanup_old_files, OUTPUT_DIR)
+
+
+async def comfy_keepalive():
+    """주기적으로 ComfyUI에 가벼운 요청을 보내 공유 HTTP 연결을 살려 둠"""
+    while True:
+        await asyncio.sleep(COMFY_KEEPALIVE_INTERVAL)
+        await client.ping()
+
+
+def get_workflow() -> dict:
+    """요청별 워크플로우 복사본 (수정 대상 노드만 얕게 복사, 나머지는 템플릿과 공유)"""
+    if WORKFLOW_TEMPLATE is None:
+        raise HTTPException(status_code=500, detail="워크플로우 파일이 없습니다")
+    return client.clone_workflow(WORKFLOW_TEMPLATE, WORKFLOW_INDEX)
+
+
+def first_output_image(result: dict) -> dict:
+    """실행 결과에서 첫 번째 출력 이미지 정보 (찾는 즉시 멈춤), 없으면 500"""
+    img_info = next(
+        (
+            img
+            for node_output in result.get("outputs", {}).values()
+            if isinstance(node_output, dict)
+            for img in node_output.get("images", ())
+        ),
+        None
+    )
+    if img_info is None:
+        raise HTTPException(status_code=500, detail="출력 이미지가 없습니다")
+    return img_info
+
+
+async def save_output_image(result: dict, output_path: str):
+    """첫 번째 출력 이미지를 ComfyUI에서 받아 오면서 바로 output_path에 기록"""
+    img_info = first_output_image(result)
+    await client.stream_image(
+        img_info["filename"],
+        img_info.get("subfolder", ""),
+        img_info.get("type", "output"),
+        output_path
+    )
 
 
 def get_session_dir(session_id: str) -> str:
@@ -140,19 +192,41 @@ class HealthResponse(BaseModel):
 @app.on_event("startup")
 async def startup_event():
     """서버 시작 시 초기화"""
+    global WORKFLOW_TEMPLATE, WORKFLOW_INDEX, _keepalive_task
     print(f"Z-Image Turbo API 시작...")
     print(f"ComfyUI URL: {COMFYUI_URL}")
     print(f"Workflow Path: {WORKFLOW_PATH}")
     
-    cleanup_old_files(OUTPUT_DIR)
+    await asyncio.to_thread(cleanup_old_files, OUTPUT_DIR)
     
     asyncio.create_task(periodic_cleanup())
     print(f"[Cleanup] 자동 파일 정리 활성화 ({FILE_MAX_AGE_HOURS}시간 이상 파일 삭제)")
     
     if os.path.exists(WORKFLOW_PATH):
+        WORKFLOW_TEMPLATE = client.load_workflow(WORKFLOW_PATH)
+        WORKFLOW_INDEX = client.index_workflow(WORKFLOW_TEMPLATE)
         print(f"워크플로우 파일 확인됨: {WORKFLOW_PATH}")
     else:
         print(f"경고: 워크플로우 파일이 없습니다: {WORKFLOW_PATH}")
+    
+    # 첫 요청 전에 ComfyUI 연결을 미리 열어 두고 이후 주기적으로 유지
+    if await client.ping():
+        print(f"ComfyUI 연결 확인됨: {COMFYUI_URL}")
+    else:
+        print(f"경고: ComfyUI에 연결할 수 없습니다: {COMFYUI_URL}")
+    _keepalive_task = asyncio.create_task(comfy_keepalive())
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """서버 종료 시 HTTP 연결 정리 (keepalive가 닫힌 클라이언트를 다시 만들지 않도록 먼저 중지)"""
+    if _keepalive_task is not None:
+        _keepalive_task.cancel()
+        try:
+            await _keepalive_task
+        except asyncio.CancelledError:
+            pass
+    await client.aclose()
 
 
 # ============================================
@@ -178,14 +252,7 @@ async def root():
 @app.get("/health", response_model=HealthResponse, tags=["Health"])
 async def health_check():
     """헬스 체크"""
-    comfyui_ok = False
-    try:
-        import httpx
-        async with httpx.AsyncClient(timeout=5.0) as http_client:
-            response = await http_client.get(f"{COMFYUI_URL}/system_stats")
-            comfyui_ok = response.status_code == 200
-    except:
-        pass
+    comfyui_ok = await client.ping()
     
     return HealthResponse(
         status="healthy",
@@ -211,14 +278,10 @@ async def generate_image_form(
     start_time = time.time()
     
     try:
-        if not os.path.exists(WORKFLOW_PATH):
-            raise HTTPException(status_code=500, detail="워크플로우 파일이 없습니다")
-        
-        workflow = client.load_workflow(WORKFLOW_PATH)
+        workflow = get_workflow()
         
         # 시드 설정
         if seed is None:
-            import random
             seed = random.randint(0, 2**32 - 1)
         
         # 워크플로우 업데이트
@@ -230,39 +293,20 @@ async def generate_image_form(
             height=height,
             steps=steps,
             cfg=cfg,
-            seed=seed
+            seed=seed,
+            node_index=WORKFLOW_INDEX
         )
         
         # 실행
         result = await client.execute_workflow(workflow, timeout=300)
         
-        # 결과 이미지 가져오기
-        outputs = result.get("outputs", {})
-        output_images = []
-        
-        for node_id, node_output in outputs.items():
-            if isinstance(node_output, dict) and "images" in node_output:
-                for img in node_output["images"]:
-                    output_images.append(img)
-        
-        if not output_images:
-            raise HTTPException(status_code=500, detail="출력 이미지가 없습니다")
-        
-        # 첫 번째 이미지 저장
-        img_info = output_images[0]
-        img_bytes = await client.get_image(
-            img_info["filename"],
-            img_info.get("subfolder", ""),
-            img_info.get("type", "output")
-        )
-        
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        unique_id = str(uuid.uuid4())[:8]
+        timestamp = time.strftime("%Y%m%d_%H%M%S")
+        unique_id = token_hex(4)
         output_filename = f"zimage_{timestamp}_{unique_id}.png"
         output_path = os.path.join(OUTPUT_DIR, output_filename)
         
-        with open(output_path, "wb") as f:
-            f.write(img_bytes)
+        # 첫 번째 이미지를 받으면서 바로 저장
+        await save_output_image(result, output_path)
         
         processing_time = time.time() - start_time
         
@@ -277,7 +321,6 @@ async def generate_image_form(
     except HTTPException:
         raise
     except Exception as e:
-        import traceback
         print(f"[ERROR] 이미지 생성 실패:")
         print(traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"이미지 생성 실패: {str(e)}")
@@ -291,14 +334,10 @@ async def generate_image_json(request: ImageGenerateRequest):
     start_time = time.time()
     
     try:
-        if not os.path.exists(WORKFLOW_PATH):
-            raise HTTPException(status_code=500, detail="워크플로우 파일이 없습니다")
-        
-        workflow = client.load_workflow(WORKFLOW_PATH)
+        workflow = get_workflow()
         
         seed = request.seed
         if seed is None:
-            import random
             seed = random.randint(0, 2**32 - 1)
         
         workflow = client.update_image_workflow(
@@ -309,36 +348,19 @@ async def generate_image_json(request: ImageGenerateRequest):
             height=request.height,
             steps=request.steps,
             cfg=request.cfg,
-            seed=seed
+            seed=seed,
+            node_index=WORKFLOW_INDEX
         )
         
         result = await client.execute_workflow(workflow, timeout=300)
         
-        outputs = result.get("outputs", {})
-        output_images = []
-        
-        for node_id, node_output in outputs.items():
-            if isinstance(node_output, dict) and "images" in node_output:
-                for img in node_output["images"]:
-                    output_images.append(img)
-        
-        if not output_images:
-            raise HTTPException(status_code=500, detail="출력 이미지가 없습니다")
-        
-        img_info = output_images[0]
-        img_bytes = await client.get_image(
-            img_info["filename"],
-            img_info.get("subfolder", ""),
-            img_info.get("type", "output")
-        )
-        
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        unique_id = str(uuid.uuid4())[:8]
+        timestamp = time.strftime("%Y%m%d_%H%M%S")
+        unique_id = token_hex(4)
         output_filename = f"zimage_{timestamp}_{unique_id}.png"
         output_path = os.path.join(OUTPUT_DIR, output_filename)
         
-        with open(output_path, "wb") as f:
-            f.write(img_bytes)
+        # 첫 번째 이미지를 받으면서 바로 저장
+        await save_output_image(result, output_path)
         
         processing_time = time.time() - start_time
         
@@ -353,7 +375,6 @@ async def generate_image_json(request: ImageGenerateRequest):
     except HTTPException:
         raise
     except Exception as e:
-        import traceback
         print(traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"이미지 생성 실패: {str(e)}")
 
@@ -373,14 +394,10 @@ async def session_generate_image(request: SessionImageGenerateRequest):
     try:
         session_dir = get_session_dir(request.session_id)
         
-        if not os.path.exists(WORKFLOW_PATH):
-            raise HTTPException(status_code=500, detail="워크플로우 파일이 없습니다")
-        
-        workflow = client.load_workflow(WORKFLOW_PATH)
+        workflow = get_workflow()
         
         seed = request.seed
         if seed is None:
-            import random
             seed = random.randint(0, 2**32 - 1)
         
         workflow = client.update_image_workflow(
@@ -391,36 +408,19 @@ async def session_generate_image(request: SessionImageGenerateRequest):
             height=request.height,
             steps=request.steps,
             cfg=request.cfg,
-            seed=seed
+            seed=seed,
+            node_index=WORKFLOW_INDEX
         )
         
         result = await client.execute_workflow(workflow, timeout=300)
         
-        outputs = result.get("outputs", {})
-        output_images = []
-        
-        for node_id, node_output in outputs.items():
-            if isinstance(node_output, dict) and "images" in node_output:
-                for img in node_output["images"]:
-                    output_images.append(img)
-        
-        if not output_images:
-            raise HTTPException(status_code=500, detail="출력 이미지가 없습니다")
-        
-        img_info = output_images[0]
-        img_bytes = await client.get_image(
-            img_info["filename"],
-            img_info.get("subfolder", ""),
-            img_info.get("type", "output")
-        )
-        
         output_filename = request.output_filename or "generated.png"
         if not output_filename.endswith(".png"):
             output_filename += ".png"
         output_path = os.path.join(session_dir, output_filename)
         
-        with open(output_path, "wb") as f:
-            f.write(img_bytes)
+        # 첫 번째 이미지를 받으면서 바로 저장
+        await save_output_image(result, output_path)
         
         processing_time = time.time() - start_time
         
@@ -436,13 +436,12 @@ async def session_generate_image(request: SessionImageGenerateRequest):
     except HTTPException:
         raise
     except Exception as e:
-        import traceback
         print(traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"이미지 생성 실패: {str(e)}")
 
 
 @app.get("/session/{session_id}/files", tags=["Session"])
-async def list_session_files(session_id: str):
+def list_session_files(session_id: str):
     """세션 폴더 내 파일 목록 조회"""
     session_dir = os.path.join(SHARED_DIR, session_id)
     
@@ -470,13 +469,17 @@ async def get_output(filename: str):
     """결과 이미지 다운로드"""
     filepath = os.path.join(OUTPUT_DIR, filename)
     
-    if not os.path.exists(filepath):
+    try:
+        stat_result = os.stat(filepath)
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail="파일을 찾을 수 없습니다")
     
+    # stat 결과를 넘겨 FileResponse의 중복 stat 생략
     return FileResponse(
         filepath,
         media_type="image/png",
-        filename=filename
+        filename=filename,
+        stat_result=stat_result
     )
 
 
@@ -485,15 +488,15 @@ async def delete_output(filename: str):
     """결과 이미지 삭제"""
     filepath = os.path.join(OUTPUT_DIR, filename)
     
-    if not os.path.exists(filepath):
+    try:
+        os.remove(filepath)
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail="파일을 찾을 수 없습니다")
-    
-    os.remove(filepath)
     return {"success": True, "message": f"{filename} 삭제 완료"}
 
 
 @app.get("/outputs", tags=["Output"])
-async def list_outputs():
+def list_outputs():
     """결과 이미지 목록"""
     files = []
     for f in Path(OUTPUT_DIR).glob("*.png"):
@@ -3,24 +3,117 @@ ComfyUI 클라이언트
 Z-Image Turbo 워크플로우용
 """
 
-import json
+import os
+import orjson
 import uuid
 import asyncio
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 import httpx
+import aiofiles
 import websockets
 
 
+# 실행 중 노드 로그의 최소 간격 (초) - 프레임마다 stdout에 쓰지 않음
+PROGRESS_LOG_INTERVAL = 0.25
+
+# WebSocket 수신 메시지 최대 크기 (미리보기 이미지 프레임 포함)
+WS_MAX_SIZE = 2 ** 23
+
+# /view 응답을 디스크로 옮길 때의 청크 크기
+STREAM_CHUNK_SIZE = 1 << 20
+
+
 class ComfyUIClient:
     def __init__(self, base_url: str = "http://localhost:8000"):
         self.base_url = base_url.rstrip("/")
         self.ws_url = self.base_url.replace("http://", "ws://").replace("https://", "wss://")
         self.client_id = str(uuid.uuid4())
+        self._http: Optional[httpx.AsyncClient] = None
+    
+    @property
+    def http(self) -> httpx.AsyncClient:
+        """keep-alive 연결을 재사용하는 공유 HTTP 클라이언트
+        
+        import 시점이 아니라 처음 사용할 때(실행 중인 이벤트 루프 안에서) 생성
+        """
+        if self._http is None or self._http.is_closed:
+            self._http = httpx.AsyncClient(
+                base_url=self.base_url,
+                # HTTP/2는 TLS(ALPN)로만 협상됨 - 평문 http://는 HTTP/1.1 그대로 사용
+                http2=self.base_url.startswith("https://"),
+                timeout=httpx.Timeout(30.0, connect=5.0),
+                limits=httpx.Limits(
+                    max_keepalive_connections=20,
+                    max_connections=100,
+                    keepalive_expiry=30.0
+                )
+            )
+        return self._http
+    
+    async def aclose(self):
+        """공유 HTTP 클라이언트 종료"""
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+    
+    async def ping(self) -> bool:
+        """/system_stats 요청 1회 (연결 풀 예열/유지 및 헬스 체크용)"""
+        try:
+            response = await self.http.get("/system_stats", timeout=5.0)
+            return response.status_code == 200
+        except (httpx.HTTPError, asyncio.TimeoutError):
+            return False
     
     def load_workflow(self, workflow_path: str) -> Dict[str, Any]:
         """워크플로우 JSON 파일 로드"""
-        with open(workflow_path, "r", encoding="utf-8") as f:
-            return json.load(f)
+        with open(workflow_path, "rb") as f:
+            return orjson.loads(f.read())
+    
+    def clone_workflow(
+        self,
+        template: Dict[str, Any],
+        node_index: Optional[Dict[str, List[str]]] = None
+    ) -> Dict[str, Any]:
+        """템플릿의 요청별 복사본 (deepcopy 대신 노드 단위 얕은 복사)
+        
+        update_image_workflow는 노드의 inputs에 스칼라 값만 대입하므로 노드 dict와 inputs만 새로 만들고
+        나머지(리스트 링크 등)는 템플릿과 공유함. node_index가 있으면 수정 대상 노드만 복사
+        """
+        if node_index is None:
+            return {
+                node_id: dict(node, inputs=dict(node["inputs"])) if "inputs" in node else dict(node)
+                for node_id, node in template.items()
+            }
+        workflow = dict(template)
+        for node_ids in node_index.values():
+            for node_id in node_ids:
+                node = template[node_id]
+                workflow[node_id] = dict(node, inputs=dict(node["inputs"]))
+        return workflow
+    
+    def index_workflow(self, workflow: Dict[str, Any]) -> Dict[str, List[str]]:
+        """update_image_workflow가 수정하는 노드 ID를 역할별로 모음 (템플릿 로드 시 한 번만)"""
+        index = {"positive": [], "negative": [], "latent": [], "sampler": []}
+        for node_id, node in workflow.items():
+            class_type = node.get("class_type")
+            
+            if class_type == "CLIPTextEncode":
+                title = node.get("_meta", {}).get("title", "")
+                # Positive Prompt (노드 6)
+                if "Positive" in title:
+                    index["positive"].append(node_id)
+                # Negative Prompt (노드 7)
+                elif "Negative" in title:
+                    index["negative"].append(node_id)
+            
+            # EmptySD3LatentImage (노드 13) - 이미지 크기
+            elif class_type == "EmptySD3LatentImage":
+                index["latent"].append(node_id)
+            
+            # KSampler (노드 3)
+            elif class_type == "KSampler":
+                index["sampler"].append(node_id)
+        return index
     
     def update_image_workflow(
         self,
@@ -31,10 +124,13 @@ class ComfyUIClient:
         height: int = 1024,
         steps: int = 9,
         cfg: float = 1.0,
-        seed: int = None
+        seed: int = None,
+        node_index: Optional[Dict[str, List[str]]] = None
     ) -> Dict[str, Any]:
         """
         Z-Image Turbo 워크플로우 업데이트
+        
+        node_index(index_workflow 결과)를 넘기면 노드를 훑지 않고 해당 ID만 바로 수정
         """
         print(f"[Workflow] 업데이트 시작:")
         print(f"  - prompt: {prompt[:50]}...")
@@ -42,32 +138,30 @@ class ComfyUIClient:
         print(f"  - size: {width}x{height}")
         print(f"  - steps: {steps}, cfg: {cfg}, seed: {seed}")
         
-        for node_id, node in workflow.items():
-            class_type = node.get("class_type", "")
-            
-            # Positive Prompt (노드 6)
-            if class_type == "CLIPTextEncode" and "Positive" in node.get("_meta", {}).get("title", ""):
-                node["inputs"]["text"] = prompt
-                print(f"[Workflow] 노드 {node_id} (Positive Prompt): 업데이트됨")
-            
-            # Negative Prompt (노드 7)
-            if class_type == "CLIPTextEncode" and "Negative" in node.get("_meta", {}).get("title", ""):
-                node["inputs"]["text"] = negative_prompt
-                print(f"[Workflow] 노드 {node_id} (Negative Prompt): 업데이트됨")
-            
-            # EmptySD3LatentImage (노드 13) - 이미지 크기
-            if class_type == "EmptySD3LatentImage":
-                node["inputs"]["width"] = width
-                node["inputs"]["height"] = height
-                print(f"[Workflow] 노드 {node_id} (LatentImage): {width}x{height}")
-            
-            # KSampler (노드 3)
-            if class_type == "KSampler":
-                node["inputs"]["steps"] = steps
-                node["inputs"]["cfg"] = cfg
-                if seed is not None:
-                    node["inputs"]["seed"] = seed
-                print(f"[Workflow] 노드 {node_id} (KSampler): steps={steps}, cfg={cfg}, seed={seed}")
+        if node_index is None:
+            node_index = self.index_workflow(workflow)
+        
+        for node_id in node_index["positive"]:
+            workflow[node_id]["inputs"]["text"] = prompt
+            print(f"[Workflow] 노드 {node_id} (Positive Prompt): 업데이트됨")
+        
+        for node_id in node_index["negative"]:
+            workflow[node_id]["inputs"]["text"] = negative_prompt
+            print(f"[Workflow] 노드 {node_id} (Negative Prompt): 업데이트됨")
+        
+        for node_id in node_index["latent"]:
+            inputs = workflow[node_id]["inputs"]
+            inputs["width"] = width
+            inputs["height"] = height
+            print(f"[Workflow] 노드 {node_id} (LatentImage): {width}x{height}")
+        
+        for node_id in node_index["sampler"]:
+            inputs = workflow[node_id]["inputs"]
+            inputs["steps"] = steps
+            inputs["cfg"] = cfg
+            if seed is not None:
+                inputs["seed"] = seed
+            print(f"[Workflow] 노드 {node_id} (KSampler): steps={steps}, cfg={cfg}, seed={seed}")
         
         return workflow
     
@@ -78,58 +172,74 @@ class ComfyUIClient:
             "client_id": self.client_id
         }
         
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(
-                f"{self.base_url}/prompt",
-                json=payload
-            )
-            
-            if response.status_code != 200:
-                error_text = response.text
-                try:
-                    error_json = response.json()
-                    print(f"[ComfyUI Error] Status: {response.status_code}")
-                    print(f"[ComfyUI Error] Response: {error_text}")
-                    raise Exception(f"ComfyUI 에러: {error_json['error']}")
-                except json.JSONDecodeError:
-                    raise Exception(f"ComfyUI 요청 실패 ({response.status_code}): {error_text}")
-            
-            result = response.json()
-            return result["prompt_id"]
+        response = await self.http.post(
+            "/prompt",
+            content=orjson.dumps(payload),
+            headers={"Content-Type": "application/json"}
+        )
+        
+        if response.status_code != 200:
+            error_text = response.text
+            try:
+                error_json = orjson.loads(response.content)
+                print(f"[ComfyUI Error] Status: {response.status_code}")
+                print(f"[ComfyUI Error] Response: {error_text}")
+                raise Exception(f"ComfyUI 에러: {error_json['error']}")
+            except orjson.JSONDecodeError:
+                raise Exception(f"ComfyUI 요청 실패 ({response.status_code}): {error_text}")
+        
+        result = orjson.loads(response.content)
+        return result["prompt_id"]
     
     async def wait_for_completion(self, prompt_id: str, timeout: float = 300) -> Dict[str, Any]:
         """워크플로우 완료 대기 (WebSocket)"""
         ws_url = f"{self.ws_url}/ws?clientId={self.client_id}"
         
         try:
-            async with websockets.connect(ws_url) as ws:
-                start_time = asyncio.get_event_loop().time()
+            # 진행 메시지는 작은 JSON이라 permessage-deflate는 끄고 프레임마다 압축 해제 비용을 없앰
+            async with websockets.connect(
+                ws_url,
+                compression=None,
+                max_size=WS_MAX_SIZE,
+                open_timeout=5,
+                close_timeout=1
+            ) as ws:
+                # 전체 마감 시각까지 한 번에 대기 (주기적으로 깨어나 시간만 확인하지 않음)
+                loop = asyncio.get_running_loop()
+                deadline = loop.time() + timeout
+                last_log_time = 0.0
                 
                 while True:
-                    if asyncio.get_event_loop().time() - start_time > timeout:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
                         raise TimeoutError(f"워크플로우 타임아웃 ({timeout}초)")
                     
                     try:
-                        message = await asyncio.wait_for(ws.recv(), timeout=5.0)
-                        data = json.loads(message)
-                        
-                        if data.get("type") == "executing":
-                            exec_data = data.get("data", {})
-                            if exec_data.get("prompt_id") == prompt_id:
-                                node = exec_data.get("node")
-                                if node is None:
-                                    print(f"[ComfyUI] 워크플로우 완료: {prompt_id}")
-                                    break
-                                else:
-                                    print(f"[ComfyUI] 실행 중: 노드 {node}")
-                        
-                        elif data.get("type") == "execution_error":
-                            error_data = data.get("data", {})
-                            if error_data.get("prompt_id") == prompt_id:
-                                raise Exception(f"실행 오류: {error_data}")
-                    
+                        message = await asyncio.wait_for(ws.recv(), timeout=remaining)
                     except asyncio.TimeoutError:
+                        raise TimeoutError(f"워크플로우 타임아웃 ({timeout}초)")
+                    
+                    # 미리보기 이미지 등 바이너리 프레임은 건너뜀
+                    if type(message) is not str:
                         continue
+                    
+                    data = orjson.loads(message)
+                    
+                    if data.get("type") == "executing":
+                        exec_data = data.get("data", {})
+                        if exec_data.get("prompt_id") == prompt_id:
+                            node = exec_data.get("node")
+                            if node is None:
+                                print(f"[ComfyUI] 워크플로우 완료: {prompt_id}")
+                                break
+                            elif loop.time() - last_log_time > PROGRESS_LOG_INTERVAL:
+                                last_log_time = loop.time()
+                                print(f"[ComfyUI] 실행 중: 노드 {node}")
+                    
+                    elif data.get("type") == "execution_error":
+                        error_data = data.get("data", {})
+                        if error_data.get("prompt_id") == prompt_id:
+                            raise Exception(f"실행 오류: {error_data}")
         
         except Exception as e:
             if "websockets" in str(type(e).__module__):
@@ -155,35 +265,43 @@ class ComfyUIClient:
     
     async def get_history(self, prompt_id: str) -> Optional[Dict[str, Any]]:
         """프롬프트 히스토리 조회"""
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.get(f"{self.base_url}/history/{prompt_id}")
-            
-            if response.status_code != 200:
-                return None
-            
-            history = response.json()
-            if prompt_id in history:
-                return history[prompt_id]
+        response = await self.http.get(f"/history/{prompt_id}")
+        
+        if response.status_code != 200:
             return None
+        
+        history = orjson.loads(response.content)
+        if prompt_id in history:
+            return history[prompt_id]
+        return None
     
-    async def get_image(self, filename: str, subfolder: str = "", folder_type: str = "output") -> bytes:
-        """ComfyUI에서 이미지 다운로드"""
+    async def stream_image(self, filename: str, subfolder: str, folder_type: str, dest_path: str) -> int:
+        """생성된 이미지를 받는 대로 파일에 기록 (수신과 디스크 쓰기가 겹침, 저장한 바이트 수 반환)"""
         params = {
             "filename": filename,
             "subfolder": subfolder,
             "type": folder_type
         }
         
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            response = await client.get(
-                f"{self.base_url}/view",
-                params=params
-            )
-            
-            if response.status_code != 200:
-                raise Exception(f"이미지 다운로드 실패: {response.status_code}")
-            
-            return response.content
+        # 임시 파일에 받은 뒤 완료되면 교체 (전송 실패 시 잘린 파일이 기존 결과를 덮어쓰지 않도록)
+        part_path = f"{dest_path}.{uuid.uuid4().hex[:8]}.part"
+        written = 0
+        try:
+            async with self.http.stream("GET", "/view", params=params, timeout=60.0) as response:
+                if response.status_code != 200:
+                    raise Exception(f"이미지 다운로드 실패: {response.status_code}")
+                async with aiofiles.open(part_path, "wb") as f:
+                    async for chunk in response.aiter_bytes(STREAM_CHUNK_SIZE):
+                        await f.write(chunk)
+                        written += len(chunk)
+            os.replace(part_path, dest_path)
+        except BaseException:
+            try:
+                os.unlink(part_path)
+            except FileNotFoundError:
+                pass
+            raise
+        return written
     
     async def execute_workflow(self, workflow: Dict[str, Any], timeout: float = 300) -> Dict[str, Any]:
         """워크플로우 실행 및 완료 대기"""
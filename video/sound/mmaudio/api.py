@@ -4,16 +4,17 @@ ComfyUI를 통한 비디오 → 오디오 자동 생성 API
 """
 
 from fastapi import FastAPI, HTTPException, UploadFile, File, Form
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
 from typing import Optional, List
 import os
-import uuid
 import time
 import asyncio
+import aiofiles
+import httpx
+from secrets import token_hex
 from datetime import datetime
-from pathlib import Path
 
 from comfyui_client import ComfyUIClient
 
@@ -23,7 +24,8 @@ from comfyui_client import ComfyUIClient
 app = FastAPI(
     title="MMAudio API",
     description="ComfyUI 기반 비디오 → 오디오 자동 생성 API (MMAudio)",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 app.add_middleware(
@@ -53,13 +55,23 @@ os.makedirs(SHARED_DIR, exist_ok=True)
 # ComfyUI 클라이언트
 client = ComfyUIClient(COMFYUI_URL)
 
+# 워크플로우 템플릿 (시작 시 한 번만 로드)
+WORKFLOW_TEMPLATE: Optional[dict] = None
+
+# ComfyUI 동시 실행 수 제한 (GPU VRAM 경쟁으로 처리량이 떨어지지 않도록, 대기는 이벤트 루프에서)
+COMFY_CONCURRENCY = int(os.getenv("COMFY_CONCURRENCY", "2"))
+COMFY_SEM = asyncio.Semaphore(COMFY_CONCURRENCY)
+
 # 파일 자동 삭제 설정
 FILE_MAX_AGE_HOURS = 2
 
+# 업로드 스트리밍 청크 크기 (1MB)
+UPLOAD_CHUNK_SIZE = 1 << 20
+
 
 def log(message: str, level: str = "INFO"):
     """타임스탬프가 포함된 로그 출력"""
-    timestamp = datetime.now().strftime("%H:%M:%S")
+    timestamp = time.strftime("%H:%M:%S")
     print(f"[{timestamp}] [MMAudio] [{level}] {message}", flush=True)
 
 
@@ -67,28 +79,63 @@ def log(message: str, level: str = "INFO"):
 # 유틸리티 함수
 # ============================================
 def cleanup_old_files(directory: str, max_age_hours: int = FILE_MAX_AGE_HOURS):
-    """오래된 파일 삭제"""
-    now = time.time()
+    """오래된 파일 삭제 (scandir의 캐시된 stat 사용)"""
+    cutoff = time.time() - max_age_hours * 3600
     deleted_count = 0
-    for file in Path(directory).glob("*"):
-        if file.is_file():
-            age_hours = (now - file.stat().st_mtime) / 3600
-            if age_hours > max_age_hours:
+    with os.scandir(directory) as it:
+        for entry in it:
+            if entry.is_file(follow_symlinks=False) and entry.stat().st_mtime < cutoff:
                 try:
-                    file.unlink()
+                    os.unlink(entry.path)
                     deleted_count += 1
-                except Exception as e:
-                    print(f"파일 삭제 실패 {file}: {e}")
+                except OSError as e:
+                    print(f"파일 삭제 실패 {entry.path}: {e}")
     if deleted_count > 0:
         print(f"[Cleanup] {directory}: {deleted_count}개 오래된 파일 삭제됨")
 
 
+def list_files(directory: str, suffix: str = "") -> list:
+    """디렉토리 파일 목록 (최신순) - scandir 한 번, 파일당 stat 한 번"""
+    entries = []
+    with os.scandir(directory) as it:
+        for entry in it:
+            if entry.name.endswith(suffix) and entry.is_file():
+                st = entry.stat()
+                entries.append((st.st_ctime, entry.name, st.st_size))
+    entries.sort(reverse=True)
+    return [
+        {
+            "filename": name,
+            "size_mb": round(size / (1024 * 1024), 2),
+            "created": datetime.fromtimestamp(ctime).isoformat()
+        }
+        for ctime, name, size in entries
+    ]
+
+
+async def save_upload(upload: UploadFile, path: str) -> int:
+    """업로드 파일을 청크 단위로 디스크에 스트리밍 저장하고 저장한 바이트 수 반환"""
+    size = 0
+    async with aiofiles.open(path, "wb") as f:
+        while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+            await f.write(chunk)
+            size += len(chunk)
+    return size
+
+
+def get_workflow() -> dict:
+    """워크플로우 템플릿 반환 (update_mmaudio_workflow가 복사본을 만들므로 그대로 사용)"""
+    if WORKFLOW_TEMPLATE is None:
+        raise HTTPException(status_code=500, detail="워크플로우 파일이 없습니다")
+    return WORKFLOW_TEMPLATE
+
+
 async def periodic_cleanup():
     """주기적으로 오래된 파일 삭제"""
     while True:
         await asyncio.sleep(1800)  # 30분
-        cleanup_old_files(OUTPUT_DIR)
-        cleanup_old_files(UPLOAD_DIR)
+        await asyncio.to_thread(cleanup_old_files, OUTPUT_DIR)
+        await asyncio.to_thread(cleanup_old_files, UPLOAD_DIR)
 
 
 # ============================================
@@ -138,13 +185,14 @@ class HealthResponse(BaseModel):
 @app.on_event("startup")
 async def startup_event():
     """서버 시작 시 초기화"""
+    global WORKFLOW_TEMPLATE
     print(f"MMAudio API 시작...")
     print(f"ComfyUI URL: {COMFYUI_URL}")
     print(f"Workflow Path: {WORKFLOW_PATH}")
     
     # 오래된 파일 정리
-    cleanup_old_files(OUTPUT_DIR)
-    cleanup_old_files(UPLOAD_DIR)
+    await asyncio.to_thread(cleanup_old_files, OUTPUT_DIR)
+    await asyncio.to_thread(cleanup_old_files, UPLOAD_DIR)
     
     # 백그라운드 정리 태스크
     asyncio.create_task(periodic_cleanup())
@@ -152,11 +200,18 @@ async def startup_event():
     
     # 워크플로우 파일 확인
     if os.path.exists(WORKFLOW_PATH):
+        WORKFLOW_TEMPLATE = client.load_workflow(WORKFLOW_PATH)
         print(f"워크플로우 파일 확인됨: {WORKFLOW_PATH}")
     else:
         print(f"경고: 워크플로우 파일이 없습니다: {WORKFLOW_PATH}")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """서버 종료 시 ComfyUI HTTP 연결 정리"""
+    await client.aclose()
+
+
 # ============================================
 # API 엔드포인트
 # ============================================
@@ -182,11 +237,9 @@ async def health_check():
     """헬스 체크"""
     comfyui_ok = False
     try:
-        import httpx
-        async with httpx.AsyncClient(timeout=5.0) as http_client:
-            response = await http_client.get(f"{COMFYUI_URL}/system_stats")
-            comfyui_ok = response.status_code == 200
-    except:
+        response = await client.http.get("/system_stats", timeout=5.0)
+        comfyui_ok = response.status_code == 200
+    except (httpx.HTTPError, asyncio.TimeoutError):
         pass
     
     return HealthResponse(
@@ -204,13 +257,11 @@ async def upload_video(
     """비디오 파일 업로드"""
     try:
         ext = os.path.splitext(video.filename)[1] or ".mp4"
-        unique_id = str(uuid.uuid4())[:8]
+        unique_id = token_hex(4)
         filename = f"mmaudio_video_{unique_id}{ext}"
         filepath = os.path.join(UPLOAD_DIR, filename)
         
-        with open(filepath, "wb") as f:
-            content = await video.read()
-            f.write(content)
+        await save_upload(video, filepath)
         
         # ComfyUI에도 업로드
         try:
@@ -249,13 +300,9 @@ async def generate_audio_form(
     
     try:
         # 워크플로우 로드
-        if not os.path.exists(WORKFLOW_PATH):
-            log(f"워크플로우 파일 없음: {WORKFLOW_PATH}", "ERROR")
-            raise HTTPException(status_code=500, detail="워크플로우 파일이 없습니다")
-        
-        workflow = client.load_workflow(WORKFLOW_PATH)
+        workflow = get_workflow()
         
-        unique_id = str(uuid.uuid4())[:8]
+        unique_id = token_hex(4)
         log(f"작업 ID: {unique_id}")
         
         # 비디오 저장 및 업로드
@@ -264,12 +311,8 @@ async def generate_audio_form(
         video_filename = f"mmaudio_{unique_id}{video_ext}"
         video_path = os.path.join(UPLOAD_DIR, video_filename)
         
-        video_content = await video.read()
-        video_size = len(video_content) / (1024 * 1024)  # MB
+        video_size = await save_upload(video, video_path) / (1024 * 1024)  # MB
         log(f"비디오 크기: {video_size:.2f}MB")
-        
-        with open(video_path, "wb") as f:
-            f.write(video_content)
         log(f"로컬 저장 완료: {video_path}")
         
         log("2단계: ComfyUI 서버에 업로드 중...")
@@ -285,7 +328,8 @@ async def generate_audio_form(
         
         # 실행
         log("4단계: ComfyUI 워크플로우 실행 중...")
-        result = await client.execute_workflow(workflow, timeout=1800)
+        async with COMFY_SEM:
+            result = await client.execute_workflow(workflow, timeout=1800)
         
         # 결과 비디오 가져오기 (오디오가 합쳐진 비디오)
         log("5단계: 결과 비디오 다운로드 중...")
@@ -315,12 +359,12 @@ async def generate_audio_form(
         log(f"다운로드 완료: {output_size:.2f}MB")
         
         # 로컬에 저장
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        timestamp = time.strftime("%Y%m%d_%H%M%S")
         output_filename = f"mmaudio_{timestamp}_{unique_id}.mp4"
         output_path = os.path.join(OUTPUT_DIR, output_filename)
         
-        with open(output_path, "wb") as f:
-            f.write(vid_bytes)
+        async with aiofiles.open(output_path, "wb") as f:
+            await f.write(vid_bytes)
         
         processing_time = time.time() - start_time
         
@@ -357,10 +401,7 @@ async def generate_audio_json(request: MMAudioRequest):
     
     try:
         # 워크플로우 로드
-        if not os.path.exists(WORKFLOW_PATH):
-            raise HTTPException(status_code=500, detail="워크플로우 파일이 없습니다")
-        
-        workflow = client.load_workflow(WORKFLOW_PATH)
+        workflow = get_workflow()
         
         # 워크플로우 업데이트
         workflow = client.update_mmaudio_workflow(
@@ -370,7 +411,8 @@ async def generate_audio_json(request: MMAudioRequest):
         )
         
         # 실행
-        result = await client.execute_workflow(workflow, timeout=1800)
+        async with COMFY_SEM:
+            result = await client.execute_workflow(workflow, timeout=1800)
         
         # 결과 처리
         outputs = result.get("outputs", {})
@@ -392,13 +434,13 @@ async def generate_audio_json(request: MMAudioRequest):
             vid_info.get("type", "output")
         )
         
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        unique_id = str(uuid.uuid4())[:8]
+        timestamp = time.strftime("%Y%m%d_%H%M%S")
+        unique_id = token_hex(4)
         output_filename = f"mmaudio_{timestamp}_{unique_id}.mp4"
         output_path = os.path.join(OUTPUT_DIR, output_filename)
         
-        with open(output_path, "wb") as f:
-            f.write(vid_bytes)
+        async with aiofiles.open(output_path, "wb") as f:
+            await f.write(vid_bytes)
         
         processing_time = time.time() - start_time
         
@@ -422,13 +464,17 @@ async def get_output(filename: str):
     """결과 영상 다운로드"""
     filepath = os.path.join(OUTPUT_DIR, filename)
     
-    if not os.path.exists(filepath):
+    try:
+        stat_result = os.stat(filepath)
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail="파일을 찾을 수 없습니다")
     
+    # stat 결과를 넘겨 FileResponse의 중복 stat 생략
     return FileResponse(
         filepath,
         media_type="video/mp4",
-        filename=filename
+        filename=filename,
+        stat_result=stat_result
     )
 
 
@@ -447,15 +493,7 @@ async def delete_output(filename: str):
 @app.get("/outputs", tags=["Output"])
 async def list_outputs():
     """결과 영상 목록"""
-    files = []
-    for f in Path(OUTPUT_DIR).glob("*.mp4"):
-        if f.is_file():
-            files.append({
-                "filename": f.name,
-                "size_mb": round(f.stat().st_size / (1024 * 1024), 2),
-                "created": datetime.fromtimestamp(f.stat().st_ctime).isoformat()
-            })
-    files.sort(key=lambda x: x["created"], reverse=True)
+    files = await asyncio.to_thread(list_files, OUTPUT_DIR, ".mp4")
     return {"files": files, "count": len(files)}
 
 
@@ -492,12 +530,9 @@ async def session_generate_audio(request: SessionMMAudioRequest):
             raise HTTPException(status_code=404, detail=f"비디오 파일을 찾을 수 없습니다: {request.video_filename}")
         
         # 워크플로우 로드
-        if not os.path.exists(WORKFLOW_PATH):
-            raise HTTPException(status_code=500, detail="워크플로우 파일이 없습니다")
-        
-        workflow = client.load_workflow(WORKFLOW_PATH)
+        workflow = get_workflow()
         
-        unique_id = str(uuid.uuid4())[:8]
+        unique_id = token_hex(4)
         
         # ComfyUI에 업로드 (세션 폴더에서)
         comfy_video_name = f"session_{request.session_id}_{request.video_filename}"
@@ -511,7 +546,8 @@ async def session_generate_audio(request: SessionMMAudioRequest):
         )
         
         # 실행
-        result = await client.execute_workflow(workflow, timeout=1800)
+        async with COMFY_SEM:
+            result = await client.execute_workflow(workflow, timeout=1800)
         
         # 결과 비디오 가져오기
         outputs = result.get("outputs", {})
@@ -538,8 +574,8 @@ async def session_generate_audio(request: SessionMMAudioRequest):
             output_filename += ".mp4"
         output_path = os.path.join(session_dir, output_filename)
         
-        with open(output_path, "wb") as f:
-            f.write(vid_bytes)
+        async with aiofiles.open(output_path, "wb") as f:
+            await f.write(vid_bytes)
         
         processing_time = time.time() - start_time
         
@@ -565,19 +601,11 @@ async def list_session_files(session_id: str):
     """세션 폴더 내 파일 목록 조회"""
     session_dir = os.path.join(SHARED_DIR, session_id)
     
-    if not os.path.exists(session_dir):
+    try:
+        files = await asyncio.to_thread(list_files, session_dir)
+    except FileNotFoundError:
         return {"session_id": session_id, "files": [], "count": 0, "exists": False}
     
-    files = []
-    for f in Path(session_dir).glob("*"):
-        if f.is_file():
-            files.append({
-                "filename": f.name,
-                "size_mb": round(f.stat().st_size / (1024 * 1024), 2),
-                "created": datetime.fromtimestamp(f.stat().st_ctime).isoformat()
-            })
-    files.sort(key=lambda x: x["created"], reverse=True)
-    
     return {"session_id": session_id, "files": files, "count": len(files), "exists": True}
 
 